@@ -0,0 +1,198 @@
+"""Time tracker.py's data paths and compare them against a stored baseline.
+
+It runs against the storage backend set in secrets; with ``backend =
+"sqlite"`` no server is needed. Seed a local database first (see seed.py,
+or import a CSV into the SQLite file), then:
+
+    python benchmark.py --output results.json --baseline baseline.json
+    python benchmark.py --save-baseline baseline.json
+
+Every case runs with the query cache cleared beforehand, so it measures the
+database and Python work rather than a cache hit. Cases:
+
+* get_categories, and get_expenses as the app calls it for each sidebar period
+  (the recent list and a transactions page);
+* the Analytics aggregations for each period: summary, trend, comparison;
+* chart building for each period, with data already fetched;
+* full page renders through Streamlit's AppTest.
+
+A case regresses when its median is more than --threshold slower than the
+baseline's and by more than --min-delta; any regression makes the exit
+status 1.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timezone
+
+import streamlit as st
+
+from db import get_query_cache
+from explain_check import period_ranges
+from startup_benchmark import TRACKER, PAGES
+from storage import get_storage
+
+
+def timed(func, repeat, setup=None):
+    """Run func repeat times after one untimed warm-up; returns wall times in seconds."""
+    times = []
+    for run in range(repeat + 1):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        if run:
+            times.append(time.perf_counter() - started)
+    return times
+
+
+def data_cases(store, today):
+    yield "get_categories", store.get_categories
+    yield "get_expenses (recent 8)", lambda: store.get_expenses(limit=8)
+    for period, (start_date, end_date) in period_ranges(today).items():
+        yield f"get_expenses page ({period})", lambda s=start_date, e=end_date: store.get_expenses(s, e, limit=51)
+        yield f"get_expense_summary ({period})", lambda s=start_date, e=end_date: store.get_expense_summary(s, e)
+        yield f"get_spending_trend ({period})", lambda s=start_date, e=end_date: store.get_spending_trend(s, e)
+        if start_date and end_date:
+            yield (f"get_period_comparison ({period})",
+                   lambda s=start_date, e=end_date: store.get_period_comparison(s, e))
+
+
+def chart_cases(store, today):
+    import charts
+
+    builders = (charts.trend_traces, charts.category_donut_traces, charts.category_bar_traces,
+                charts.weekday_traces)
+    for period, (start_date, end_date) in period_ranges(today).items():
+        def fetch(s=start_date, e=end_date):
+            store.get_expense_summary(s, e)
+            store.get_spending_trend(s, e)
+
+        def build(s=start_date, e=end_date):
+            for builder in builders:
+                # Unwrapped, so figures are rebuilt while their data stays cached
+                builder.__wrapped__(s, e)
+        yield f"charts ({period})", build, fetch
+
+
+def render_cases(today):
+    from streamlit.testing.v1 import AppTest
+
+    def render(page, period=None):
+        app = AppTest.from_file(TRACKER, default_timeout=300)
+        app.run()
+        if page != PAGES[0]:
+            app.sidebar.radio[0].set_value(page)
+        if period:
+            app.sidebar.selectbox[0].set_value(period)
+        if page != PAGES[0] or period:
+            app.run()
+        errors = list(app.exception) + list(app.error)
+        if errors:
+            raise RuntimeError(f"{page} ({period}) failed to render: {errors[0].value}")
+
+    for page in PAGES:
+        if page == "📊 Analytics":
+            for period in period_ranges(today):
+                yield f"render {page} ({period})", lambda p=page, q=period: render(p, q)
+        else:
+            yield f"render {page}", lambda p=page: render(p)
+
+
+def summarize(times):
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "max": max(times),
+        "runs": len(times),
+    }
+
+
+def compare(results, baseline, threshold, min_delta):
+    """Yield (name, ratio, regressed) for every case present in both."""
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base:
+            ratio = result["median"] / base["median"] if base["median"] else float("inf")
+            # Sub-millisecond cases jitter by more than any sensible threshold
+            yield name, ratio, ratio > 1 + threshold and result["median"] - base["median"] > min_delta
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case")
+    parser.add_argument("--skip-renders", action="store_true", help="leave out the AppTest page renders")
+    parser.add_argument("--output", metavar="FILE", help="write results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare against results saved earlier")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown that counts as a regression (default 0.2 = 20%%)")
+    parser.add_argument("--min-delta", type=float, default=1.0,
+                        help="ignore slowdowns smaller than this many milliseconds")
+    args = parser.parse_args()
+
+    store = get_storage()
+    store.ensure_schema()
+    summary = store.get_expense_summary()
+    if summary is None:
+        return 1
+    expenses = summary['totals']['count']
+
+    cache = get_query_cache()
+    today = date.today()
+    cases = [(name, func, cache.invalidate) for name, func in data_cases(store, today)]
+    cases += list(chart_cases(store, today))
+    if not args.skip_renders:
+        cases += [(name, func, cache.invalidate) for name, func in render_cases(today)]
+
+    results = {}
+    for name, func, setup in cases:
+        results[name] = summarize(timed(func, args.repeat, setup))
+        print(f"{name:<48} median {results[name]['median'] * 1000:8.1f} ms"
+              f"  min {results[name]['min'] * 1000:8.1f} ms", flush=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "backend": st.secrets.get("backend", "postgres"),
+            "expenses": expenses,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+        },
+        "results": results,
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as out:
+            json.dump(report, out, indent=2)
+
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("backend", "postgres") != report["meta"]["backend"]:
+            print(f"note: baseline ran on {baseline['meta'].get('backend', 'postgres')}, "
+                  f"this run on {report['meta']['backend']}")
+        if baseline["meta"].get("expenses") != expenses:
+            print(f"note: baseline has {baseline['meta'].get('expenses'):,} expenses, this run {expenses:,}")
+        print(f"\nAgainst baseline {baseline['meta'].get('commit') or ''} ({baseline['meta']['timestamp']}):")
+        for name, ratio, slower in compare(results, baseline["results"], args.threshold, args.min_delta / 1000):
+            regressed = regressed or slower
+            print(f"{'SLOWER' if slower else 'ok    '}  {name:<48} {ratio:6.2f}x")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
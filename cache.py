@@ -0,0 +1,82 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from instrumentation import span
+
+
+# In-memory result cache for read queries, shared by every session in the process.
+# Writers call invalidate() after committing, which bumps the data version and
+# drops every entry, so a read never returns rows from before a local write.
+class QueryCache:
+    def __init__(self, maxsize=256, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = 0
+        self._entries = OrderedDict()  # key -> (expires at, value)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        """Return (found, value) and refresh the entry's LRU position on a hit."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self._stats['misses'] += 1
+            return False, None
+
+    def put(self, key, value, version):
+        with self._lock:
+            # A write committed while this result was being read; it may be stale
+            if version != self.version:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, version=self.version, size=len(self._entries), maxsize=self.maxsize)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+def cached(get_cache, should_store=lambda: True):
+    """Memoize a read function in the cache returned by get_cache().
+
+    Results are shared between callers, so treat them as read-only.
+    should_store() is checked after each call so failed reads aren't kept.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(func.__name__) as timing:
+                cache = get_cache()
+                key = (func.__name__, args, tuple(sorted(kwargs.items())))
+                found, value = cache.get(key)
+                if timing is not None:
+                    timing['cache'] = 'hit' if found else 'miss'
+                if found:
+                    return value
+                version = cache.version
+                value = func(*args, **kwargs)
+                if should_store():
+                    cache.put(key, value, version)
+                return value
+        return wrapper
+    return decorator
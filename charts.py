@@ -0,0 +1,204 @@
+"""Plotly figures for the Analytics page.
+
+Figures are memoized in the query cache, so they share its invalidation: a
+write bumps the data version and every figure is rebuilt from fresh data on
+next use. Each chart is built in two steps, both cached:
+
+* ``*_traces(start_date, end_date)`` holds the data traces and the
+  theme-neutral layout. The bucket granularity is derived from the range
+  and the data, so the period fully determines it.
+* ``*_figure(start_date, end_date, theme)`` copies that and applies the
+  theme colors, so toggling the theme never re-reads or re-buckets data.
+
+Figures are shared between sessions; treat them as read-only.
+"""
+import pandas as pd
+import plotly.graph_objects as go
+
+from cache import cached
+from db import get_query_cache, _checkout_succeeded
+from storage import get_storage
+
+CHART_THEMES = {
+    'dark': {'text': '#ffffff', 'grid': '#404040'},
+    'light': {'text': '#1a1a1a', 'grid': '#e9ecef'},
+}
+
+GRANULARITY_TITLES = {'day': 'Date', 'week': 'Week', 'month': 'Month', 'quarter': 'Quarter'}
+GRANULARITY_NAMES = {'day': 'Daily', 'week': 'Weekly', 'month': 'Monthly', 'quarter': 'Quarterly'}
+DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def _themed(figure, theme, **axes):
+    """Copy of a cached figure with the theme's colors applied."""
+    colors = CHART_THEMES[theme]
+    figure = go.Figure(figure)
+    figure.update_layout(
+        font=dict(family='Inter', size=12, color=colors['text']),
+        legend=dict(font=dict(color=colors['text'])),
+    )
+    for axis, gridded in axes.items():
+        figure.update_layout({axis: dict(color=colors['text'], gridcolor=colors['grid'] if gridded else None)})
+    return figure
+
+
+def _trend_labels(dates, granularity):
+    if granularity == 'quarter':
+        return "Q" + dates.dt.quarter.astype(str) + " " + dates.dt.year.astype(str)
+    if granularity == 'month':
+        return dates.dt.strftime('%b %Y')
+    if granularity == 'week':
+        return dates.dt.strftime('Week of %b %d, %Y')
+    if len(dates) and (dates.max() - dates.min()).days <= 7:
+        return dates.dt.strftime('%a, %b %d')
+    if dates.dt.year.nunique() <= 1:
+        return dates.dt.strftime('%b %d')
+    return dates.dt.strftime('%b %d, %Y')
+
+
+@cached(get_query_cache, _checkout_succeeded)
+def trend_traces(start_date=None, end_date=None):
+    trend = get_storage().get_spending_trend(start_date, end_date) or {'granularity': 'day', 'points': [], 'downsampled': False}
+    granularity = trend['granularity']
+    points = pd.DataFrame(trend['points'], columns=['date', 'amount'])
+    points['date'] = pd.to_datetime(points['date'])
+    labels = _trend_labels(points['date'], granularity)
+
+    figure = go.Figure()
+    figure.add_trace(go.Scatter(
+        x=labels,
+        y=points['amount'],
+        mode='lines+markers' if len(points) <= 31 else 'lines',
+        name=f"{GRANULARITY_NAMES[granularity]} Spending",
+        line=dict(color='#667eea', width=3),
+        marker=dict(size=8, color='#667eea'),
+        fill='tozeroy',
+        fillcolor='rgba(102, 126, 234, 0.15)',
+        hovertemplate='<b>%{x}</b><br>₹%{y:,.2f}<extra></extra>'
+    ))
+
+    # Add moving average only if enough data points
+    if len(points) > 3:
+        figure.add_trace(go.Scatter(
+            x=labels,
+            y=points['amount'].rolling(window=3, min_periods=1).mean(),
+            mode='lines',
+            name='3-Period Average',
+            line=dict(color='#FF6B6B', width=2, dash='dash'),
+            hovertemplate='<b>%{x}</b><br>Avg: ₹%{y:,.2f}<extra></extra>'
+        ))
+
+    figure.update_layout(
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        xaxis=dict(showgrid=True, title=GRANULARITY_TITLES[granularity], tickangle=-45 if len(points) > 10 else 0),
+        yaxis=dict(showgrid=True, title='Amount (₹)'),
+        hovermode='x unified',
+        height=400,
+        margin=dict(l=20, r=20, t=20, b=80),
+        showlegend=True,
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+    )
+    return figure
+
+
+@cached(get_query_cache, _checkout_succeeded)
+def trend_figure(start_date=None, end_date=None, theme='dark'):
+    return _themed(trend_traces(start_date, end_date), theme, xaxis=True, yaxis=True)
+
+
+def _category_data(start_date, end_date):
+    summary = get_storage().get_expense_summary(start_date, end_date)
+    return pd.DataFrame(summary['by_category'] if summary else [],
+                        columns=['category_name', 'color', 'icon', 'amount'])
+
+
+@cached(get_query_cache, _checkout_succeeded)
+def category_donut_traces(start_date=None, end_date=None):
+    category_data = _category_data(start_date, end_date)
+    figure = go.Figure(data=[go.Pie(
+        labels=category_data['category_name'],
+        values=category_data['amount'],
+        hole=0.5,
+        marker=dict(colors=category_data['color']),
+        textposition='inside',
+        textinfo='percent',
+        hovertemplate='<b>%{label}</b><br>₹%{value:,.2f}<br>%{percent}<extra></extra>'
+    )])
+    figure.update_layout(
+        showlegend=True,
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        height=350,
+        margin=dict(l=20, r=20, t=20, b=20),
+    )
+    return figure
+
+
+@cached(get_query_cache, _checkout_succeeded)
+def category_donut_figure(start_date=None, end_date=None, theme='dark'):
+    return _themed(category_donut_traces(start_date, end_date), theme)
+
+
+@cached(get_query_cache, _checkout_succeeded)
+def category_bar_traces(start_date=None, end_date=None):
+    category_data = _category_data(start_date, end_date)
+    figure = go.Figure(go.Bar(
+        y=category_data['category_name'],
+        x=category_data['amount'],
+        orientation='h',
+        marker=dict(color=category_data['color']),
+        text=[f'₹{amount:,.0f}' for amount in category_data['amount']],
+        textposition='outside',
+        hovertemplate='<b>%{y}</b><br>₹%{x:,.2f}<extra></extra>'
+    ))
+    figure.update_layout(
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        xaxis=dict(showgrid=True, title='Amount (₹)'),
+        yaxis=dict(showgrid=False, title=''),
+        height=350,
+        margin=dict(l=20, r=20, t=20, b=20)
+    )
+    return figure
+
+
+@cached(get_query_cache, _checkout_succeeded)
+def category_bar_figure(start_date=None, end_date=None, theme='dark'):
+    return _themed(category_bar_traces(start_date, end_date), theme, xaxis=True, yaxis=False)
+
+
+@cached(get_query_cache, _checkout_succeeded)
+def weekday_traces(start_date=None, end_date=None):
+    summary = get_storage().get_expense_summary(start_date, end_date)
+    dow_expenses = pd.Series(
+        {DAY_ORDER[row['weekday'] - 1]: row['amount'] for row in (summary['by_weekday'] if summary else [])},
+        dtype=float
+    ).reindex(DAY_ORDER, fill_value=0)
+
+    figure = go.Figure(go.Bar(
+        x=dow_expenses.index,
+        y=dow_expenses.values,
+        marker=dict(
+            color=dow_expenses.values,
+            colorscale='Purples',
+            showscale=False
+        ),
+        text=[f'₹{val:.0f}' for val in dow_expenses.values],
+        textposition='outside',
+        hovertemplate='<b>%{x}</b><br>₹%{y:,.2f}<extra></extra>'
+    ))
+    figure.update_layout(
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        xaxis=dict(showgrid=False, title=''),
+        yaxis=dict(showgrid=True, title='Amount (₹)'),
+        height=300,
+        margin=dict(l=20, r=20, t=20, b=20)
+    )
+    return figure
+
+
+@cached(get_query_cache, _checkout_succeeded)
+def weekday_figure(start_date=None, end_date=None, theme='dark'):
+    return _themed(weekday_traces(start_date, end_date), theme, xaxis=False, yaxis=True)
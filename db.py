@@ -0,0 +1,775 @@
+import functools
+import logging
+import select
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+import streamlit as st
+import psycopg2
+from psycopg2 import OperationalError, InterfaceError, IntegrityError
+from psycopg2.extras import DictCursor
+
+from cache import QueryCache, cached
+from instrumentation import InstrumentedConnection, span
+from listener import ChangeListener
+from storage import Storage
+from trend import GRANULARITIES, choose_granularity, lttb
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(OperationalError):
+    """Raised when no connection frees up before the checkout timeout."""
+
+
+# Connection pool shared by every Streamlit session in the process
+class ConnectionPool:
+    def __init__(self, connect, minconn=1, maxconn=10, ping_interval=30.0, timeout=10.0):
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.ping_interval = ping_interval
+        self.timeout = timeout
+        self._idle = []  # (connection, last returned at)
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._stats = {'connects': 0, 'reconnects': 0, 'waits': 0, 'timeouts': 0, 'peak_in_use': 0}
+        for _ in range(minconn):
+            self._idle.append((self._new_connection(), time.monotonic()))
+
+    def _new_connection(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats['connects'] += 1
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        # An idle connection has nothing to read unless the server closed it
+        # (a restart or pg_terminate_backend sends a notice first); checking
+        # costs a system call, not a round trip
+        if select.select([conn], [], [], 0)[0]:
+            return False
+        # Only ping connections that sat idle long enough to have been dropped
+        # by a server restart or a proxy timeout
+        if time.monotonic() - last_used < self.ping_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (OperationalError, InterfaceError):
+            return False
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            waited = False
+            while not self._idle and self._in_use >= self.maxconn:
+                if not waited:
+                    waited = True
+                    self._stats['waits'] += 1
+                    logger.warning("Connection pool saturated (%d/%d in use), waiting", self._in_use, self.maxconn)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout:.0f}s")
+                self._cond.wait(remaining)
+            conn, last_used = self._idle.pop() if self._idle else (None, None)
+            self._in_use += 1
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._in_use)
+
+        try:
+            if conn is not None and not self._is_healthy(conn, last_used):
+                self._close(conn)
+                conn = None
+                with self._cond:
+                    self._stats['reconnects'] += 1
+            if conn is None:
+                conn = self._new_connection()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn):
+        if not conn.closed:
+            try:
+                # End whatever transaction the caller left open
+                conn.rollback()
+            except (OperationalError, InterfaceError):
+                self._close(conn)
+        with self._cond:
+            self._in_use -= 1
+            if not conn.closed:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                in_use=self._in_use,
+                idle=len(self._idle),
+                max=self.maxconn,
+                saturation=self._in_use / self.maxconn,
+            )
+        return stats
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _connect(**options):
+    """options are extra libpq connection parameters, e.g. keepalives."""
+    return psycopg2.connect(
+        host=st.secrets["host"],
+        database=st.secrets["db"],
+        user=st.secrets["user"],
+        password=st.secrets["password"],
+        port=st.secrets["port"],
+        sslmode=st.secrets.get("sslmode", "require"),
+        connection_factory=InstrumentedConnection,
+        **options,
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_pool():
+    return ConnectionPool(
+        _connect,
+        minconn=int(st.secrets.get("pool_min", 1)),
+        maxconn=int(st.secrets.get("pool_max", 10)),
+        ping_interval=float(st.secrets.get("pool_ping_interval", 30)),
+        timeout=float(st.secrets.get("pool_timeout", 10)),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_query_cache():
+    cache = QueryCache(
+        maxsize=int(st.secrets.get("cache_max_entries", 256)),
+        ttl=float(st.secrets.get("cache_ttl", 300)),
+    )
+    # Other workers' writes arrive over LISTEN/NOTIFY (see listener.py)
+    if st.secrets.get("backend", "postgres") == 'postgres' and st.secrets.get("listen_for_changes", True):
+        ChangeListener(_connect, lambda tables: cache.invalidate()).start()
+    return cache
+
+
+# Set when the current thread's last checkout failed, so the empty fallback
+# result of a read isn't cached as if it were real data
+_checkout = threading.local()
+
+def _checkout_succeeded():
+    return not getattr(_checkout, 'failed', False)
+
+# Bump the data version after a commit so cached reads are recomputed
+def data_changed():
+    get_query_cache().invalidate()
+
+
+# Database connection (yields None when the database is unreachable)
+@contextmanager
+def get_connection():
+    try:
+        with span("db.checkout"):
+            pool = get_pool()
+            conn = pool.getconn()
+    except OperationalError as e:
+        _checkout.failed = True
+        st.error(f"Error connecting to PostgreSQL: {e}")
+        yield None
+        return
+    _checkout.failed = False
+    _checkout.lost = False
+    try:
+        yield conn
+    except (OperationalError, InterfaceError):
+        # The connection died under the caller; the idle ones most likely went
+        # with it (a server restart), so open fresh ones from here on
+        if conn.closed:
+            _checkout.lost = True
+            pool.closeall()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def reconnecting(func):
+    """Run a read once more if its connection turned out to be dead, e.g. after a server restart."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except (OperationalError, InterfaceError):
+            if not getattr(_checkout, 'lost', False):
+                raise
+            logger.warning("Database connection lost during %s, retrying on a new one", func.__name__)
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# Shown by every backend when add_category() hits the unique name
+DUPLICATE_CATEGORY = "A category named '{name}' already exists"
+
+def add_category(name, color, icon):
+    with get_connection() as conn:
+        if conn:
+            cursor = conn.cursor(cursor_factory=DictCursor)
+            try:
+                cursor.execute("INSERT INTO categories (name, color, icon) VALUES (%s, %s, %s)", (name, color, icon))
+                conn.commit()
+                data_changed()
+                return True
+            except IntegrityError:
+                st.error(DUPLICATE_CATEGORY.format(name=name))
+                return False
+            except OperationalError as e:
+                st.error(f"Error: {e}")
+                return False
+            finally:
+                cursor.close()
+
+@cached(get_query_cache, _checkout_succeeded)
+@reconnecting
+def get_categories():
+    with get_connection() as conn:
+        if conn:
+            cursor = conn.cursor(cursor_factory=DictCursor)
+            cursor.execute("SELECT * FROM categories ORDER BY name")
+            categories = cursor.fetchall()
+
+            # Convert RealDictRow to plain dict
+            categories = [dict(row) for row in categories]
+
+            cursor.close()
+            return categories
+    return []
+
+def add_expense(amount, category_id, note, expense_date):
+    with get_connection() as conn:
+        if conn:
+            cursor = conn.cursor(cursor_factory=DictCursor)
+            try:
+                cursor.execute("""
+                    INSERT INTO expenses (amount, category_id, note, expense_date)
+                    VALUES (%s, %s, %s, %s)
+                """, (amount, category_id, note, expense_date))
+                conn.commit()
+                data_changed()
+                return True
+            except OperationalError as e:
+                st.error(f"Error: {e}")
+                return False
+            finally:
+                cursor.close()
+
+# Query builders are shared with explain_check.py so the plans it checks
+# are the ones the app actually runs
+
+# Sort orders for expense listings: key columns (ending in id, so the order
+# is total) and direction. Each one has an index that returns rows in order.
+EXPENSE_ORDERS = {
+    'newest': (('expense_date', 'created_at', 'id'), 'DESC'),
+    'oldest': (('expense_date', 'created_at', 'id'), 'ASC'),
+    'largest': (('amount', 'id'), 'DESC'),
+    'smallest': (('amount', 'id'), 'ASC'),
+}
+
+def expenses_query(start_date=None, end_date=None, limit=None, after=None, order='newest', category_id=None,
+                   amount=None, note=None):
+    # Rows are found and ordered by expenses_date_id_idx; only the page's notes come from the heap
+    query = """
+        SELECT e.id, e.amount, e.category_id, e.note, e.expense_date, e.created_at,
+               c.name as category_name, c.color, c.icon
+        FROM expenses e
+        LEFT JOIN categories c ON e.category_id = c.id
+    """
+    columns, direction = EXPENSE_ORDERS[order]
+    key = ", ".join(f"e.{column}" for column in columns)
+    conditions, params = [], []
+
+    if start_date and end_date:
+        conditions.append("e.expense_date BETWEEN %s AND %s")
+        params += [start_date, end_date]
+    if category_id is not None:
+        conditions.append("e.category_id = %s")
+        params.append(category_id)
+    if amount is not None:
+        conditions.append("e.amount = %s")
+        params.append(amount)
+    if note:
+        # Substring match; LIKE wildcards typed by the user are taken literally
+        conditions.append("e.note ILIKE %s")
+        params.append("%" + note.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    # Keyset pagination: resume strictly after the last row of the previous page
+    if after:
+        placeholders = ", ".join(["%s"] * len(columns))
+        conditions.append(f"({key}) {'<' if direction == 'DESC' else '>'} ({placeholders})")
+        params += list(after)
+
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY " + ", ".join(f"e.{column} {direction}" for column in columns)
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+def expense_cursor(expense, order='newest'):
+    """Keyset cursor for get_expenses(after=...) that continues past this row:
+    a dict, or a row of get_expenses(as_frame=True)."""
+    return tuple(_cursor_value(expense[column]) for column in EXPENSE_ORDERS[order][0])
+
+def _cursor_value(value):
+    # Frame rows hold numpy scalars, which the drivers can't bind, and
+    # Timestamps, which only the datetime64 expense_date column produces
+    if hasattr(value, 'to_pydatetime'):
+        return value.date()
+    return value.item() if hasattr(value, 'item') else value
+
+def empty_frame():
+    """What as_frame fetches return when the database is unavailable."""
+    from frames import typed_frame
+    return typed_frame([], [])
+
+@cached(get_query_cache, _checkout_succeeded)
+@reconnecting
+def get_expenses(start_date=None, end_date=None, limit=None, after=None, order='newest', category_id=None,
+                 amount=None, note=None, as_frame=False):
+    with get_connection() as conn:
+        if conn:
+            query = expenses_query(start_date, end_date, limit, after, order, category_id, amount, note)
+            if as_frame:
+                from frames import copy_frame
+                cursor = conn.cursor()
+                expenses = copy_frame(cursor, *query)
+                cursor.close()
+                return expenses
+
+            cursor = conn.cursor(cursor_factory=DictCursor)
+            cursor.execute(*query)
+            expenses = cursor.fetchall()
+
+            expenses = [dict(row) for row in expenses]
+
+            cursor.close()
+            return expenses
+    return empty_frame() if as_frame else []
+
+def get_top_expenses(start_date=None, end_date=None, n=5):
+    """The period's n largest expenses, read straight off expenses_amount_idx."""
+    return get_expenses(start_date, end_date, limit=n, order='largest')
+
+def top_by_category_query(start_date=None, end_date=None, n=3):
+    # One index probe per category instead of ranking every expense in the
+    # period: the LATERAL subquery stops after n rows of expenses_category_amount_idx
+    period = " AND e.expense_date BETWEEN %s AND %s" if start_date and end_date else ""
+    query = f"""
+        SELECT c.id AS category_id, c.name AS category_name, c.color, c.icon,
+               t.id, t.amount, t.note, t.expense_date, t.created_at, t.rank
+        FROM categories c
+        CROSS JOIN LATERAL (
+            SELECT e.id, e.amount, e.note, e.expense_date, e.created_at,
+                   row_number() OVER (ORDER BY e.amount DESC, e.id DESC) AS rank
+            FROM expenses e
+            WHERE e.category_id = c.id{period}
+            ORDER BY e.amount DESC, e.id DESC
+            LIMIT %s
+        ) t
+        ORDER BY c.name, t.rank
+    """
+    return query, ([start_date, end_date] if period else []) + [n]
+
+@cached(get_query_cache, _checkout_succeeded)
+@reconnecting
+def get_top_expenses_by_category(start_date=None, end_date=None, n=3, as_frame=False):
+    with get_connection() as conn:
+        if conn:
+            query = top_by_category_query(start_date, end_date, n)
+            if as_frame:
+                from frames import copy_frame
+                cursor = conn.cursor()
+                rows = copy_frame(cursor, *query)
+                cursor.close()
+                return rows
+
+            cursor = conn.cursor(cursor_factory=DictCursor)
+            cursor.execute(*query)
+            rows = [dict(row) for row in cursor.fetchall()]
+            cursor.close()
+            return rows
+    return empty_frame() if as_frame else []
+
+# Must match the expression expenses_note_fts_idx was built on
+NOTE_TSVECTOR = "to_tsvector('english', coalesce(e.note, ''))"
+TRIGRAM_CHECK_SQL = "SELECT exists(SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"
+
+def note_search_query(text, start_date=None, end_date=None, limit=20, offset=0, fuzzy=True):
+    """Ranked search of expense notes within a period.
+
+    Full-text matches find word forms ("pizzas" finds "Pizza Hut"); with
+    fuzzy, trigram word similarity also finds typos ("piza"). Exact word
+    matches score above 1, so they always rank ahead of typo matches.
+    """
+    tsquery = "websearch_to_tsquery('english', %s)"
+    score, score_params = f"ts_rank({NOTE_TSVECTOR}, {tsquery})", [text]
+    match, match_params = f"{NOTE_TSVECTOR} @@ {tsquery}", [text]
+    if fuzzy:
+        score, score_params = f"word_similarity(%s, e.note) + {score}", [text] + score_params
+        match, match_params = f"({match} OR %s <%% e.note)", match_params + [text]
+
+    query = f"""
+        SELECT e.id, e.amount, e.category_id, e.note, e.expense_date, e.created_at,
+               c.name as category_name, c.color, c.icon, {score} AS rank
+        FROM expenses e
+        LEFT JOIN categories c ON e.category_id = c.id
+        WHERE {match}
+    """
+    params = score_params + match_params
+    if start_date and end_date:
+        query += " AND e.expense_date BETWEEN %s AND %s"
+        params += [start_date, end_date]
+    query += " ORDER BY rank DESC, e.expense_date DESC, e.id DESC LIMIT %s OFFSET %s"
+    return query, params + [limit, offset]
+
+@cached(get_query_cache, _checkout_succeeded)
+@reconnecting
+def fuzzy_search_available():
+    with get_connection() as conn:
+        if conn:
+            cursor = conn.cursor()
+            cursor.execute(TRIGRAM_CHECK_SQL)
+            available = cursor.fetchone()[0]
+            cursor.close()
+            return available
+    return False
+
+@cached(get_query_cache, _checkout_succeeded)
+@reconnecting
+def search_notes(text, start_date=None, end_date=None, limit=20, offset=0, as_frame=False):
+    fuzzy = fuzzy_search_available()
+    with get_connection() as conn:
+        if conn:
+            query = note_search_query(text, start_date, end_date, limit, offset, fuzzy)
+            if as_frame:
+                from frames import copy_frame
+                cursor = conn.cursor()
+                results = copy_frame(cursor, *query)
+                cursor.close()
+                return results
+
+            cursor = conn.cursor(cursor_factory=DictCursor)
+            cursor.execute(*query)
+            results = [dict(row) for row in cursor.fetchall()]
+            cursor.close()
+            return results
+    return empty_frame() if as_frame else []
+
+def period_filter(start_date=None, end_date=None, column='e.expense_date'):
+    if start_date and end_date:
+        return f" WHERE {column} BETWEEN %s AND %s", [start_date, end_date]
+    return "", []
+
+# Pre-reduced Analytics results; each query returns one row per bucket.
+# They read the daily_category_totals rollup, so their cost scales with
+# days x categories rather than with the number of expenses.
+def summary_queries(start_date=None, end_date=None):
+    where, params = period_filter(start_date, end_date, 'r.expense_date')
+    queries = {
+        'totals': """
+            SELECT coalesce(sum(r.count), 0)::int AS count,
+                   coalesce(sum(r.total), 0)::float8 AS total,
+                   coalesce(sum(r.total) / nullif(sum(r.count), 0), 0)::float8 AS average
+            FROM daily_category_totals r
+        """ + where,
+        'by_category': """
+            SELECT c.name AS category_name, c.color, c.icon, sum(r.total)::float8 AS amount
+            FROM daily_category_totals r
+            JOIN categories c ON r.category_id = c.id
+        """ + where + " GROUP BY c.id ORDER BY amount DESC",
+        # Re-bucketed from per-day totals like trend_query();
+        # ISO numbering: Monday = 1 ... Sunday = 7
+        'by_weekday': """
+            SELECT extract(isodow FROM d.date)::int AS weekday, sum(d.amount) AS amount
+            FROM (
+                SELECT r.expense_date AS date, sum(r.total)::float8 AS amount
+                FROM daily_category_totals r
+        """ + where + """
+                GROUP BY r.expense_date
+            ) d
+            GROUP BY 1 ORDER BY 1
+        """,
+    }
+    return {name: (query, params) for name, query in queries.items()}
+
+def trend_query(start_date=None, end_date=None, granularity='day'):
+    where, params = period_filter(start_date, end_date, 'r.expense_date')
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity {granularity!r}, expected one of {', '.join(GRANULARITIES)}")
+    # Re-bucket the per-day totals so the planner can walk the rollup's
+    # primary key in order instead of sorting every row by bucket
+    query = f"""
+        SELECT date_trunc('{granularity}', d.date)::date AS date, sum(d.amount) AS amount
+        FROM (
+            SELECT r.expense_date AS date, sum(r.total)::float8 AS amount
+            FROM daily_category_totals r
+    """ + where + """
+            GROUP BY r.expense_date
+        ) d
+        GROUP BY 1 ORDER BY 1
+    """
+    return query, params
+
+@cached(get_query_cache, _checkout_succeeded)
+@reconnecting
+def get_expense_summary(start_date=None, end_date=None):
+    with get_connection() as conn:
+        if conn:
+            cursor = conn.cursor(cursor_factory=DictCursor)
+            summary = {}
+            for name, (query, params) in summary_queries(start_date, end_date).items():
+                cursor.execute(query, params)
+                summary[name] = [dict(row) for row in cursor.fetchall()]
+            summary['totals'] = summary['totals'][0]
+            cursor.close()
+            return summary
+    return None
+
+@cached(get_query_cache, _checkout_succeeded)
+@reconnecting
+def get_spending_trend(start_date=None, end_date=None, max_points=90):
+    """Spending per bucket, with at most max_points points for any range.
+
+    Returns {'granularity', 'points', 'downsampled'}, or None if the database
+    is unreachable. For "All Time" the range is the span of the data.
+    """
+    with get_connection() as conn:
+        if conn:
+            cursor = conn.cursor(cursor_factory=DictCursor)
+            if not (start_date and end_date):
+                cursor.execute("SELECT min(expense_date), max(expense_date) FROM daily_category_totals")
+                first, last = cursor.fetchone()
+            else:
+                first, last = start_date, end_date
+            granularity = choose_granularity(first, last, max_points) if first else 'day'
+            cursor.execute(*trend_query(start_date, end_date, granularity))
+            points = [dict(row) for row in cursor.fetchall()]
+            cursor.close()
+
+            downsampled = len(points) > max_points
+            if downsampled:
+                x = [point['date'].toordinal() for point in points]
+                y = [point['amount'] for point in points]
+                points = [points[i] for i in lttb(x, y, max_points)]
+            return {'granularity': granularity, 'points': points, 'downsampled': downsampled}
+    return None
+
+@cached(get_query_cache, _checkout_succeeded)
+@reconnecting
+def get_daily_totals(start_date=None, end_date=None):
+    where, params = period_filter(start_date, end_date, 'r.expense_date')
+    with get_connection() as conn:
+        if conn:
+            cursor = conn.cursor(cursor_factory=DictCursor)
+            # The rollup trigger deletes buckets whose count drops to zero
+            cursor.execute("""
+                SELECT r.expense_date, c.name AS category_name,
+                       sum(r.count)::int AS count, sum(r.total)::float8 AS total
+                FROM daily_category_totals r
+                LEFT JOIN categories c ON r.category_id = c.id
+            """ + where + " GROUP BY 1, 2 ORDER BY 1, 2", params)
+            rows = [dict(row) for row in cursor.fetchall()]
+            cursor.close()
+            return rows
+    return None
+
+@cached(get_query_cache, _checkout_succeeded)
+@reconnecting
+def get_month_versions():
+    with get_connection() as conn:
+        if conn:
+            cursor = conn.cursor()
+            # Kept by triggers from migration 13, whichever process wrote
+            cursor.execute("SELECT to_char(month, 'YYYY-MM'), version FROM expense_month_versions")
+            versions = dict(cursor.fetchall())
+            cursor.close()
+            return versions
+    return None
+
+def previous_period(start_date, end_date):
+    # The same number of days, ending the day before start_date
+    days = (end_date - start_date).days + 1
+    return start_date - timedelta(days=days), start_date - timedelta(days=1)
+
+# Current vs previous period in one pass over the daily rollup: ROLLUP adds an overall row
+# (is_total = 1) after the per-category rows
+def comparison_query(start_date, end_date):
+    prev_start, _ = previous_period(start_date, end_date)
+    query = """
+        SELECT grouping(c.id) AS is_total,
+               c.name AS category_name, c.color, c.icon,
+               coalesce(sum(r.total) FILTER (WHERE r.expense_date >= %(start)s), 0)::float8 AS current_total,
+               coalesce(sum(r.count) FILTER (WHERE r.expense_date >= %(start)s), 0)::int AS current_count,
+               coalesce(sum(r.total) FILTER (WHERE r.expense_date < %(start)s), 0)::float8 AS previous_total,
+               coalesce(sum(r.count) FILTER (WHERE r.expense_date < %(start)s), 0)::int AS previous_count
+        FROM daily_category_totals r
+        LEFT JOIN categories c ON r.category_id = c.id
+        WHERE r.expense_date BETWEEN %(prev_start)s AND %(end)s
+        GROUP BY ROLLUP ((c.id, c.name, c.color, c.icon))
+        ORDER BY is_total, current_total DESC
+    """
+    return query, {'start': start_date, 'end': end_date, 'prev_start': prev_start}
+
+@cached(get_query_cache, _checkout_succeeded)
+@reconnecting
+def get_period_comparison(start_date, end_date):
+    with get_connection() as conn:
+        if conn:
+            cursor = conn.cursor(cursor_factory=DictCursor)
+            cursor.execute(*comparison_query(start_date, end_date))
+            rows = [dict(row) for row in cursor.fetchall()]
+            cursor.close()
+
+            totals = {'current_total': 0.0, 'current_count': 0, 'previous_total': 0.0, 'previous_count': 0}
+            categories = []
+            for row in rows:
+                if row.pop('is_total'):
+                    totals = row
+                else:
+                    row['change'] = row['current_total'] - row['previous_total']
+                    categories.append(row)
+            return {
+                'current': {'total': totals['current_total'], 'count': totals['current_count']},
+                'previous': {'total': totals['previous_total'], 'count': totals['previous_count']},
+                'categories': categories,
+            }
+    return None
+
+# How long deleted expenses stay in deleted_expenses, i.e. how long a delete can be undone
+UNDO_WINDOW = timedelta(minutes=10)
+
+# One statement moves the rows out of expenses (the rollup triggers see a
+# plain bulk delete) and into the trash, where restore_expenses() finds them
+DELETE_EXPENSES_SQL = """
+    WITH removed AS (
+        DELETE FROM expenses WHERE id = ANY(%s)
+        RETURNING id, amount, category_id, note, expense_date, created_at, import_hash
+    )
+    INSERT INTO deleted_expenses (id, amount, category_id, note, expense_date, created_at, import_hash)
+    SELECT * FROM removed
+    ON CONFLICT (id) DO NOTHING
+"""
+
+RESTORE_EXPENSES_SQL = """
+    WITH restored AS (
+        DELETE FROM deleted_expenses WHERE id = ANY(%s)
+        RETURNING id, amount, category_id, note, expense_date, created_at, import_hash
+    )
+    INSERT INTO expenses (id, amount, category_id, note, expense_date, created_at, import_hash)
+    SELECT * FROM restored
+    ON CONFLICT DO NOTHING
+"""
+
+def delete_expenses(expense_ids):
+    """Delete the given expenses in one transaction; returns how many were deleted.
+
+    They can be brought back with restore_expenses() for UNDO_WINDOW.
+    """
+    expense_ids = [int(expense_id) for expense_id in expense_ids]
+    if not expense_ids:
+        return 0
+    with get_connection() as conn:
+        if conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("DELETE FROM deleted_expenses WHERE deleted_at < now() - %s", (UNDO_WINDOW,))
+                cursor.execute(DELETE_EXPENSES_SQL, (expense_ids,))
+                deleted = cursor.rowcount
+                conn.commit()
+                data_changed()
+                return deleted
+            except OperationalError as e:
+                st.error(f"Error: {e}")
+                return 0
+            finally:
+                cursor.close()
+    return 0
+
+def restore_expenses(expense_ids):
+    """Undo delete_expenses(); returns how many expenses were restored."""
+    expense_ids = [int(expense_id) for expense_id in expense_ids]
+    if not expense_ids:
+        return 0
+    with get_connection() as conn:
+        if conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(RESTORE_EXPENSES_SQL, (expense_ids,))
+                restored = cursor.rowcount
+                conn.commit()
+                data_changed()
+                return restored
+            except OperationalError as e:
+                st.error(f"Error: {e}")
+                return 0
+            finally:
+                cursor.close()
+    return 0
+
+def delete_expense(expense_id):
+    return delete_expenses([expense_id])
+
+
+class PostgresStorage(Storage):
+    """The Storage backend for the server in secrets: this module's functions."""
+
+    def ensure_schema(self):
+        from migrations import ensure_schema
+        from maintenance import start_partition_maintenance
+        version = ensure_schema()
+        interval = float(st.secrets.get("partition_check_hours", 24)) * 3600
+        if version is not None and interval > 0:
+            start_partition_maintenance(interval)
+        return version
+
+    get_categories = staticmethod(get_categories)
+    add_category = staticmethod(add_category)
+    add_expense = staticmethod(add_expense)
+    get_expenses = staticmethod(get_expenses)
+    get_top_expenses = staticmethod(get_top_expenses)
+    get_top_expenses_by_category = staticmethod(get_top_expenses_by_category)
+    search_notes = staticmethod(search_notes)
+    get_expense_summary = staticmethod(get_expense_summary)
+    get_spending_trend = staticmethod(get_spending_trend)
+    get_period_comparison = staticmethod(get_period_comparison)
+    get_daily_totals = staticmethod(get_daily_totals)
+    get_month_versions = staticmethod(get_month_versions)
+    delete_expenses = staticmethod(delete_expenses)
+    restore_expenses = staticmethod(restore_expenses)
+    delete_expense = staticmethod(delete_expense)
+
+    def import_file(self, source, **options):
+        from importer import import_file
+        return import_file(source, **options)
+
+    def export_file(self, out, start_date=None, end_date=None, fmt='csv', chunk_size=50_000):
+        from exporter import export_file
+        return export_file(out, start_date, end_date, fmt, chunk_size)
@@ -0,0 +1,221 @@
+"""EXPLAIN every query the app issues and fail on plans that don't use indexes.
+
+Point .streamlit/secrets.toml at a local database, then:
+
+    python explain_check.py --seed 1000000
+
+A plan fails if it filters ``expenses`` or the ``daily_category_totals``
+rollup with a sequential scan, or sorts raw expense rows. Sorting an already-aggregated result is fine, and so is a full
+unfiltered scan for "All Time" aggregates, where reading every row is the job.
+A sort of a few days' worth of rows (e.g. "Today" by amount) is also allowed:
+fetching them by date and sorting beats walking the whole amount index.
+So is a sequential scan of a table (or a partition of ``expenses``) that the
+planner estimates is small, or whose filter keeps at least SEQ_SCAN_SHARE of
+its rows: fetching that many through an index would touch most of its pages
+anyway. Sorting what such scans return passes too, unless a LIMIT then keeps
+only a page of it, which an index should deliver in order. Everything is
+judged from the planner's own estimates, so the verdict depends on how
+selective each period is, not on the date the check runs. A "Today" that scans
+a whole busy month still fails.
+"""
+import argparse
+import json
+import re
+import sys
+from datetime import date, datetime, timedelta, timezone
+
+from psycopg2 import sql
+
+from db import (get_connection, expenses_query, EXPENSE_ORDERS, note_search_query, TRIGRAM_CHECK_SQL,
+                top_by_category_query, summary_queries, trend_query, comparison_query)
+from exporter import export_query
+from maintenance import create_partitions
+from migrations import migrate
+from trend import GRANULARITIES
+
+# Tables large enough that a filtering seq scan matters
+CHECKED_TABLES = ("expenses", "daily_category_totals")
+# Estimated input rows below which sorting expense rows is cheaper than an ordered index walk
+SMALL_SORT_ROWS = 10_000
+# Rows below which scanning a whole table costs about as much as an index probe
+SMALL_TABLE_ROWS = 1_000
+# Share of a table's rows a filter must keep for a sequential scan of it to pass
+SEQ_SCAN_SHARE = 0.2
+# Monthly partitions of expenses (migration 12) show up under their own names
+PARTITION_NAME = re.compile(r"expenses_(\d{4}_\d{2}|default)")
+TABLES_SQL = """
+    SELECT c.relname
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'expenses'::regclass
+    UNION ALL
+    SELECT 'daily_category_totals'
+"""
+
+SEED_SQL = """
+    INSERT INTO expenses (amount, category_id, note, expense_date, created_at)
+    SELECT round((random() * 2000)::numeric, 2),
+           (SELECT id FROM categories ORDER BY id OFFSET g %% (SELECT count(*) FROM categories) LIMIT 1),
+           'Seeded expense ' || g,
+           current_date - %(days)s + (g * %(days)s / %(rows)s),
+           now() - make_interval(days => %(days)s) + g * make_interval(secs => %(days)s * 86400.0 / %(rows)s)
+    FROM generate_series(1, %(rows)s) g
+"""
+
+
+def period_ranges(today):
+    # Same bounds the sidebar computes for each period
+    return {
+        "Today": (today, today),
+        "This Week": (today - timedelta(days=today.weekday()), today),
+        "This Month": (today.replace(day=1), today),
+        "This Year": (today.replace(month=1, day=1), today),
+        "Custom": (today - timedelta(days=30), today),
+        "All Time": (None, None),
+    }
+
+
+def app_queries(today, fuzzy=False):
+    yield "get_expenses (Recent Expenses)", expenses_query(limit=8)
+    # A cursor from the middle of the table stands in for "Older" pages
+    cursor = (today - timedelta(days=10), datetime.now(timezone.utc), 2 ** 31 - 1)
+    for period, (start_date, end_date) in period_ranges(today).items():
+        yield f"get_expenses ({period})", expenses_query(start_date, end_date)
+        yield f"get_expenses page ({period})", expenses_query(start_date, end_date, limit=51, after=cursor)
+        for order in EXPENSE_ORDERS:
+            yield f"transactions page, {order} ({period})", expenses_query(start_date, end_date, limit=51, order=order)
+        yield f"transactions page, category ({period})", expenses_query(start_date, end_date, limit=51, category_id=1)
+        yield f"delete search, amount ({period})", expenses_query(start_date, end_date, limit=101, amount=499.5)
+        yield f"top expenses ({period})", expenses_query(start_date, end_date, limit=5, order='largest')
+        yield f"top expenses by category ({period})", top_by_category_query(start_date, end_date, 3)
+        yield f"note search ({period})", note_search_query("pizza hut", start_date, end_date, limit=21, fuzzy=fuzzy)
+        yield f"export ({period})", export_query(start_date, end_date)
+        for name, query in summary_queries(start_date, end_date).items():
+            yield f"get_expense_summary.{name} ({period})", query
+        for granularity in GRANULARITIES:
+            yield f"get_spending_trend.{granularity} ({period})", trend_query(start_date, end_date, granularity)
+        if start_date and end_date:
+            yield f"get_period_comparison ({period})", comparison_query(start_date, end_date)
+
+
+def problems(plan, tables=None, limited=False):
+    """Yield a description of every offending node in an EXPLAIN (FORMAT JSON) plan.
+
+    tables maps each checked table to its estimated rows (see table_rows()).
+    limited is set below a Limit node.
+    """
+    tables = tables or {}
+    node_type = plan["Node Type"]
+    # Unfiltered scans (e.g. "All Time" aggregates) read the whole table anyway
+    if (node_type == "Seq Scan" and _table(plan) in CHECKED_TABLES and "Filter" in plan
+            and not _wide_scan(plan, tables)):
+        yield f"sequential scan filtering {plan['Relation Name']}"
+    if (node_type in ("Sort", "Incremental Sort") and _reads_raw_expenses(plan) and not _small_sort(plan)
+            and (limited or not _sorts_wide_scans(plan, tables))):
+        yield f"{node_type.lower()} on {', '.join(plan.get('Sort Key', []))}"
+    for child in plan.get("Plans", []):
+        yield from problems(child, tables, limited or node_type == "Limit")
+
+
+def _table(plan):
+    name = plan.get("Relation Name")
+    return "expenses" if name and PARTITION_NAME.fullmatch(name) else name
+
+
+def table_rows(cursor):
+    """{table: the planner's estimate of its rows} for the rollup and expenses' partitions.
+
+    Taken from an unfiltered EXPLAIN, so it is on the same footing as a
+    filtered scan's Plan Rows, even for a table that was never analyzed.
+    """
+    cursor.execute(TABLES_SQL)
+    rows = {}
+    for (name,) in cursor.fetchall():
+        cursor.execute(sql.SQL("EXPLAIN (FORMAT JSON) SELECT * FROM ONLY {}").format(sql.Identifier(name)))
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        rows[name] = plan[0]["Plan"]["Plan Rows"]
+    return rows
+
+
+def _wide_scan(plan, tables):
+    estimate = tables.get(plan["Relation Name"])
+    if estimate is None:
+        return False
+    # A parallel scan's Plan Rows is per worker, which only makes this stricter
+    return estimate < SMALL_TABLE_ROWS or plan["Plan Rows"] >= SEQ_SCAN_SHARE * estimate
+
+
+def _sorts_wide_scans(plan, tables):
+    """Whether every expenses scan below plan is a sequential scan that passes on its own."""
+    for child in plan.get("Plans", []):
+        if _table(child) == "expenses" and not (
+                child["Node Type"] == "Seq Scan" and ("Filter" not in child or _wide_scan(child, tables))):
+            return False
+        if not _sorts_wide_scans(child, tables):
+            return False
+    return True
+
+
+def _small_sort(plan):
+    return all(child["Plan Rows"] < SMALL_SORT_ROWS for child in plan.get("Plans", []))
+
+
+def _reads_raw_expenses(plan):
+    # The rollup's rows are already per-day buckets, so sorting them is fine
+    if _table(plan) == "expenses":
+        return True
+    # Anything above an aggregate sees buckets, not expense rows
+    if plan["Node Type"] == "Aggregate":
+        return False
+    return any(_reads_raw_expenses(child) for child in plan.get("Plans", []))
+
+
+def seed(conn, rows, days):
+    create_partitions(conn, since=date.today() - timedelta(days=days))
+    cursor = conn.cursor()
+    cursor.execute(SEED_SQL, {"rows": rows, "days": days})
+    conn.commit()
+    conn.autocommit = True
+    try:
+        cursor.execute("VACUUM ANALYZE expenses, daily_category_totals")
+    finally:
+        conn.autocommit = False
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seed", type=int, default=0, metavar="ROWS",
+                        help="insert this many synthetic expenses before checking")
+    parser.add_argument("--days", type=int, default=5 * 365,
+                        help="spread seeded expenses over this many days")
+    args = parser.parse_args()
+
+    with get_connection() as conn:
+        if not conn:
+            return 1
+        migrate(conn)
+        if args.seed:
+            seed(conn, args.seed, args.days)
+
+        failed = False
+        cursor = conn.cursor()
+        cursor.execute(TRIGRAM_CHECK_SQL)
+        fuzzy = cursor.fetchone()[0]
+        tables = table_rows(cursor)
+        for name, (query, params) in app_queries(date.today(), fuzzy):
+            cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            found = list(problems(plan[0]["Plan"], tables))
+            failed = failed or bool(found)
+            print(f"{'FAIL' if found else 'ok  '}  {name}" + "".join(f"\n      {p}" for p in found))
+        cursor.close()
+        conn.rollback()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
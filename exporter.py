@@ -0,0 +1,146 @@
+"""Streaming export of expenses to CSV or Parquet.
+
+Rows are pulled through a named (server-side) cursor a chunk at a time and
+written out as they arrive: CSV appends, Parquet writes one row group per
+chunk. Memory use depends on the chunk size, not on how many rows match.
+
+That holds for export_file() and this command line. The app's download
+buttons read the finished file into memory to serve it, so tracker.py only
+offers them up to ``export_max_rows`` (default 200,000) and points larger
+exports here.
+
+    python exporter.py expenses.parquet --start 2024-01-01 --end 2024-12-31
+"""
+import argparse
+import sys
+import tempfile
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from db import get_connection, period_filter
+from frames import typed_frame
+from storage import get_storage
+
+# Same column names importer.py expects. Re-importing an export is not a no-op:
+# rows entered through the form have no import_hash, so they come back as new rows
+EXPORT_COLUMNS = ['date', 'amount', 'category', 'note']
+FORMATS = ('csv', 'parquet')
+PARQUET_SCHEMA = pa.schema([
+    ('date', pa.date32()),
+    ('amount', pa.float64()),
+    ('category', pa.string()),
+    ('note', pa.string()),
+])
+
+
+def export_query(start_date=None, end_date=None):
+    where, params = period_filter(start_date, end_date)
+    query = """
+        SELECT e.expense_date AS date, e.amount::float8 AS amount, c.name AS category, e.note
+        FROM expenses e
+        LEFT JOIN categories c ON e.category_id = c.id
+    """ + where + " ORDER BY e.expense_date DESC, e.created_at DESC, e.id DESC"
+    return query, params
+
+
+def write_chunks(chunks, out, fmt='csv'):
+    """Write an iterable of row lists (EXPORT_COLUMNS order) to out; returns the row count.
+
+    Each chunk becomes a typed frame (see frames.py) before it is written. The
+    first chunk is written even when empty, for the header / schema.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+    writer = None
+    rows_written = 0
+    try:
+        for index, rows in enumerate(chunks):
+            chunk = typed_frame(rows, EXPORT_COLUMNS)
+            if fmt == 'csv':
+                chunk.to_csv(out, header=index == 0, index=False)
+            else:
+                if writer is None:
+                    writer = pq.ParquetWriter(out, PARQUET_SCHEMA)
+                writer.write_table(pa.Table.from_pandas(chunk, schema=PARQUET_SCHEMA, preserve_index=False))
+            rows_written += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows_written
+
+
+def fetch_chunks(cursor, chunk_size):
+    """Yield the cursor's rows chunk_size at a time; at least one (possibly empty) chunk."""
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        yield rows
+        if len(rows) < chunk_size:
+            break
+
+
+def export_expenses(conn, out, start_date=None, end_date=None, fmt='csv', chunk_size=50_000):
+    """Write the period's expenses to the binary file object out; returns the row count."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+    cursor = conn.cursor(name='expense_export')
+    cursor.itersize = chunk_size
+    try:
+        cursor.execute(*export_query(start_date, end_date))
+        return write_chunks(fetch_chunks(cursor, chunk_size), out, fmt)
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def export_file(out, start_date=None, end_date=None, fmt='csv', chunk_size=50_000):
+    """export_expenses() on a pooled connection; None if the database is unreachable."""
+    with get_connection() as conn:
+        if conn:
+            return export_expenses(conn, out, start_date, end_date, fmt, chunk_size)
+    return None
+
+
+def export_to_tempfile(start_date=None, end_date=None, fmt='csv'):
+    """Export into a temporary file and return it rewound, for st.download_button.
+
+    download_button reads the whole file into memory; see the module docstring.
+    """
+    # Unbuffered, so it is the raw file object download_button knows how to read
+    out = tempfile.TemporaryFile(buffering=0)
+    get_storage().export_file(out, start_date, end_date, fmt)
+    out.seek(0)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export expenses to CSV or Parquet")
+    parser.add_argument("file", help="output file ('-' for stdout, CSV only)")
+    parser.add_argument("--start", type=date.fromisoformat, help="first expense date (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="last expense date (YYYY-MM-DD)")
+    parser.add_argument("--format", choices=FORMATS,
+                        help="defaults to the output file's extension, else csv")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="rows fetched per round trip")
+    args = parser.parse_args()
+    if bool(args.start) != bool(args.end):
+        parser.error("--start and --end go together")
+
+    fmt = args.format or ('parquet' if args.file.endswith('.parquet') else 'csv')
+    if args.file == "-":
+        if fmt != 'csv':
+            parser.error("only CSV can be written to stdout")
+        count = get_storage().export_file(sys.stdout.buffer, args.start, args.end, fmt, args.chunk_size)
+    else:
+        with open(args.file, 'wb') as out:
+            count = get_storage().export_file(out, args.start, args.end, fmt, args.chunk_size)
+    if count is None:
+        return 1
+    print(f"Exported {count:,} expenses", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
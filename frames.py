@@ -0,0 +1,59 @@
+"""Typed DataFrames straight from query results.
+
+Frames built here already hold their final dtypes: float64 amounts, datetime64
+dates and categorical category columns. They never go through per-row dicts or
+Decimals, and need no pd.to_numeric / pd.to_datetime pass afterwards. A
+Postgres result is read through COPY ... TO STDOUT and decoded by a single
+read_csv call. Rows from a cursor (SQLite, and the exporter's server-side
+cursor chunks) go through typed_frame(), one column at a time.
+
+pandas is imported here, so the storage modules import this module inside the
+functions that need it. That keeps pandas off the non-Analytics pages (see
+prewarm.py).
+"""
+import io
+
+import pandas as pd
+
+# Columns not listed keep the values the driver returns (notes, created_at)
+DTYPES = {
+    'id': 'int64',
+    'amount': 'float64',
+    'category_id': 'Int64',
+    'rank': 'float64',
+    'category_name': 'category',
+    'category': 'category',
+    'color': 'category',
+    'icon': 'category',
+}
+DATE_COLUMNS = ('expense_date', 'date')
+
+
+def _dtype(column):
+    return 'datetime64[ns]' if column in DATE_COLUMNS else DTYPES.get(column)
+
+
+def typed_frame(rows, columns):
+    """Cursor rows (tuples) as a DataFrame, each column built straight into its dtype.
+
+    Dates may be date objects (psycopg2) or ISO strings (SQLite).
+    """
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return pd.DataFrame({column: pd.Series(column_values, dtype=_dtype(column))
+                         for column, column_values in zip(columns, values)})
+
+
+def copy_frame(cursor, query, params):
+    """A psycopg2 query's result, decoded from COPY output by one read_csv call."""
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({cursor.mogrify(query, params).decode()}) TO STDOUT WITH (FORMAT csv, HEADER)",
+                       buffer)
+    buffer.seek(0)
+    columns = buffer.readline().decode().rstrip('\r\n').split(',')
+    buffer.seek(0)
+    dates = [column for column in columns if column in DATE_COLUMNS]
+    # Empty fields are NULL, but a note reading "NA" stays text
+    frame = pd.read_csv(buffer, dtype={column: DTYPES[column] for column in columns if column in DTYPES},
+                        parse_dates=dates, date_format='%Y-%m-%d', keep_default_na=False, na_values=[''])
+    # read_csv leaves the date columns of a header-only result as object
+    return frame.astype({column: 'datetime64[ns]' for column in dates})
@@ -0,0 +1,208 @@
+"""Bulk import of expenses from CSV / bank-statement exports.
+
+The file is read in chunks, each chunk is COPY'd into a temporary staging
+table, and a single INSERT ... SELECT merges the staged rows into expenses.
+Every imported row carries a content hash, so importing the same file (or an
+overlapping statement) again only adds rows that weren't there before. Rows
+entered through the form have no hash and are never matched, so importing an
+exporter.py file duplicates them.
+
+    python importer.py statement.csv --date-column "Txn Date" --amount-column Debit
+"""
+import argparse
+import io
+import sys
+
+import pandas as pd
+
+from db import get_connection, data_changed
+from storage import get_storage
+
+# Same limit as the form's note field
+MAX_NOTE_LENGTH = 500
+MAX_AMOUNT = 99_999_999.99
+
+STAGING_TABLE = """
+    CREATE TEMP TABLE expense_import (
+        line_no bigint not null,
+        expense_date date not null,
+        amount numeric(10,2) not null,
+        category text,
+        category_id integer,
+        note text
+    ) ON COMMIT DROP
+"""
+
+# Identical rows within one file are legitimate (two coffees on the same day),
+# so the hash includes each row's occurrence number among its duplicates.
+# The anti-join skips rows from earlier imports in bulk; ON CONFLICT only
+# has to catch a concurrent import of the same rows. The hash covers the date,
+# so matching on expense_date as well loses nothing and finds the partition.
+MERGE_SQL = """
+    INSERT INTO expenses (amount, category_id, note, expense_date, import_hash)
+    SELECT amount, category_id, note, expense_date, import_hash
+    FROM (
+        SELECT amount, category_id, note, expense_date,
+               md5(concat_ws('|', expense_date, amount, lower(coalesce(category, '')), coalesce(note, ''),
+                             row_number() OVER (
+                                 PARTITION BY expense_date, amount, lower(category), note ORDER BY line_no
+                             ))) AS import_hash
+        FROM expense_import
+    ) staged
+    WHERE NOT EXISTS (
+        SELECT 1 FROM expenses e WHERE e.import_hash = staged.import_hash AND e.expense_date = staged.expense_date
+    )
+    ON CONFLICT (import_hash, expense_date) WHERE import_hash IS NOT NULL DO NOTHING
+"""
+
+
+def _category_ids(cursor):
+    # One lookup for the whole import; names match case-insensitively
+    cursor.execute("SELECT lower(name), id FROM categories")
+    return dict(cursor.fetchall())
+
+
+def _clean_chunk(chunk, columns, category_ids, fallback_id, date_format, debits_negative):
+    raw_amounts = chunk[columns['amount']]
+    amounts = pd.to_numeric(raw_amounts, errors='coerce')
+    # Only values like "₹1,234.50" need the slower clean-up pass
+    formatted = amounts.isna() & raw_amounts.notna()
+    if formatted.any():
+        amounts[formatted] = pd.to_numeric(
+            raw_amounts[formatted].str.replace(r'[^0-9.\-]', '', regex=True), errors='coerce'
+        )
+    if debits_negative:
+        amounts = -amounts
+    dates = pd.to_datetime(chunk[columns['date']], format=date_format, errors='coerce')
+
+    if columns['category'] in chunk:
+        categories = chunk[columns['category']].fillna('').astype(str).str.strip()
+    else:
+        categories = pd.Series('', index=chunk.index)
+    category_ids = categories.str.lower().map(category_ids)
+    unmapped = int(category_ids.isna().sum())
+    category_ids = category_ids.fillna(fallback_id) if fallback_id is not None else category_ids
+
+    if columns['note'] in chunk:
+        notes = chunk[columns['note']].fillna('').astype(str).str.strip().str.slice(0, MAX_NOTE_LENGTH)
+    else:
+        notes = pd.Series('', index=chunk.index)
+
+    cleaned = pd.DataFrame({
+        'line_no': chunk.index,
+        'expense_date': dates.dt.strftime('%Y-%m-%d'),
+        'amount': amounts.round(2),
+        'category': categories,
+        'category_id': category_ids.astype('Int64'),
+        'note': notes.replace('', None),
+    })
+    valid = dates.notna() & (amounts > 0) & (amounts <= MAX_AMOUNT)
+    return cleaned[valid], int((~valid).sum()), unmapped
+
+
+def read_chunks(source, category_ids, result, chunk_size=100_000, date_column='date', amount_column='amount',
+                category_column='category', note_column='note', date_format=None, default_category='Others',
+                debits_negative=False):
+    """Yield the CSV's valid rows a chunk at a time, cleaned by _clean_chunk().
+
+    Counts of rows read, rejected and with an unknown category are added to
+    result as the chunks are read.
+    """
+    columns = {'date': date_column, 'amount': amount_column, 'category': category_column, 'note': note_column}
+    fallback_id = category_ids.get(default_category.lower()) if default_category else None
+    for chunk in pd.read_csv(source, chunksize=chunk_size, dtype=str, skipinitialspace=True):
+        missing = {columns['date'], columns['amount']} - set(chunk.columns)
+        if missing:
+            raise ValueError(f"CSV is missing column(s): {', '.join(sorted(missing))}")
+        cleaned, rejected, unmapped = _clean_chunk(
+            chunk, columns, category_ids, fallback_id, date_format, debits_negative
+        )
+        result['read'] += len(chunk)
+        result['rejected'] += rejected
+        result['unmapped_categories'] += unmapped
+        yield cleaned
+
+
+def import_csv(conn, source, **options):
+    """Stream a CSV file into expenses and return counts of what happened.
+
+    Options are read_chunks()'s. Rows with an unparseable date or a
+    non-positive amount are rejected. Unknown category names fall back to
+    default_category.
+    """
+    result = {'read': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0, 'unmapped_categories': 0}
+    cursor = conn.cursor()
+    try:
+        category_ids = _category_ids(cursor)
+        cursor.execute(STAGING_TABLE)
+
+        for cleaned in read_chunks(source, category_ids, result, **options):
+            buffer = io.StringIO()
+            cleaned.to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cursor.copy_expert(
+                "COPY expense_import (line_no, expense_date, amount, category, category_id, note) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+
+        # Room to sort and hash the staged rows in memory
+        cursor.execute("SET LOCAL work_mem = '256MB'")
+        cursor.execute("ANALYZE expense_import")
+        cursor.execute(MERGE_SQL)
+        result['inserted'] = cursor.rowcount
+        result['duplicates'] = result['read'] - result['rejected'] - result['inserted']
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    if result['inserted']:
+        data_changed()
+    return result
+
+
+def import_file(source, **options):
+    """import_csv() on a pooled connection; None if the database is unreachable."""
+    with get_connection() as conn:
+        if conn:
+            return import_csv(conn, source, **options)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import expenses from a CSV file")
+    parser.add_argument("file", help="CSV file to import ('-' for stdin)")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="rows per COPY batch")
+    parser.add_argument("--date-column", default="date")
+    parser.add_argument("--amount-column", default="amount")
+    parser.add_argument("--category-column", default="category")
+    parser.add_argument("--note-column", default="note")
+    parser.add_argument("--date-format", help="strftime format of the date column, e.g. %%d/%%m/%%Y")
+    parser.add_argument("--default-category", default="Others",
+                        help="category for rows whose category is missing or unknown")
+    parser.add_argument("--debits-negative", action="store_true",
+                        help="the export lists spending as negative amounts")
+    args = parser.parse_args()
+
+    result = get_storage().import_file(
+        sys.stdin if args.file == "-" else args.file,
+        chunk_size=args.chunk_size,
+        date_column=args.date_column,
+        amount_column=args.amount_column,
+        category_column=args.category_column,
+        note_column=args.note_column,
+        date_format=args.date_format,
+        default_category=args.default_category,
+        debits_negative=args.debits_negative,
+    )
+    if result is None:
+        return 1
+    print(", ".join(f"{count:,} {label.replace('_', ' ')}" for label, count in result.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""Per-rerun timing spans and database call statistics.
+
+tracker.py calls start_rerun() at the top of the script and finish_rerun() in a
+finally block at the bottom when instrumentation is on (``instrumentation = true`` in secrets,
+or ``?debug=1`` in the URL, which also shows the sidebar panel). In between:
+
+* span(name) times a block; cached reads and page sections use it,
+* every cursor on a pooled connection records each statement's time, rows
+  fetched and approximate bytes received.
+
+A finished rerun is logged as one JSON object on the ``expense_tracker.metrics``
+logger and, if ``metrics_file`` is set, appended to that file as a JSON line.
+
+When no rerun is being recorded, span() returns a shared no-op context
+manager and cursors are handed out unwrapped, so the cost is one
+ContextVar lookup per call.
+"""
+import contextvars
+import json
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+
+from psycopg2.extensions import connection
+
+logger = logging.getLogger("expense_tracker.metrics")
+
+_current = contextvars.ContextVar("rerun_metrics", default=None)
+# Names of the open spans; per context, so spans opened on loader threads
+# (see loader.py) nest under the span that dispatched them
+_open_spans = contextvars.ContextVar("open_spans", default=())
+_NO_SPAN = nullcontext()
+
+
+class RerunMetrics:
+    def __init__(self, **attrs):
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.wall_time = None
+        self.spans = []    # dicts: name, depth, start_ms, ms and attributes
+        self.queries = []  # dicts: span, sql, ms, rows, bytes
+
+    def summary(self):
+        return {
+            'ms': round(self.wall_time if self.wall_time is not None else self.elapsed_ms(), 2),
+            'queries': len(self.queries),
+            'query_ms': round(sum(query['ms'] for query in self.queries), 2),
+            'rows': sum(query['rows'] for query in self.queries),
+            'bytes': sum(query['bytes'] for query in self.queries),
+        }
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def to_dict(self):
+        return dict(self.attrs, summary=self.summary(), spans=self.spans, queries=self.queries)
+
+
+def current():
+    """The rerun being recorded on this thread / context, or None."""
+    return _current.get()
+
+
+def start_rerun(**attrs):
+    metrics = RerunMetrics(**attrs)
+    _current.set(metrics)
+    return metrics
+
+
+def annotate(**attrs):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.attrs.update(attrs)
+
+
+def finish_rerun(metrics_file=None):
+    """Stop recording, log the rerun and return its metrics."""
+    metrics = _current.get()
+    if metrics is None:
+        return None
+    _current.set(None)
+    metrics.wall_time = metrics.elapsed_ms()
+    line = json.dumps(metrics.to_dict(), default=str)
+    logger.info(line)
+    if metrics_file:
+        with open(metrics_file, "a") as out:
+            out.write(line + "\n")
+    return metrics
+
+
+@contextmanager
+def _span(metrics, name, attrs):
+    open_spans = _open_spans.get()
+    record = dict(name=name, depth=len(open_spans), start_ms=round(metrics.elapsed_ms(), 2), **attrs)
+    metrics.spans.append(record)
+    token = _open_spans.set(open_spans + (name,))
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['ms'] = round((time.perf_counter() - started) * 1000, 3)
+        _open_spans.reset(token)
+
+
+def span(name, **attrs):
+    """Time the enclosed block as part of the current rerun, if one is recorded."""
+    metrics = _current.get()
+    if metrics is None:
+        return _NO_SPAN
+    return _span(metrics, name, attrs)
+
+
+def _row_bytes(row):
+    # Approximate wire size of a text-format DataRow: 4-byte length per field plus the text
+    return sum(4 + (len(str(value)) if value is not None else 0) for value in row)
+
+
+class TimedCursor:
+    """Wraps any psycopg2 cursor and records its statements in a RerunMetrics."""
+
+    def __init__(self, cursor, metrics):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_metrics', metrics)
+        object.__setattr__(self, '_query', None)
+
+    def _record(self, sql, started):
+        open_spans = _open_spans.get()
+        query = {
+            'span': open_spans[-1] if open_spans else None,
+            'sql': " ".join(str(sql).split())[:120],
+            'ms': round((time.perf_counter() - started) * 1000, 3),
+            'rows': 0,
+            'bytes': 0,
+        }
+        self._metrics.queries.append(query)
+        object.__setattr__(self, '_query', query)
+
+    def _fetched(self, rows, started):
+        query = self._query
+        if query is not None:
+            query['ms'] = round(query['ms'] + (time.perf_counter() - started) * 1000, 3)
+            query['rows'] += len(rows)
+            query['bytes'] += sum(_row_bytes(row) for row in rows)
+        return rows
+
+    def execute(self, sql, vars=None):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, vars)
+        finally:
+            self._record(sql, started)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        position = file.tell() if file.seekable() else None
+        try:
+            return self._cursor.copy_expert(sql, file, size)
+        finally:
+            self._record(sql, started)
+            if position is not None:
+                self._query['bytes'] = abs(file.tell() - position)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched([row] if row is not None else [], started)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        return self._fetched(self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany(),
+                             started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        return self._fetched(self._cursor.fetchall(), started)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._cursor.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+
+class InstrumentedConnection(connection):
+    """psycopg2 connection whose cursors are timed while a rerun is recorded."""
+
+    def cursor(self, *args, **kwargs):
+        cursor = super().cursor(*args, **kwargs)
+        metrics = _current.get()
+        return cursor if metrics is None else TimedCursor(cursor, metrics)
@@ -0,0 +1,110 @@
+"""Cross-process cache invalidation over Postgres LISTEN/NOTIFY.
+
+Migration 5 installs statement-level triggers on expenses and categories that
+NOTIFY the ``expense_tracker_changes`` channel with the table name, so every
+writer (the app, bulk imports, psql) announces its commits. Each worker runs
+one ChangeListener thread that drops its query cache when a notification
+arrives.
+
+To watch notifications from another process:
+
+    python listener.py
+
+listener_check.py checks end to end that a write in one process empties
+another process's query cache.
+"""
+import logging
+import select
+import threading
+import time
+
+from psycopg2 import OperationalError, InterfaceError
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "expense_tracker_changes"
+
+# libpq options for the LISTEN connection. A peer that vanished without closing
+# the connection (a NAT timeout, a failover) fails the keepalive probes, and
+# tcp_user_timeout (ms) bounds how long a ping can go unacknowledged; either
+# way the socket errors out instead of leaving select() waiting forever.
+KEEPALIVES = {
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 3,
+    'tcp_user_timeout': 60_000,
+}
+
+
+class ChangeListener(threading.Thread):
+    """connect(**options) opens a new connection; it is passed KEEPALIVES."""
+
+    def __init__(self, connect, on_change, channel=CHANNEL, poll_interval=5.0, retry_interval=5.0,
+                 ping_interval=60.0):
+        super().__init__(name="expense-change-listener", daemon=True)
+        self._connect = connect
+        self._on_change = on_change
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.ping_interval = ping_interval
+        self.notifications = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = self._connect(**KEEPALIVES)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                # Anything committed while we weren't listening went unannounced
+                self._on_change([])
+                self._listen(conn)
+            except (OperationalError, InterfaceError) as e:
+                logger.warning("Change listener disconnected, retrying in %.0fs: %s", self.retry_interval, e)
+            finally:
+                if conn is not None:
+                    conn.close()
+            self._stopped.wait(self.retry_interval)
+
+    def _listen(self, conn):
+        last_heard = time.monotonic()
+        while not self._stopped.is_set():
+            # Wake up periodically so stop() is honoured and pings go out
+            if select.select([conn], [], [], self.poll_interval) != ([], [], []):
+                conn.poll()
+                last_heard = time.monotonic()
+            elif time.monotonic() - last_heard >= self.ping_interval:
+                # A quiet connection may be a dead one: a failed ping raises
+                # OperationalError, and run() reconnects
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                last_heard = time.monotonic()
+            if conn.notifies:
+                tables = sorted({notify.payload for notify in conn.notifies})
+                self.notifications += len(conn.notifies)
+                conn.notifies.clear()
+                self._on_change(tables)
+
+    def stop(self):
+        self._stopped.set()
+
+
+if __name__ == "__main__":
+    from datetime import datetime
+
+    from db import _connect
+
+    def report(tables):
+        print(f"{datetime.now():%H:%M:%S.%f} {', '.join(tables) or '(listening)'}", flush=True)
+
+    listener = ChangeListener(_connect, report)
+    listener.start()
+    try:
+        listener.join()
+    except KeyboardInterrupt:
+        listener.stop()
@@ -0,0 +1,120 @@
+"""Check that a write in one process invalidates another process's query cache.
+
+Point .streamlit/secrets.toml at a local Postgres database, then:
+
+    python listener_check.py --deadline 2
+
+A child process builds the query cache the way a worker does (which starts its
+ChangeListener), fills it, and waits. This process then commits an expense
+insert and its delete in one transaction, which leaves the data unchanged but
+fires the NOTIFY triggers from migration 5. The check fails unless the child's
+cache is emptied within --deadline seconds of that commit.
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+# Seconds between looks at the child's cache
+POLL_INTERVAL = 0.005
+# How long the child waits for its listener to connect before giving up
+CONNECT_TIMEOUT = 30.0
+
+WRITE_SQL = """
+    INSERT INTO expenses (amount, category_id, note, expense_date)
+    VALUES (0.01, NULL, 'listener_check', current_date)
+    RETURNING id, expense_date
+"""
+
+
+def watch(timeout):
+    """Runs in the child process: print "ready" once the cache is filled, then
+    the wall-clock time at which it was invalidated."""
+    from db import get_categories, get_query_cache
+
+    cache = get_query_cache()
+    # The listener invalidates once as soon as it is LISTENing
+    give_up = time.monotonic() + CONNECT_TIMEOUT
+    while cache.stats()['invalidations'] == 0:
+        if time.monotonic() > give_up:
+            print("listener never connected (is listen_for_changes off, or the backend not postgres?)", flush=True)
+            return 1
+        time.sleep(POLL_INTERVAL)
+
+    get_categories()
+    version = cache.stats()['version']
+    if not cache.stats()['size']:
+        print("could not fill the query cache", flush=True)
+        return 1
+    print("ready", flush=True)
+
+    give_up = time.monotonic() + timeout
+    while cache.stats()['version'] == version:
+        if time.monotonic() > give_up:
+            print("not invalidated", flush=True)
+            return 1
+        time.sleep(POLL_INTERVAL)
+    print(f"invalidated {time.time()!r}", flush=True)
+    return 0
+
+
+def write(conn):
+    """Commit an insert and delete of one expense; returns the commit's wall-clock time."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(WRITE_SQL)
+        expense_id, expense_date = cursor.fetchone()
+        cursor.execute("DELETE FROM expenses WHERE id = %s AND expense_date = %s", (expense_id, expense_date))
+        conn.commit()
+        return time.time()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deadline", type=float, default=2.0,
+                        help="seconds the other process may take to drop its cache")
+    parser.add_argument("--child", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        return watch(args.child)
+
+    from db import get_connection
+
+    child = subprocess.Popen([sys.executable, __file__, "--child", str(args.deadline + CONNECT_TIMEOUT)],
+                             stdout=subprocess.PIPE, text=True)
+    try:
+        status = child.stdout.readline().strip()
+        if status != "ready":
+            print(f"FAIL  child: {status or 'exited early'}")
+            return 1
+        with get_connection() as conn:
+            if not conn:
+                return 1
+            committed = write(conn)
+        try:
+            output, _ = child.communicate(timeout=args.deadline)
+        except subprocess.TimeoutExpired:
+            print(f"FAIL  cache not invalidated within {args.deadline:.1f}s")
+            return 1
+    finally:
+        if child.poll() is None:
+            child.kill()
+            child.wait()
+
+    status = output.strip()
+    if not status.startswith("invalidated "):
+        print(f"FAIL  child: {status or 'exited early'}")
+        return 1
+    latency = max(float(status.split()[1]) - committed, 0.0)
+    print(f"{'ok  ' if latency <= args.deadline else 'FAIL'}  cache invalidated {latency * 1000:.0f} ms after commit")
+    return 0 if latency <= args.deadline else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
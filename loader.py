@@ -0,0 +1,62 @@
+"""Run independent reads concurrently on a process-wide thread pool.
+
+The Analytics page needs several queries that don't depend on each other
+(summary, comparison, trend, top expenses). Run one after another, the page
+waits for the sum of their round trips; load_all() dispatches them together
+so it waits for the slowest one.
+
+The executor is shared by every session in the process and bounded by
+``loader_threads`` in secrets (default 4, never more than ``pool_max``), so
+a burst of sessions queues for workers instead of exhausting the connection
+pool. Each task checks out its own pooled connection through the usual read
+functions, so results land in the query cache as if they had been read
+inline.
+
+Tasks run in a copy of the caller's context, which carries the rerun's
+instrumentation (see instrumentation.py), and with the caller's Streamlit
+script context attached, so a connection error is still shown on the page.
+"""
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from instrumentation import span
+
+
+# Once per process
+@st.cache_resource(show_spinner=False)
+def get_executor():
+    workers = min(int(st.secrets.get("loader_threads", 4)), int(st.secrets.get("pool_max", 10)))
+    return ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="loader")
+
+
+def _run(context, script_ctx, func, args):
+    if script_ctx is not None:
+        add_script_run_ctx(threading.current_thread(), script_ctx)
+    return context.run(func, *args)
+
+
+def load_all(tasks, name="load"):
+    """Run {key: (func, *args)} concurrently and return {key: result}.
+
+    Every task is waited for; the first exception raised by any of them is
+    then re-raised here.
+    """
+    with span(name, tasks=len(tasks)):
+        if len(tasks) < 2:
+            return {key: func(*args) for key, (func, *args) in tasks.items()}
+        executor = get_executor()
+        script_ctx = get_script_run_ctx(suppress_warning=True)
+        futures = {
+            key: executor.submit(_run, contextvars.copy_context(), script_ctx, func, args)
+            for key, (func, *args) in tasks.items()
+        }
+        # Let every task finish before raising, so none outlives this rerun
+        errors = [future.exception() for future in futures.values()]
+        for error in errors:
+            if error is not None:
+                raise error
+        return {key: future.result() for key, future in futures.items()}
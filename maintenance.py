@@ -0,0 +1,201 @@
+"""Database maintenance commands.
+
+    python maintenance.py rebuild-rollup                 recompute daily_category_totals
+    python maintenance.py partitions                     create the coming months' expenses partitions
+    python maintenance.py archive-partitions YYYY-MM     detach the partitions of months before YYYY-MM
+
+expenses is partitioned by month (migration 12). Migrations keep the next
+PARTITION_MONTHS_AHEAD months ready each time they run, and every app worker
+does the same every ``partition_check_hours`` (default 24) while it runs, so
+a long-lived worker never outlives the partitions it started with. Run
+``partitions`` from cron only where no app worker runs. Rows dated in a month
+without a partition are never rejected: they wait in expenses_default, and the
+next ``partitions`` run moves them into a partition of their own.
+"""
+import argparse
+import logging
+import sys
+import threading
+import time
+from datetime import date
+
+import streamlit as st
+
+from db import get_connection, data_changed
+from listener import CHANNEL
+
+logger = logging.getLogger(__name__)
+
+# Months after the current one that always have a partition ready
+PARTITION_MONTHS_AHEAD = 3
+
+ROLLUP_DRIFT_SQL = """
+    SELECT count(*)
+    FROM daily_category_totals r
+    FULL JOIN (
+        SELECT expense_date, coalesce(category_id, 0) AS category_id, sum(amount) AS total, count(*) AS count
+        FROM expenses GROUP BY 1, 2
+    ) e USING (expense_date, category_id)
+    WHERE r.total IS DISTINCT FROM e.total OR r.count IS DISTINCT FROM e.count
+"""
+
+
+def rebuild_rollup(conn):
+    """Recompute daily_category_totals from expenses; returns how many buckets had drifted."""
+    cursor = conn.cursor()
+    try:
+        # Writers wait until the rebuild commits, so no delta is lost in between
+        cursor.execute("LOCK TABLE expenses IN SHARE MODE")
+        cursor.execute(ROLLUP_DRIFT_SQL)
+        drifted = cursor.fetchone()[0]
+        if drifted:
+            cursor.execute("DELETE FROM daily_category_totals")
+            cursor.execute("""
+                INSERT INTO daily_category_totals (expense_date, category_id, total, count)
+                SELECT expense_date, coalesce(category_id, 0), sum(amount), count(*)
+                FROM expenses GROUP BY 1, 2
+            """)
+            # Delivered on commit, so other workers drop their cached totals
+            cursor.execute("SELECT pg_notify(%s, 'expenses')", (CHANNEL,))
+        conn.commit()
+        return drifted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def create_partitions(conn, months_ahead=PARTITION_MONTHS_AHEAD, since=None):
+    """Create monthly expenses partitions from since (default this month) to months_ahead months ahead.
+
+    Also gives every month with rows in expenses_default its own partition.
+    Returns how many partitions were created.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT create_expense_partitions(%s, (current_date + make_interval(months => %s))::date)",
+            (since or date.today(), months_ahead)
+        )
+        created = cursor.fetchone()[0]
+        conn.commit()
+        return created
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _create_partitions_forever(interval):
+    while True:
+        # Migrations have just created them, so start with a wait
+        time.sleep(interval)
+        try:
+            with get_connection() as conn:
+                if conn:
+                    created = create_partitions(conn)
+                    if created:
+                        logger.info("Created %d expenses partitions", created)
+        except Exception:
+            logger.exception("Creating expenses partitions failed")
+
+
+# Once per process
+@st.cache_resource(show_spinner=False)
+def start_partition_maintenance(interval):
+    thread = threading.Thread(target=_create_partitions_forever, args=(interval,),
+                              name="partition-maintenance", daemon=True)
+    thread.start()
+    return thread
+
+
+MONTHLY_PARTITIONS_SQL = """
+    SELECT c.relname, to_date(right(c.relname, 7), 'YYYY_MM')
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'expenses'::regclass AND c.relname ~ '^expenses_[0-9]{4}_[0-9]{2}$'
+    ORDER BY 2
+"""
+
+
+def archive_partitions(conn, before, drop=False):
+    """Detach the partitions of months before before's month; returns their names.
+
+    Each one is kept as the standalone table archived_<name>, or dropped with
+    drop=True. Either way its rows leave expenses and daily_category_totals
+    in the same transaction, and other workers are notified.
+    """
+    before = before.replace(day=1)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(MONTHLY_PARTITIONS_SQL)
+        archived = []
+        for name, month in cursor.fetchall():
+            if month >= before:
+                break
+            # CONCURRENTLY isn't allowed alongside a default partition; a
+            # plain DETACH briefly blocks reads and writes on expenses
+            cursor.execute(f'ALTER TABLE expenses DETACH PARTITION "{name}"')
+            cursor.execute(
+                "DELETE FROM daily_category_totals WHERE expense_date >= %s AND expense_date < %s::date + interval '1 month'",
+                (month, month)
+            )
+            # Detaching fires no triggers; snapshot readers see the month as changed
+            cursor.execute("DELETE FROM expense_month_versions WHERE month = %s", (month,))
+            cursor.execute(f'DROP TABLE "{name}"' if drop else f'ALTER TABLE "{name}" RENAME TO "archived_{name}"')
+            archived.append(name)
+        if archived:
+            cursor.execute("SELECT pg_notify(%s, 'expenses')", (CHANNEL,))
+        conn.commit()
+        return archived
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def year_month(value):
+    try:
+        year, month_number = value.split("-")
+        return date(int(year), int(month_number), 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {value!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Database maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild-rollup", help="recompute daily_category_totals from expenses")
+    partitions = commands.add_parser("partitions", help="create the coming months' expenses partitions")
+    partitions.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD,
+                            help="months after the current one to create")
+    archive = commands.add_parser("archive-partitions", help="detach the partitions of old months")
+    archive.add_argument("before", type=year_month, help="first month to keep, as YYYY-MM")
+    archive.add_argument("--drop", action="store_true", help="drop the detached partitions instead of keeping them")
+    args = parser.parse_args()
+
+    with get_connection() as conn:
+        if not conn:
+            return 1
+        if args.command == "rebuild-rollup":
+            drifted = rebuild_rollup(conn)
+            if drifted:
+                data_changed()
+                print(f"Rebuilt daily_category_totals, {drifted} drifted buckets repaired")
+            else:
+                print("daily_category_totals matches expenses")
+        elif args.command == "partitions":
+            print(f"Created {create_partitions(conn, args.months_ahead)} partitions")
+        elif args.command == "archive-partitions":
+            archived = archive_partitions(conn, args.before, args.drop)
+            if archived:
+                data_changed()
+            action = "Dropped" if args.drop else "Detached"
+            print(f"{action} {len(archived)} partitions" + (f": {', '.join(archived)}" if archived else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,482 @@
+"""Versioned schema migrations.
+
+Each entry in MIGRATIONS is applied exactly once, in order, inside its own
+transaction, and recorded in schema_version. New schema changes go at the end
+of the list; never edit a step that has already shipped.
+
+Run ``python migrations.py`` at deploy time, or let the app apply pending
+steps once per process on first load. Either way the next few months'
+expenses partitions are created too (see maintenance.py).
+"""
+import sys
+
+import streamlit as st
+
+from db import get_connection
+from maintenance import create_partitions
+
+# Arbitrary key so concurrent workers don't apply the same step twice
+MIGRATION_LOCK_ID = 727_001
+
+MIGRATIONS = [
+    (1, "create categories and expenses", [
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            id integer generated by default as identity primary key,
+            name varchar(100) unique not null,
+            color varchar(7) default '#667eea',
+            icon varchar(50) default '📦',
+            created_at timestamp with time zone default now()
+        )
+        """,
+        # Databases created before icons existed
+        "ALTER TABLE categories ADD COLUMN IF NOT EXISTS icon varchar(50) DEFAULT '📦'",
+        """
+        CREATE TABLE IF NOT EXISTS expenses (
+            id integer generated by default as identity primary key,
+            amount numeric(10,2) not null,
+            category_id integer references categories(id) on delete set null,
+            note text,
+            expense_date date not null,
+            created_at timestamp with time zone default now()
+        )
+        """,
+    ]),
+    (2, "seed default categories", [
+        # Also back-fills icons on default categories that still carry the placeholder
+        """
+        INSERT INTO categories (name, color, icon) VALUES
+            ('Food', '#FF6B6B', '🍔'),
+            ('Transport', '#4ECDC4', '🚗'),
+            ('Shopping', '#45B7D1', '🛍️'),
+            ('Bills', '#FFA07A', '💡'),
+            ('Entertainment', '#98D8C8', '🎬'),
+            ('Health', '#F7DC6F', '⚕️'),
+            ('Education', '#BB8FCE', '📚'),
+            ('Others', '#B19CD9', '📦')
+        ON CONFLICT (name) DO UPDATE SET icon = EXCLUDED.icon
+        WHERE categories.icon IS NULL OR categories.icon = '📦'
+        """,
+    ]),
+    (3, "index expense access paths", [
+        # Period filter + newest-first ordering (note is left out, see step 4)
+        """
+        CREATE INDEX IF NOT EXISTS expenses_date_idx
+            ON expenses (expense_date DESC, created_at DESC)
+            INCLUDE (id, amount, category_id)
+        """,
+        # Category join, ON DELETE SET NULL, and per-category period filters
+        "CREATE INDEX IF NOT EXISTS expenses_category_date_idx ON expenses (category_id, expense_date)",
+    ]),
+    (4, "add id to the expense ordering index for keyset pagination", [
+        # No note in INCLUDE: an unbounded text column can exceed the btree
+        # row limit and make inserts, or this very step, fail
+        """
+        CREATE INDEX IF NOT EXISTS expenses_date_id_idx
+            ON expenses (expense_date DESC, created_at DESC, id DESC)
+            INCLUDE (amount, category_id)
+        """,
+        "DROP INDEX IF EXISTS expenses_date_idx",
+    ]),
+    (5, "notify listeners when expenses or categories change", [
+        # Statement-level, so a bulk write sends one notification, and NOTIFY
+        # itself is only delivered once the writing transaction commits
+        """
+        CREATE OR REPLACE FUNCTION notify_data_changed() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('expense_tracker_changes', TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE TRIGGER expenses_notify_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON expenses
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_data_changed()
+        """,
+        """
+        CREATE OR REPLACE TRIGGER categories_notify_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON categories
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_data_changed()
+        """,
+    ]),
+    (6, "daily per-category rollup of expenses", [
+        # Uncategorized expenses are kept under category_id 0 so the key stays NOT NULL
+        """
+        CREATE TABLE IF NOT EXISTS daily_category_totals (
+            expense_date date not null,
+            category_id integer not null,
+            total numeric(14,2) not null,
+            count integer not null,
+            primary key (expense_date, category_id)
+        )
+        """,
+        # Lets the trigger find emptied buckets without scanning the rollup
+        "CREATE INDEX IF NOT EXISTS daily_category_totals_empty_idx ON daily_category_totals (expense_date) WHERE count = 0",
+        # Statement-level with transition tables: a bulk write applies one
+        # grouped delta instead of one upsert per row
+        """
+        CREATE OR REPLACE FUNCTION apply_daily_category_totals() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO daily_category_totals AS t (expense_date, category_id, total, count)
+                SELECT expense_date, coalesce(category_id, 0), sum(amount), count(*)
+                FROM new_rows GROUP BY 1, 2
+                ON CONFLICT (expense_date, category_id) DO UPDATE
+                    SET total = t.total + EXCLUDED.total, count = t.count + EXCLUDED.count;
+            ELSIF TG_OP = 'DELETE' THEN
+                INSERT INTO daily_category_totals AS t (expense_date, category_id, total, count)
+                SELECT expense_date, coalesce(category_id, 0), -sum(amount), -count(*)
+                FROM old_rows GROUP BY 1, 2
+                ON CONFLICT (expense_date, category_id) DO UPDATE
+                    SET total = t.total + EXCLUDED.total, count = t.count + EXCLUDED.count;
+            ELSE
+                INSERT INTO daily_category_totals AS t (expense_date, category_id, total, count)
+                SELECT expense_date, category_id, sum(amount), sum(n)
+                FROM (
+                    SELECT expense_date, coalesce(category_id, 0) AS category_id, amount, 1 AS n FROM new_rows
+                    UNION ALL
+                    SELECT expense_date, coalesce(category_id, 0), -amount, -1 FROM old_rows
+                ) changes
+                GROUP BY 1, 2
+                ON CONFLICT (expense_date, category_id) DO UPDATE
+                    SET total = t.total + EXCLUDED.total, count = t.count + EXCLUDED.count;
+            END IF;
+            DELETE FROM daily_category_totals WHERE count = 0;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE TRIGGER expenses_rollup_insert
+            AFTER INSERT ON expenses REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_daily_category_totals()
+        """,
+        """
+        CREATE OR REPLACE TRIGGER expenses_rollup_delete
+            AFTER DELETE ON expenses REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_daily_category_totals()
+        """,
+        """
+        CREATE OR REPLACE TRIGGER expenses_rollup_update
+            AFTER UPDATE ON expenses REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_daily_category_totals()
+        """,
+        # Backfill; maintenance.py rebuild-rollup repairs drift later
+        "DELETE FROM daily_category_totals",
+        """
+        INSERT INTO daily_category_totals (expense_date, category_id, total, count)
+        SELECT expense_date, coalesce(category_id, 0), sum(amount), count(*)
+        FROM expenses GROUP BY 1, 2
+        """,
+    ]),
+    (7, "content hash for deduplicating bulk imports", [
+        "ALTER TABLE expenses ADD COLUMN IF NOT EXISTS import_hash text",
+        # Rows entered by hand have no hash and are never treated as duplicates
+        "CREATE UNIQUE INDEX IF NOT EXISTS expenses_import_hash_idx ON expenses (import_hash) WHERE import_hash IS NOT NULL",
+    ]),
+    (8, "indexes for sorted and category-filtered transaction pages", [
+        # Replaces (category_id, expense_date): same prefix, plus the full
+        # newest-first key so a category-filtered page needs no sort
+        """
+        CREATE INDEX IF NOT EXISTS expenses_category_order_idx
+            ON expenses (category_id, expense_date DESC, created_at DESC, id DESC)
+        """,
+        "DROP INDEX IF EXISTS expenses_category_date_idx",
+        "CREATE INDEX IF NOT EXISTS expenses_amount_idx ON expenses (amount DESC, id DESC)",
+    ]),
+    (9, "trash table so deletes can be undone", [
+        # Deleted rows move here rather than being flagged in expenses, so the
+        # rollup, the covering indexes and every read only ever see live rows
+        """
+        CREATE TABLE IF NOT EXISTS deleted_expenses (
+            id integer primary key,
+            amount numeric(10,2) not null,
+            category_id integer references categories(id) on delete set null,
+            note text,
+            expense_date date not null,
+            created_at timestamp with time zone,
+            import_hash text,
+            deleted_at timestamp with time zone not null default now()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS deleted_expenses_deleted_at_idx ON deleted_expenses (deleted_at)",
+    ]),
+    (10, "full-text and trigram indexes on expense notes", [
+        # Expression index; db.NOTE_TSVECTOR must stay identical for it to be used
+        "CREATE INDEX IF NOT EXISTS expenses_note_fts_idx ON expenses USING gin (to_tsvector('english', coalesce(note, '')))",
+        # pg_trgm ships with Postgres contrib and every major hosted Postgres.
+        # Where it is missing, note search falls back to full-text matches only.
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+                CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                CREATE INDEX IF NOT EXISTS expenses_note_trgm_idx ON expenses USING gin (note gin_trgm_ops);
+            END IF;
+        END
+        $$
+        """,
+    ]),
+    (11, "index for per-category top expenses", [
+        # expense_date is included so period filters are checked in the index
+        """
+        CREATE INDEX IF NOT EXISTS expenses_category_amount_idx
+            ON expenses (category_id, amount DESC, id DESC) INCLUDE (expense_date)
+        """,
+    ]),
+    (12, "partition expenses by month", [
+        # Every period filter is a range on expense_date, so each one prunes
+        # to the months it covers, and vacuum and index builds work on one
+        # month at a time. Partitions are named expenses_YYYY_MM; rows dated
+        # in a month without one land in expenses_default until
+        # create_expense_partitions() moves them (see maintenance.py).
+        """
+        CREATE OR REPLACE FUNCTION create_expense_partition(month date) RETURNS boolean AS $$
+        DECLARE
+            first_day date := date_trunc('month', month);
+            next_day date := date_trunc('month', month) + interval '1 month';
+            partition text := 'expenses_' || to_char(month, 'YYYY_MM');
+        BEGIN
+            IF to_regclass(partition) IS NOT NULL THEN
+                RETURN false;
+            END IF;
+            EXECUTE format('CREATE TABLE %I (LIKE expenses)', partition);
+            -- Rows move straight between partitions, so the rollup and
+            -- notify triggers on expenses don't see them
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM expenses_default WHERE expense_date >= %L AND expense_date < %L RETURNING *)'
+                ' INSERT INTO %I SELECT * FROM moved', first_day, next_day, partition);
+            EXECUTE format('ALTER TABLE expenses ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           partition, first_day, next_day);
+            RETURN true;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        # Every month from first_day to last_day, plus any month with rows in
+        # expenses_default; returns how many partitions were created
+        """
+        CREATE OR REPLACE FUNCTION create_expense_partitions(first_day date, last_day date) RETURNS integer AS $$
+        DECLARE
+            month date;
+            created integer := 0;
+        BEGIN
+            PERFORM pg_advisory_xact_lock(727002);
+            FOR month IN
+                SELECT generate_series(date_trunc('month', first_day), last_day, interval '1 month')::date
+                UNION
+                SELECT DISTINCT date_trunc('month', expense_date)::date FROM expenses_default
+            LOOP
+                IF create_expense_partition(month) THEN
+                    created := created + 1;
+                END IF;
+            END LOOP;
+            RETURN created;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "ALTER TABLE expenses RENAME TO expenses_unpartitioned",
+        """
+        CREATE TABLE expenses (
+            id integer generated by default as identity,
+            amount numeric(10,2) not null,
+            category_id integer,
+            note text,
+            expense_date date not null,
+            created_at timestamp with time zone default now(),
+            import_hash text
+        ) PARTITION BY RANGE (expense_date)
+        """,
+        "CREATE TABLE expenses_default PARTITION OF expenses DEFAULT",
+        # One partition per month that has expenses (not every month in
+        # between, so a mistyped year doesn't create centuries of them),
+        # then this month and the next three
+        """
+        SELECT create_expense_partition(month)
+        FROM (SELECT DISTINCT date_trunc('month', expense_date)::date AS month FROM expenses_unpartitioned) months
+        """,
+        "SELECT create_expense_partitions(current_date, (current_date + interval '3 months')::date)",
+        """
+        INSERT INTO expenses (id, amount, category_id, note, expense_date, created_at, import_hash)
+        SELECT id, amount, category_id, note, expense_date, created_at, import_hash FROM expenses_unpartitioned
+        """,
+        # Restored expenses keep their ids, so count the trash too
+        """
+        SELECT setval(pg_get_serial_sequence('expenses', 'id'),
+                      greatest((SELECT max(id) FROM expenses_unpartitioned), (SELECT max(id) FROM deleted_expenses), 1))
+        """,
+        "DROP TABLE expenses_unpartitioned",
+        # Keys and indexes as before (steps 1, 4, 7, 8, 10 and 11), built once
+        # the rows are in. Unique keys must include the partition key: the
+        # primary key becomes (id, expense_date), and the import hash already
+        # covers the date.
+        "ALTER TABLE expenses ADD PRIMARY KEY (id, expense_date)",
+        "ALTER TABLE expenses ADD FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE SET NULL",
+        """
+        CREATE INDEX expenses_date_id_idx
+            ON expenses (expense_date DESC, created_at DESC, id DESC)
+            INCLUDE (amount, category_id)
+        """,
+        """
+        CREATE UNIQUE INDEX expenses_import_hash_idx
+            ON expenses (import_hash, expense_date) WHERE import_hash IS NOT NULL
+        """,
+        """
+        CREATE INDEX expenses_category_order_idx
+            ON expenses (category_id, expense_date DESC, created_at DESC, id DESC)
+        """,
+        "CREATE INDEX expenses_amount_idx ON expenses (amount DESC, id DESC)",
+        "CREATE INDEX expenses_note_fts_idx ON expenses USING gin (to_tsvector('english', coalesce(note, '')))",
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX expenses_note_trgm_idx ON expenses USING gin (note gin_trgm_ops);
+            END IF;
+        END
+        $$
+        """,
+        """
+        CREATE INDEX expenses_category_amount_idx
+            ON expenses (category_id, amount DESC, id DESC) INCLUDE (expense_date)
+        """,
+        # The triggers went with the old table; the rollup already matches the copied rows
+        """
+        CREATE TRIGGER expenses_notify_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON expenses
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_data_changed()
+        """,
+        """
+        CREATE TRIGGER expenses_rollup_insert
+            AFTER INSERT ON expenses REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_daily_category_totals()
+        """,
+        """
+        CREATE TRIGGER expenses_rollup_delete
+            AFTER DELETE ON expenses REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_daily_category_totals()
+        """,
+        """
+        CREATE TRIGGER expenses_rollup_update
+            AFTER UPDATE ON expenses REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_daily_category_totals()
+        """,
+        "ANALYZE expenses",
+    ]),
+    (13, "per-month change versions for snapshot readers", [
+        # Bumped from a shared sequence by every write to a month, so a
+        # month's version never repeats, even after archiving empties it
+        "CREATE SEQUENCE IF NOT EXISTS expense_month_version_seq",
+        """
+        CREATE TABLE IF NOT EXISTS expense_month_versions (
+            month date primary key,
+            version bigint not null
+        )
+        """,
+        """
+        CREATE OR REPLACE FUNCTION bump_expense_month_versions() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO expense_month_versions (month, version)
+                SELECT month, nextval('expense_month_version_seq')
+                FROM (SELECT DISTINCT date_trunc('month', expense_date)::date AS month FROM new_rows) months
+                ON CONFLICT (month) DO UPDATE SET version = EXCLUDED.version;
+            END IF;
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                INSERT INTO expense_month_versions (month, version)
+                SELECT month, nextval('expense_month_version_seq')
+                FROM (SELECT DISTINCT date_trunc('month', expense_date)::date AS month FROM old_rows) months
+                ON CONFLICT (month) DO UPDATE SET version = EXCLUDED.version;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE TRIGGER expenses_month_versions_insert
+            AFTER INSERT ON expenses REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_expense_month_versions()
+        """,
+        """
+        CREATE OR REPLACE TRIGGER expenses_month_versions_delete
+            AFTER DELETE ON expenses REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_expense_month_versions()
+        """,
+        """
+        CREATE OR REPLACE TRIGGER expenses_month_versions_update
+            AFTER UPDATE ON expenses REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_expense_month_versions()
+        """,
+        """
+        INSERT INTO expense_month_versions (month, version)
+        SELECT month, nextval('expense_month_version_seq')
+        FROM (SELECT DISTINCT date_trunc('month', expense_date)::date AS month FROM daily_category_totals) months
+        ON CONFLICT (month) DO NOTHING
+        """,
+    ]),
+]
+
+
+def current_version(cursor):
+    cursor.execute("SELECT coalesce(max(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+def migrate(conn):
+    """Apply pending migrations and return the resulting schema version."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version integer primary key,
+                description text not null,
+                applied_at timestamp with time zone default now()
+            )
+        """)
+        conn.commit()
+
+        version = current_version(cursor)
+        for step, description, statements in MIGRATIONS:
+            if step <= version:
+                continue
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                (step, description)
+            )
+            conn.commit()
+            version = step
+        create_partitions(conn)
+        return version
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+        cursor.close()
+
+
+@st.cache_resource(show_spinner=False)
+def _ensure_schema():
+    with get_connection() as conn:
+        if conn:
+            return migrate(conn)
+
+
+# Once per process; later reruns hit the cache and never touch the database
+def ensure_schema():
+    version = _ensure_schema()
+    if version is None:
+        # Database was unreachable, try again on the next rerun
+        _ensure_schema.clear()
+    return version
+
+
+if __name__ == "__main__":
+    with get_connection() as conn:
+        if not conn:
+            sys.exit(1)
+        print(f"Schema at version {migrate(conn)}")
@@ -0,0 +1,40 @@
+"""Background import of the Analytics page's heavy dependencies.
+
+pandas, plotly and pyarrow take about a second to import and only Analytics
+needs them, so tracker.py imports them inside that page. To keep the first
+switch to Analytics from paying for it, start_prewarm() imports them on a
+daemon thread while the user is still on another page. Python's per-module
+import locks make a page that gets there first simply wait for the thread.
+
+Set ``prewarm_analytics = false`` in secrets to turn it off.
+"""
+import importlib
+import logging
+import threading
+import time
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_MODULES = ("pandas", "plotly.graph_objects", "charts", "exporter")
+
+
+def _import_all(modules):
+    started = time.perf_counter()
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            # The page import will raise the same error where it can be seen
+            logger.exception("Prewarming %s failed", name)
+            return
+    logger.info("Prewarmed %s in %.2fs", ", ".join(modules), time.perf_counter() - started)
+
+
+# Once per process
+@st.cache_resource(show_spinner=False)
+def start_prewarm(modules=ANALYTICS_MODULES):
+    thread = threading.Thread(target=_import_all, args=(modules,), name="analytics-prewarm", daemon=True)
+    thread.start()
+    return thread
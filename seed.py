@@ -0,0 +1,149 @@
+"""Seed a local database with realistic synthetic expenses.
+
+Volumes are configurable from thousands to tens of millions of rows, and the
+data is shaped like real spending rather than spread uniformly:
+
+* more expenses in recent months than years ago (a growing user base),
+* busier weekends,
+* a few common categories and a long tail, with category-specific
+  log-normal amounts and a monthly bill spike on the 1st,
+* notes drawn from a merchant vocabulary, some left empty.
+
+The app has no notion of users, so there is no per-user dimension to seed.
+
+Rows are generated inside Postgres with generate_series and inserted in
+batches, so the rollup triggers see bounded transition tables.
+
+    python seed.py --expenses 1000000 --days 1825 --categories 20 --truncate
+"""
+import argparse
+import sys
+import time
+from datetime import date, timedelta
+
+from db import get_connection
+from maintenance import create_partitions
+from migrations import migrate
+
+MERCHANTS = [
+    "Swiggy order", "Zomato dinner", "Cafe coffee", "Big Bazaar groceries", "Milk and bread",
+    "Uber ride", "Ola cab", "Metro card recharge", "Petrol", "Parking",
+    "Amazon order", "Flipkart order", "Myntra clothes", "Electricity bill", "Mobile recharge",
+    "Broadband bill", "Rent", "Netflix subscription", "Movie tickets", "Concert",
+    "Pharmacy", "Doctor visit", "Gym membership", "Online course", "Books",
+    "Pizza Hut", "Dominos pizza", "Birthday gift", "Haircut", "Laundry",
+]
+
+EXTRA_CATEGORIES_SQL = """
+    INSERT INTO categories (name, color, icon)
+    SELECT 'Category ' || g, '#' || lpad(to_hex((random() * 16777215)::int), 6, '0'), '📦'
+    FROM generate_series(1, %(count)s) g
+    ON CONFLICT (name) DO NOTHING
+"""
+
+# Per row: r_day shapes the date (sqrt skews towards recent days), r_weekend
+# moves some weekday expenses onto the following Saturday or Sunday,
+# r_category picks popular categories far more often than the tail, and z is
+# a standard normal (Box-Muller) for log-normal amounts.
+EXPENSES_SQL = """
+    WITH cats AS (
+        SELECT array_agg(id ORDER BY id) AS ids FROM categories
+    ),
+    draws AS (
+        SELECT g, random() AS r_day, random() AS r_weekend, random() AS r_category, random() AS r_note,
+               random() AS r_time, sqrt(-2 * ln(1 - random())) * cos(2 * pi() * random()) AS z
+        FROM generate_series(%(first)s, %(last)s) g
+    ),
+    shaped AS (
+        SELECT d.*,
+               current_date - %(days)s + 1 + floor(sqrt(d.r_day) * %(days)s)::int AS day,
+               cats.ids[1 + floor(power(d.r_category, 2) * cardinality(cats.ids))::int] AS category_id
+        FROM draws d, cats
+    ),
+    dated AS (
+        SELECT s.*,
+               CASE WHEN s.r_weekend < 0.3 AND extract(isodow FROM s.day) < 6
+                    THEN least(s.day + (6 - extract(isodow FROM s.day)::int) + (s.r_weekend < 0.15)::int, current_date)
+                    ELSE s.day END AS expense_date
+        FROM shaped s
+    )
+    INSERT INTO expenses (amount, category_id, note, expense_date, created_at)
+    SELECT round(least(greatest(
+               exp(5.0 + 0.6 * (category_id %% 5) + 0.8 * z)
+               * CASE WHEN extract(day FROM expense_date) = 1 AND category_id %% 4 = 0 THEN 8 ELSE 1 END,
+               1), 99999)::numeric, 2),
+           category_id,
+           CASE WHEN r_note < 0.2 THEN NULL
+                ELSE (%(merchants)s::text[])[1 + floor(r_note * r_note * %(merchant_count)s)::int] END,
+           expense_date,
+           expense_date + make_interval(secs => r_time * 86399)
+    FROM dated
+"""
+
+
+def seed(conn, expenses, days=3 * 365, categories=0, truncate=False, batch_size=1_000_000, seed_value=0.42,
+         progress=None):
+    """Insert synthetic expenses (and optionally extra categories); returns rows inserted."""
+    cursor = conn.cursor()
+    try:
+        # Same seed, same data
+        cursor.execute("SELECT setseed(%s)", (seed_value,))
+        if truncate:
+            # TRUNCATE bypasses the rollup's row triggers, so clear the rollup too
+            cursor.execute("TRUNCATE expenses, deleted_expenses, daily_category_totals")
+        if categories:
+            cursor.execute(EXTRA_CATEGORIES_SQL, {"count": categories})
+        conn.commit()
+        # Partitions for every seeded month, so no row lands in expenses_default
+        create_partitions(conn, since=date.today() - timedelta(days=days))
+
+        inserted = 0
+        for first in range(1, expenses + 1, batch_size):
+            last = min(first + batch_size - 1, expenses)
+            cursor.execute(EXPENSES_SQL, {
+                "first": first, "last": last, "days": days,
+                "merchants": MERCHANTS, "merchant_count": len(MERCHANTS),
+            })
+            conn.commit()
+            inserted += cursor.rowcount
+            if progress:
+                progress(inserted)
+
+        conn.autocommit = True
+        try:
+            cursor.execute("VACUUM ANALYZE expenses, daily_category_totals")
+        finally:
+            conn.autocommit = False
+        return inserted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--expenses", type=int, default=100_000, help="expenses to insert")
+    parser.add_argument("--days", type=int, default=3 * 365, help="spread expenses over this many days up to today")
+    parser.add_argument("--categories", type=int, default=0, help="extra categories beyond the defaults")
+    parser.add_argument("--truncate", action="store_true", help="delete all existing expenses first")
+    parser.add_argument("--batch-size", type=int, default=1_000_000, help="rows per INSERT statement")
+    parser.add_argument("--seed", type=float, default=0.42, help="random seed in [-1, 1]")
+    args = parser.parse_args()
+
+    with get_connection() as conn:
+        if not conn:
+            return 1
+        migrate(conn)
+        started = time.perf_counter()
+        count = seed(
+            conn, args.expenses, args.days, args.categories, args.truncate, args.batch_size, args.seed,
+            progress=lambda done: print(f"  {done:,} / {args.expenses:,}", file=sys.stderr),
+        )
+    print(f"Inserted {count:,} expenses in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
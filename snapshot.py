@@ -0,0 +1,429 @@
+"""Parquet snapshots of closed months for long-range Analytics.
+
+Months before the current one rarely change, yet "All Time" and the other
+long ranges aggregate every one of them again after each write. refresh()
+exports each closed month to ``<snapshot_dir>/month=YYYY-MM/expenses.parquet``
+(exporter.py's columns: date, amount, category, note). SnapshotStorage then
+answers the summary, trend and comparison queries by aggregating those files
+with pyarrow, and asks the live backend only for the days the snapshot
+doesn't cover: the open month, plus any month closed since the last refresh.
+
+A month is exported again when its fingerprint, a hash of its per-day,
+per-category counts and totals, stops matching the live data. That catches
+back-dated inserts, imports and deletes alike, which a created_at watermark
+would miss. Every write to a month also bumps its version (see
+Storage.get_month_versions(); triggers keep it, whichever process wrote), and
+the manifest records the versions the snapshot was taken at. A closed month
+whose version has moved on since is read live until it is exported again, so
+another worker's delete or back-dated insert shows as soon as its NOTIFY
+empties this worker's query cache. Refresh on a schedule to keep that live
+part small:
+
+    python snapshot.py
+
+or let the app do it in the background every ``snapshot_refresh_minutes``
+(default 60; 0 turns it off). Only one process refreshes a directory at a
+time, holding a lock file beside the manifest; the others skip their turn.
+Setting ``snapshot_dir`` in secrets turns snapshots on.
+"""
+import argparse
+import functools
+try:
+    import fcntl
+except ImportError:  # Windows: refreshes aren't serialized
+    fcntl = None
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+
+import streamlit as st
+
+from cache import cached
+from db import get_query_cache, previous_period, _checkout_succeeded
+from storage import Storage
+from trend import bucket_start, choose_granularity, lttb
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+LOCK_FILE = ".refresh.lock"
+# Lower bound for "everything before the open month"
+FIRST_DAY = date(1, 1, 1)
+
+
+def open_month(today=None):
+    """First day of the month still being written to."""
+    return (today or date.today()).replace(day=1)
+
+
+def month_range(month):
+    """First and last day of a 'YYYY-MM' month."""
+    first = date.fromisoformat(month + "-01")
+    return first, (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+
+def fingerprints(daily):
+    """{'YYYY-MM': hash of the month's get_daily_totals() rows}."""
+    months = defaultdict(list)
+    for row in daily:
+        months[row['expense_date'].strftime('%Y-%m')].append(
+            f"{row['expense_date']}|{row['category_name']}|{row['count']}|{row['total']:.2f}"
+        )
+    # Sorted here because backends order NULL category names differently
+    return {month: hashlib.sha1("\n".join(sorted(rows)).encode()).hexdigest() for month, rows in months.items()}
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_atomically(path, write):
+    """Call write(out) on a file beside path and rename it over path, unless write returns None.
+
+    Readers never see a half-written file.
+    """
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            result = write(out)
+        if result is not None:
+            os.replace(temporary, path)
+        return result
+    finally:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+
+
+@contextmanager
+def _refresh_lock(directory):
+    """Yields whether this process got the directory's refresh lock; never waits for it."""
+    if fcntl is None:
+        yield True
+        return
+    with open(os.path.join(directory, LOCK_FILE), "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def refresh(store, directory, today=None):
+    """Bring the snapshot up to date with store; returns what changed, or None if store is unavailable.
+
+    If another process is refreshing the directory, returns at once with 'skipped' set.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with _refresh_lock(directory) as acquired:
+        if not acquired:
+            return {'written': [], 'removed': [], 'unchanged': 0, 'skipped': True}
+        return _refresh(store, directory, today)
+
+
+def _refresh(store, directory, today):
+    until = open_month(today)
+    # Read before the totals: a write landing in between leaves its month
+    # with a newer version than the snapshot records, so it is read live
+    versions = store.get_month_versions()
+    daily = store.get_daily_totals(FIRST_DAY, until - timedelta(days=1))
+    if versions is None or daily is None:
+        return None
+    manifest = load_manifest(directory) or {'months': {}}
+    current = fingerprints(daily)
+
+    written = []
+    for month, fingerprint in sorted(current.items()):
+        if manifest['months'].get(month, {}).get('fingerprint') == fingerprint:
+            continue
+        partition = os.path.join(directory, f"month={month}")
+        os.makedirs(partition, exist_ok=True)
+        rows = _write_atomically(os.path.join(partition, "expenses.parquet"),
+                                 lambda out: store.export_file(out, *month_range(month), 'parquet'))
+        if rows is None:
+            return None
+        manifest['months'][month] = {'fingerprint': fingerprint, 'rows': rows}
+        written.append(month)
+
+    # Months whose expenses have all been deleted since
+    removed = sorted(set(manifest['months']) - set(current))
+    for month in removed:
+        del manifest['months'][month]
+        shutil.rmtree(os.path.join(directory, f"month={month}"), ignore_errors=True)
+
+    manifest['until'] = until.isoformat()
+    manifest['versions'] = {month: version for month, version in versions.items() if month < until.strftime('%Y-%m')}
+    manifest['refreshed_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    _write_atomically(os.path.join(directory, MANIFEST), lambda out: out.write(json.dumps(manifest, indent=2).encode()))
+    return {'written': written, 'removed': removed, 'unchanged': len(current) - len(written), 'skipped': False}
+
+
+# A month's file only changes along with its fingerprint, so its daily totals
+# are read once per process rather than after every write
+@functools.lru_cache(maxsize=512)
+def month_daily(path, fingerprint):
+    """get_daily_totals() rows for one snapshotted month."""
+    # Imported here so only Analytics over snapshotted months pay for pyarrow
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path, columns=['date', 'category', 'amount'])
+    grouped = table.group_by(['date', 'category']).aggregate([('amount', 'sum'), ('amount', 'count')])
+    return [
+        {'expense_date': row['date'], 'category_name': row['category'],
+         'count': row['amount_count'], 'total': round(row['amount_sum'], 2)}
+        for row in grouped.to_pylist()
+    ]
+
+
+def _delegate(name):
+    def method(self, *args, **kwargs):
+        return getattr(self.store, name)(*args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+class SnapshotStorage(Storage):
+    """Wraps a backend; Analytics over closed months read the Parquet snapshot instead."""
+
+    def __init__(self, store, directory):
+        self.store = store
+        self.directory = directory
+        self._manifest = None
+        self._manifest_mtime = None
+
+    ensure_schema = _delegate('ensure_schema')
+    get_categories = _delegate('get_categories')
+    add_category = _delegate('add_category')
+    add_expense = _delegate('add_expense')
+    get_expenses = _delegate('get_expenses')
+    get_top_expenses = _delegate('get_top_expenses')
+    get_top_expenses_by_category = _delegate('get_top_expenses_by_category')
+    search_notes = _delegate('search_notes')
+    get_daily_totals = _delegate('get_daily_totals')
+    delete_expenses = _delegate('delete_expenses')
+    restore_expenses = _delegate('restore_expenses')
+    delete_expense = _delegate('delete_expense')
+    import_file = _delegate('import_file')
+    export_file = _delegate('export_file')
+
+    def manifest(self):
+        """The current manifest, re-read whenever a refresh has replaced it."""
+        try:
+            mtime = os.stat(os.path.join(self.directory, MANIFEST)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self._manifest_mtime:
+            self._manifest, self._manifest_mtime = load_manifest(self.directory), mtime
+        return self._manifest
+
+    def _split(self, start_date, end_date):
+        """(snapshot range, live ranges, snapshot version), or None if the snapshot can't help.
+
+        The live ranges are the open month's part of the period, and the part
+        of any closed month written to since it was exported.
+        """
+        manifest = self.manifest()
+        if not manifest:
+            return None
+        until = date.fromisoformat(manifest['until'])
+        if start_date and start_date >= until:
+            return None
+        versions = self.store.get_month_versions()
+        if versions is None:
+            return None
+        last_closed = until - timedelta(days=1)
+        first, last = start_date or FIRST_DAY, min(end_date, last_closed) if end_date else last_closed
+        exported = manifest.get('versions', {})
+        live = []
+        for month in sorted(set(versions) | set(exported)):
+            month_first, month_last = month_range(month)
+            if month_first <= last and month_last >= first and versions.get(month) != exported.get(month):
+                live.append((max(month_first, first), min(month_last, last)))
+        if not end_date or end_date >= until:
+            live.append((max(start_date or until, until), end_date or date.max))
+        return (first, last), tuple(live), manifest['refreshed_at']
+
+    def _snapshot_daily(self, first, last, skip=()):
+        """Snapshot rows from first to last, leaving out the 'YYYY-MM' months in skip."""
+        daily = []
+        for month, entry in sorted(self.manifest()['months'].items()):
+            month_first, month_last = month_range(month)
+            if month_last < first or month_first > last or month in skip:
+                continue
+            rows = month_daily(os.path.join(self.directory, f"month={month}", "expenses.parquet"), entry['fingerprint'])
+            if first > month_first or last < month_last:
+                rows = [row for row in rows if first <= row['expense_date'] <= last]
+            daily += rows
+        return daily
+
+    def _daily(self, split):
+        """get_daily_totals() over every part of a split; None if a live part is unavailable."""
+        (first, last), live, _ = split
+        daily = self._snapshot_daily(first, last, {live_first.strftime('%Y-%m') for live_first, _ in live})
+        for live_range in live:
+            rows = self.store.get_daily_totals(*live_range)
+            if rows is None:
+                return None
+            daily += rows
+        return daily
+
+    def get_expense_summary(self, start_date=None, end_date=None):
+        split = self._split(start_date, end_date)
+        if split is None:
+            return self.store.get_expense_summary(start_date, end_date)
+        return self._summary(split)
+
+    @cached(get_query_cache, _checkout_succeeded)
+    def _summary(self, split):
+        daily = self._daily(split)
+        if daily is None:
+            return None
+        categories = {category['name']: category for category in self.store.get_categories()}
+        count = sum(row['count'] for row in daily)
+        total = round(sum(row['total'] for row in daily), 2)
+        by_category, by_weekday = defaultdict(float), defaultdict(float)
+        for row in daily:
+            if row['category_name'] in categories:
+                by_category[row['category_name']] += row['total']
+            by_weekday[row['expense_date'].isoweekday()] += row['total']
+        return {
+            'totals': {'count': count, 'total': total, 'average': total / count if count else 0.0},
+            'by_category': [
+                {'category_name': name, 'color': categories[name]['color'], 'icon': categories[name]['icon'],
+                 'amount': round(amount, 2)}
+                for name, amount in sorted(by_category.items(), key=lambda item: item[1], reverse=True)
+            ],
+            'by_weekday': [{'weekday': day, 'amount': round(amount, 2)} for day, amount in sorted(by_weekday.items())],
+        }
+
+    def get_spending_trend(self, start_date=None, end_date=None, max_points=90):
+        split = self._split(start_date, end_date)
+        if split is None:
+            return self.store.get_spending_trend(start_date, end_date, max_points)
+        return self._trend(split, start_date, end_date, max_points)
+
+    @cached(get_query_cache, _checkout_succeeded)
+    def _trend(self, split, start_date, end_date, max_points):
+        daily = self._daily(split)
+        if daily is None:
+            return None
+        if start_date and end_date:
+            first, last = start_date, end_date
+        else:
+            days = [row['expense_date'] for row in daily]
+            first, last = (min(days), max(days)) if days else (None, None)
+        granularity = choose_granularity(first, last, max_points) if first else 'day'
+        buckets = defaultdict(float)
+        for row in daily:
+            buckets[bucket_start(row['expense_date'], granularity)] += row['total']
+        points = [{'date': day, 'amount': round(amount, 2)} for day, amount in sorted(buckets.items())]
+
+        downsampled = len(points) > max_points
+        if downsampled:
+            x = [point['date'].toordinal() for point in points]
+            y = [point['amount'] for point in points]
+            points = [points[i] for i in lttb(x, y, max_points)]
+        return {'granularity': granularity, 'points': points, 'downsampled': downsampled}
+
+    def get_period_comparison(self, start_date, end_date):
+        prev_start, _ = previous_period(start_date, end_date)
+        split = self._split(prev_start, end_date)
+        if split is None:
+            return self.store.get_period_comparison(start_date, end_date)
+        return self._comparison(split, start_date)
+
+    @cached(get_query_cache, _checkout_succeeded)
+    def _comparison(self, split, start_date):
+        daily = self._daily(split)
+        if daily is None:
+            return None
+        categories = {category['name']: category for category in self.store.get_categories()}
+        rows = {}
+        for row in daily:
+            name = row['category_name']
+            if name not in rows:
+                category = categories.get(name, {})
+                rows[name] = {'category_name': name, 'color': category.get('color'), 'icon': category.get('icon'),
+                              'current_total': 0.0, 'current_count': 0, 'previous_total': 0.0, 'previous_count': 0}
+            part = 'current' if row['expense_date'] >= start_date else 'previous'
+            rows[name][f'{part}_total'] += row['total']
+            rows[name][f'{part}_count'] += row['count']
+
+        result = sorted(rows.values(), key=lambda row: row['current_total'], reverse=True)
+        for row in result:
+            row['current_total'] = round(row['current_total'], 2)
+            row['previous_total'] = round(row['previous_total'], 2)
+            row['change'] = row['current_total'] - row['previous_total']
+        return {
+            'current': {'total': round(sum(row['current_total'] for row in result), 2),
+                        'count': sum(row['current_count'] for row in result)},
+            'previous': {'total': round(sum(row['previous_total'] for row in result), 2),
+                         'count': sum(row['previous_count'] for row in result)},
+            'categories': result,
+        }
+
+
+def _refresh_forever(store, directory, interval):
+    while True:
+        try:
+            started = time.perf_counter()
+            changes = refresh(store, directory)
+            if changes and (changes['written'] or changes['removed']):
+                logger.info("Snapshot refreshed in %.1fs: %d month(s) written, %d removed",
+                            time.perf_counter() - started, len(changes['written']), len(changes['removed']))
+        except Exception:
+            logger.exception("Snapshot refresh failed")
+        time.sleep(interval)
+
+
+# Once per process
+@st.cache_resource(show_spinner=False)
+def start_refresher(_store, directory, interval):
+    thread = threading.Thread(target=_refresh_forever, args=(_store, directory, interval),
+                              name="snapshot-refresh", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export closed months to the Parquet snapshot")
+    parser.add_argument("--dir", help="snapshot directory (defaults to snapshot_dir in secrets)")
+    args = parser.parse_args()
+    directory = args.dir or st.secrets.get("snapshot_dir")
+    if not directory:
+        parser.error("no --dir given and no snapshot_dir in secrets")
+
+    # Imported here, as storage.py imports this module
+    from storage import get_backend
+    store = get_backend()
+    store.ensure_schema()
+    started = time.perf_counter()
+    changes = refresh(store, directory)
+    if changes is None:
+        return 1
+    if changes['skipped']:
+        print(f"another process is refreshing {directory}; try again later", file=sys.stderr)
+        return 1
+    print(f"{len(changes['written'])} month(s) written, {len(changes['removed'])} removed, "
+          f"{changes['unchanged']} unchanged in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
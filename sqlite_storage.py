@@ -0,0 +1,582 @@
+"""Embedded SQLite backend (``backend = "sqlite"`` in secrets).
+
+For single-user and offline deployments, and for running the whole app
+without a server. The schema mirrors the Postgres one minus the
+server-side machinery:
+
+* no daily rollup: the Analytics group-bys read expenses directly, which at
+  one user's volume takes milliseconds;
+* no LISTEN/NOTIFY: writes from this process invalidate the query cache,
+  other processes' writes show up within cache_ttl;
+* no trigram matching: note search uses an FTS5 index with the porter
+  stemmer, or a substring match where SQLite was built without FTS5.
+
+Dates are stored as ISO text and timestamps as UTC text with millisecond
+precision, so both sort and compare as text; rows are converted back to
+date / datetime on the way out.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+import streamlit as st
+
+from cache import cached
+from db import EXPENSE_ORDERS, UNDO_WINDOW, DUPLICATE_CATEGORY, get_query_cache, data_changed, empty_frame, previous_period
+from instrumentation import TimedCursor, current
+from storage import Storage
+from trend import GRANULARITIES, choose_granularity, lttb
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%f'
+NOW = f"strftime('{TIMESTAMP_FORMAT}', 'now')"
+
+MIGRATIONS = [
+    (1, "create categories, expenses and the undo trash", [
+        f"""
+        CREATE TABLE IF NOT EXISTS categories (
+            id integer primary key,
+            name text unique not null,
+            color text default '#667eea',
+            icon text default '📦',
+            created_at text default ({NOW})
+        )
+        """,
+        # AUTOINCREMENT so a deleted expense's id is never reused while it can be restored
+        f"""
+        CREATE TABLE IF NOT EXISTS expenses (
+            id integer primary key autoincrement,
+            amount real not null,
+            category_id integer references categories(id) on delete set null,
+            note text,
+            expense_date text not null,
+            created_at text not null default ({NOW}),
+            import_hash text
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS expenses_import_hash_idx ON expenses (import_hash) WHERE import_hash IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS expenses_date_idx ON expenses (expense_date, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS expenses_amount_idx ON expenses (amount, id)",
+        "CREATE INDEX IF NOT EXISTS expenses_category_idx ON expenses (category_id, expense_date)",
+        f"""
+        CREATE TABLE IF NOT EXISTS deleted_expenses (
+            id integer primary key,
+            amount real not null,
+            category_id integer references categories(id) on delete set null,
+            note text,
+            expense_date text not null,
+            created_at text,
+            import_hash text,
+            deleted_at text not null default ({NOW})
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS deleted_expenses_deleted_at_idx ON deleted_expenses (deleted_at)",
+        """
+        INSERT INTO categories (name, color, icon) VALUES
+            ('Food', '#FF6B6B', '🍔'),
+            ('Transport', '#4ECDC4', '🚗'),
+            ('Shopping', '#45B7D1', '🛍️'),
+            ('Bills', '#FFA07A', '💡'),
+            ('Entertainment', '#98D8C8', '🎬'),
+            ('Health', '#F7DC6F', '⚕️'),
+            ('Education', '#BB8FCE', '📚'),
+            ('Others', '#B19CD9', '📦')
+        ON CONFLICT (name) DO NOTHING
+        """,
+    ]),
+    (2, "per-month change versions for snapshot readers", [
+        # Rows are never deleted here, so max() + 1 never repeats a version
+        "CREATE TABLE IF NOT EXISTS expense_month_versions (month text primary key, version integer not null)",
+        "CREATE INDEX IF NOT EXISTS expense_month_versions_version_idx ON expense_month_versions (version)",
+        """
+        CREATE TRIGGER IF NOT EXISTS expenses_month_versions_insert AFTER INSERT ON expenses BEGIN
+            INSERT INTO expense_month_versions (month, version)
+            VALUES (substr(new.expense_date, 1, 7), (SELECT coalesce(max(version), 0) + 1 FROM expense_month_versions))
+            ON CONFLICT (month) DO UPDATE SET version = excluded.version;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS expenses_month_versions_delete AFTER DELETE ON expenses BEGIN
+            INSERT INTO expense_month_versions (month, version)
+            VALUES (substr(old.expense_date, 1, 7), (SELECT coalesce(max(version), 0) + 1 FROM expense_month_versions))
+            ON CONFLICT (month) DO UPDATE SET version = excluded.version;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS expenses_month_versions_update AFTER UPDATE ON expenses BEGIN
+            INSERT INTO expense_month_versions (month, version)
+            VALUES (substr(old.expense_date, 1, 7), (SELECT coalesce(max(version), 0) + 1 FROM expense_month_versions))
+            ON CONFLICT (month) DO UPDATE SET version = excluded.version;
+            INSERT INTO expense_month_versions (month, version)
+            VALUES (substr(new.expense_date, 1, 7), (SELECT coalesce(max(version), 0) + 1 FROM expense_month_versions))
+            ON CONFLICT (month) DO UPDATE SET version = excluded.version;
+        END
+        """,
+        """
+        INSERT INTO expense_month_versions (month, version)
+        SELECT substr(expense_date, 1, 7), row_number() OVER () FROM expenses GROUP BY 1
+        """,
+    ]),
+]
+
+# Applied only where SQLite has FTS5; search_notes() checks for the table
+FTS_STATEMENTS = [
+    # External content: the index stores only tokens, the notes stay in expenses
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts
+        USING fts5(note, content='expenses', content_rowid='id', tokenize='porter unicode61')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS expenses_fts_insert AFTER INSERT ON expenses BEGIN
+        INSERT INTO expenses_fts (rowid, note) VALUES (new.id, new.note);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS expenses_fts_delete AFTER DELETE ON expenses BEGIN
+        INSERT INTO expenses_fts (expenses_fts, rowid, note) VALUES ('delete', old.id, old.note);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS expenses_fts_update AFTER UPDATE OF note ON expenses BEGIN
+        INSERT INTO expenses_fts (expenses_fts, rowid, note) VALUES ('delete', old.id, old.note);
+        INSERT INTO expenses_fts (rowid, note) VALUES (new.id, new.note);
+    END
+    """,
+    "INSERT INTO expenses_fts (expenses_fts) VALUES ('rebuild')",
+]
+
+# date_trunc() equivalents; weeks start on Monday as in Postgres
+BUCKETS = {
+    'day': "e.expense_date",
+    'week': "date(e.expense_date, '-6 days', 'weekday 1')",
+    'month': "date(e.expense_date, 'start of month')",
+    'quarter': "printf('%s-%02d-01', strftime('%Y', e.expense_date),"
+               " (CAST(strftime('%m', e.expense_date) AS integer) - 1) / 3 * 3 + 1)",
+}
+
+DATE_COLUMNS = ('expense_date', 'date')
+TIMESTAMP_COLUMNS = ('created_at', 'deleted_at')
+
+EXPENSE_COLUMNS = """
+    e.id, e.amount, e.category_id, e.note, e.expense_date, e.created_at,
+    c.name AS category_name, c.color, c.icon
+"""
+
+
+def _timestamp(value):
+    """A datetime as stored: UTC, millisecond precision."""
+    value = value.astimezone(timezone.utc)
+    return value.strftime('%Y-%m-%d %H:%M:%S.') + f"{value.microsecond // 1000:03d}"
+
+
+def _param(value):
+    if isinstance(value, datetime):
+        return _timestamp(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _row(columns, values):
+    row = dict(zip(columns, values))
+    for column in DATE_COLUMNS:
+        if row.get(column) is not None:
+            row[column] = date.fromisoformat(row[column])
+    for column in TIMESTAMP_COLUMNS:
+        if row.get(column) is not None:
+            row[column] = datetime.fromisoformat(row[column]).replace(tzinfo=timezone.utc)
+    return row
+
+
+def _fetch(cursor, query, params=(), as_frame=False):
+    cursor.execute(query, [_param(value) for value in params])
+    columns = [column[0] for column in cursor.description]
+    if as_frame:
+        from frames import typed_frame
+        return typed_frame(cursor.fetchall(), columns)
+    return [_row(columns, values) for values in cursor.fetchall()]
+
+
+def _period(start_date, end_date, column='e.expense_date'):
+    if start_date and end_date:
+        return f"{column} BETWEEN ? AND ?", [start_date, end_date]
+    return None, []
+
+
+def _ids(expense_ids):
+    # One parameter for any number of ids
+    return json.dumps([int(expense_id) for expense_id in expense_ids])
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path, timeout=10.0):
+        self.path = path
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._schema_lock = threading.Lock()
+        self._schema_version = None
+        # An embedded file has no deploy step, so it is brought up to date on open
+        self.ensure_schema()
+
+    def _connect(self):
+        # Handed between threads by _connection(), but only ever used by one at a time
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+            with self._lock:
+                self._idle.append(conn)
+
+    @staticmethod
+    def _cursor(conn):
+        cursor = conn.cursor()
+        metrics = current()
+        return cursor if metrics is None else TimedCursor(cursor, metrics)
+
+    def ensure_schema(self):
+        if self._schema_version is not None:
+            return self._schema_version
+        with self._schema_lock, self._connection() as conn:
+            # WAL lets readers carry on while an import or delete commits
+            conn.execute("PRAGMA journal_mode = WAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            fts = any(option == 'ENABLE_FTS5' for (option,) in conn.execute("PRAGMA compile_options"))
+            for step, _, statements in MIGRATIONS:
+                if step > version:
+                    for statement in statements:
+                        conn.execute(statement)
+                    if step == 1 and fts:
+                        for statement in FTS_STATEMENTS:
+                            conn.execute(statement)
+                    # PRAGMA takes no parameters; step is an int from MIGRATIONS
+                    conn.execute(f"PRAGMA user_version = {step}")
+                    conn.commit()
+                    version = step
+            self._schema_version = version
+        return version
+
+    @cached(get_query_cache)
+    def get_categories(self):
+        with self._connection() as conn:
+            return _fetch(self._cursor(conn), "SELECT * FROM categories ORDER BY name")
+
+    def _write(self, query, params, duplicate=None):
+        """duplicate, if given, is the error shown when a unique key rejects the row."""
+        with self._connection() as conn:
+            try:
+                cursor = self._cursor(conn)
+                cursor.execute(query, [_param(value) for value in params])
+                conn.commit()
+                data_changed()
+                return True
+            except sqlite3.IntegrityError as e:
+                st.error(duplicate or f"Error: {e}")
+                return False
+            except sqlite3.Error as e:
+                st.error(f"Error: {e}")
+                return False
+
+    def add_category(self, name, color, icon):
+        return self._write("INSERT INTO categories (name, color, icon) VALUES (?, ?, ?)", (name, color, icon),
+                           duplicate=DUPLICATE_CATEGORY.format(name=name))
+
+    def add_expense(self, amount, category_id, note, expense_date):
+        return self._write(
+            "INSERT INTO expenses (amount, category_id, note, expense_date) VALUES (?, ?, ?, ?)",
+            (round(float(amount), 2), category_id, note, expense_date)
+        )
+
+    @cached(get_query_cache)
+    def get_expenses(self, start_date=None, end_date=None, limit=None, after=None, order='newest',
+                     category_id=None, amount=None, note=None, as_frame=False):
+        columns, direction = EXPENSE_ORDERS[order]
+        key = ", ".join(f"e.{column}" for column in columns)
+        condition, params = _period(start_date, end_date)
+        conditions = [condition] if condition else []
+        if category_id is not None:
+            conditions.append("e.category_id = ?")
+            params.append(category_id)
+        if amount is not None:
+            conditions.append("e.amount = ?")
+            params.append(float(amount))
+        if note:
+            # LIKE is case-insensitive for ASCII; wildcards typed by the user are taken literally
+            conditions.append("e.note LIKE ? ESCAPE '\\'")
+            params.append("%" + note.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if after:
+            conditions.append(f"({key}) {'<' if direction == 'DESC' else '>'} ({', '.join(['?'] * len(columns))})")
+            params += list(after)
+
+        query = f"SELECT {EXPENSE_COLUMNS} FROM expenses e LEFT JOIN categories c ON e.category_id = c.id"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY " + ", ".join(f"e.{column} {direction}" for column in columns)
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._connection() as conn:
+            return _fetch(self._cursor(conn), query, params, as_frame)
+
+    @cached(get_query_cache)
+    def get_top_expenses_by_category(self, start_date=None, end_date=None, n=3, as_frame=False):
+        condition, params = _period(start_date, end_date)
+        query = f"""
+            SELECT * FROM (
+                SELECT c.id AS category_id, c.name AS category_name, c.color, c.icon,
+                       e.id, e.amount, e.note, e.expense_date, e.created_at,
+                       row_number() OVER (PARTITION BY e.category_id ORDER BY e.amount DESC, e.id DESC) AS rank
+                FROM expenses e
+                JOIN categories c ON e.category_id = c.id
+                {'WHERE ' + condition if condition else ''}
+            )
+            WHERE rank <= ?
+            ORDER BY category_name, rank
+        """
+        with self._connection() as conn:
+            return _fetch(self._cursor(conn), query, params + [n], as_frame)
+
+    @cached(get_query_cache)
+    def search_notes(self, text, start_date=None, end_date=None, limit=20, offset=0, as_frame=False):
+        condition, params = _period(start_date, end_date)
+        period = f" AND {condition}" if condition else ""
+        with self._connection() as conn:
+            cursor = self._cursor(conn)
+            cursor.execute("SELECT exists(SELECT 1 FROM sqlite_master WHERE name = 'expenses_fts')", ())
+            if cursor.fetchone()[0]:
+                # Every word must match, as quoted FTS5 strings so punctuation can't form operators
+                words = re.findall(r"\w+", text)
+                if not words:
+                    return empty_frame() if as_frame else []
+                query = f"""
+                    SELECT {EXPENSE_COLUMNS}, -bm25(expenses_fts) AS rank
+                    FROM expenses_fts
+                    JOIN expenses e ON e.id = expenses_fts.rowid
+                    LEFT JOIN categories c ON e.category_id = c.id
+                    WHERE expenses_fts MATCH ?{period}
+                """
+                params = [" ".join(f'"{word}"' for word in words)] + params
+            else:
+                query = f"""
+                    SELECT {EXPENSE_COLUMNS}, 1.0 AS rank
+                    FROM expenses e
+                    LEFT JOIN categories c ON e.category_id = c.id
+                    WHERE e.note LIKE ? ESCAPE '\\'{period}
+                """
+                params = ["%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"] + params
+            query += " ORDER BY rank DESC, e.expense_date DESC, e.id DESC LIMIT ? OFFSET ?"
+            return _fetch(cursor, query, params + [limit, offset], as_frame)
+
+    @cached(get_query_cache)
+    def get_expense_summary(self, start_date=None, end_date=None):
+        condition, params = _period(start_date, end_date)
+        where = f" WHERE {condition}" if condition else ""
+        queries = {
+            'totals': """
+                SELECT count(*) AS count, round(coalesce(sum(e.amount), 0), 2) AS total,
+                       coalesce(avg(e.amount), 0) AS average
+                FROM expenses e
+            """ + where,
+            'by_category': """
+                SELECT c.name AS category_name, c.color, c.icon, round(sum(e.amount), 2) AS amount
+                FROM expenses e
+                JOIN categories c ON e.category_id = c.id
+            """ + where + " GROUP BY c.id ORDER BY amount DESC",
+            # ISO numbering like Postgres' isodow: Monday = 1 ... Sunday = 7
+            'by_weekday': """
+                SELECT (CAST(strftime('%w', e.expense_date) AS integer) + 6) % 7 + 1 AS weekday,
+                       round(sum(e.amount), 2) AS amount
+                FROM expenses e
+            """ + where + " GROUP BY 1 ORDER BY 1",
+        }
+        with self._connection() as conn:
+            cursor = self._cursor(conn)
+            summary = {name: _fetch(cursor, query, params) for name, query in queries.items()}
+        summary['totals'] = summary['totals'][0]
+        return summary
+
+    @cached(get_query_cache)
+    def get_spending_trend(self, start_date=None, end_date=None, max_points=90):
+        condition, params = _period(start_date, end_date)
+        with self._connection() as conn:
+            cursor = self._cursor(conn)
+            if not (start_date and end_date):
+                cursor.execute("SELECT min(expense_date), max(expense_date) FROM expenses", ())
+                first, last = (date.fromisoformat(value) if value else None for value in cursor.fetchone())
+            else:
+                first, last = start_date, end_date
+            granularity = choose_granularity(first, last, max_points) if first else 'day'
+            if granularity not in GRANULARITIES:
+                raise ValueError(f"Unknown granularity {granularity!r}")
+            points = _fetch(cursor, f"""
+                SELECT {BUCKETS[granularity]} AS date, round(sum(e.amount), 2) AS amount
+                FROM expenses e
+                {'WHERE ' + condition if condition else ''}
+                GROUP BY 1 ORDER BY 1
+            """, params)
+
+        downsampled = len(points) > max_points
+        if downsampled:
+            x = [point['date'].toordinal() for point in points]
+            y = [point['amount'] for point in points]
+            points = [points[i] for i in lttb(x, y, max_points)]
+        return {'granularity': granularity, 'points': points, 'downsampled': downsampled}
+
+    @cached(get_query_cache)
+    def get_period_comparison(self, start_date, end_date):
+        prev_start, _ = previous_period(start_date, end_date)
+        query = """
+            SELECT c.name AS category_name, c.color, c.icon,
+                   round(coalesce(sum(e.amount) FILTER (WHERE e.expense_date >= :start), 0), 2) AS current_total,
+                   count(*) FILTER (WHERE e.expense_date >= :start) AS current_count,
+                   round(coalesce(sum(e.amount) FILTER (WHERE e.expense_date < :start), 0), 2) AS previous_total,
+                   count(*) FILTER (WHERE e.expense_date < :start) AS previous_count
+            FROM expenses e
+            LEFT JOIN categories c ON e.category_id = c.id
+            WHERE e.expense_date BETWEEN :prev_start AND :end
+            GROUP BY c.id
+            ORDER BY current_total DESC
+        """
+        with self._connection() as conn:
+            cursor = self._cursor(conn)
+            cursor.execute(query, {'start': _param(start_date), 'end': _param(end_date),
+                                   'prev_start': _param(prev_start)})
+            columns = [column[0] for column in cursor.description]
+            categories = [_row(columns, values) for values in cursor.fetchall()]
+
+        for row in categories:
+            row['change'] = row['current_total'] - row['previous_total']
+        return {
+            'current': {'total': round(sum(row['current_total'] for row in categories), 2),
+                        'count': sum(row['current_count'] for row in categories)},
+            'previous': {'total': round(sum(row['previous_total'] for row in categories), 2),
+                         'count': sum(row['previous_count'] for row in categories)},
+            'categories': categories,
+        }
+
+    @cached(get_query_cache)
+    def get_daily_totals(self, start_date=None, end_date=None):
+        condition, params = _period(start_date, end_date)
+        query = f"""
+            SELECT e.expense_date, c.name AS category_name, count(*) AS count, round(sum(e.amount), 2) AS total
+            FROM expenses e
+            LEFT JOIN categories c ON e.category_id = c.id
+            {'WHERE ' + condition if condition else ''}
+            GROUP BY 1, 2 ORDER BY 1, 2
+        """
+        with self._connection() as conn:
+            return _fetch(self._cursor(conn), query, params)
+
+    @cached(get_query_cache)
+    def get_month_versions(self):
+        with self._connection() as conn:
+            cursor = self._cursor(conn)
+            cursor.execute("SELECT month, version FROM expense_month_versions", ())
+            return dict(cursor.fetchall())
+
+    def _move(self, expense_ids, copy_sql, delete_sql, purge=False):
+        """Copy rows between expenses and the trash, then delete the originals; returns rows copied."""
+        if not expense_ids:
+            return 0
+        ids = _ids(expense_ids)
+        with self._connection() as conn:
+            try:
+                cursor = self._cursor(conn)
+                if purge:
+                    cursor.execute("DELETE FROM deleted_expenses WHERE deleted_at < ?",
+                                   (_timestamp(datetime.now(timezone.utc) - UNDO_WINDOW),))
+                cursor.execute(copy_sql, (ids,))
+                moved = cursor.rowcount
+                cursor.execute(delete_sql, (ids,))
+                conn.commit()
+                data_changed()
+                return moved
+            except sqlite3.Error as e:
+                st.error(f"Error: {e}")
+                return 0
+
+    def delete_expenses(self, expense_ids):
+        return self._move(expense_ids, """
+            INSERT OR IGNORE INTO deleted_expenses (id, amount, category_id, note, expense_date, created_at, import_hash)
+            SELECT id, amount, category_id, note, expense_date, created_at, import_hash
+            FROM expenses WHERE id IN (SELECT value FROM json_each(?))
+        """, "DELETE FROM expenses WHERE id IN (SELECT value FROM json_each(?))", purge=True)
+
+    def restore_expenses(self, expense_ids):
+        return self._move(expense_ids, """
+            INSERT OR IGNORE INTO expenses (id, amount, category_id, note, expense_date, created_at, import_hash)
+            SELECT id, amount, category_id, note, expense_date, created_at, import_hash
+            FROM deleted_expenses WHERE id IN (SELECT value FROM json_each(?))
+        """, "DELETE FROM deleted_expenses WHERE id IN (SELECT value FROM json_each(?))")
+
+    def import_file(self, source, **options):
+        """importer.import_csv() for SQLite: rows are inserted as they are read.
+
+        The content hash is computed as in importer.MERGE_SQL, so a file
+        imported on either backend is recognised by the other.
+        """
+        from importer import read_chunks
+
+        result = {'read': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0, 'unmapped_categories': 0}
+        occurrences = Counter()
+        with self._connection() as conn:
+            cursor = self._cursor(conn)
+            try:
+                cursor.execute("SELECT lower(name), id FROM categories", ())
+                category_ids = dict(cursor.fetchall())
+                for cleaned in read_chunks(source, category_ids, result, **options):
+                    rows = []
+                    # Missing category ids and notes as None rather than pandas' NA
+                    cleaned = cleaned.astype(object).where(cleaned.notna(), None)
+                    for row in cleaned.itertuples(index=False):
+                        key = (row.expense_date, f"{row.amount:.2f}", row.category.lower(), row.note or '')
+                        occurrences[key] += 1
+                        import_hash = hashlib.md5("|".join(key + (str(occurrences[key]),)).encode()).hexdigest()
+                        rows.append((row.amount, row.category_id, row.note, row.expense_date, import_hash))
+                    cursor.executemany(
+                        "INSERT OR IGNORE INTO expenses (amount, category_id, note, expense_date, import_hash) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        rows
+                    )
+                    result['inserted'] += cursor.rowcount
+                result['duplicates'] = result['read'] - result['rejected'] - result['inserted']
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        if result['inserted']:
+            data_changed()
+        return result
+
+    def export_file(self, out, start_date=None, end_date=None, fmt='csv', chunk_size=50_000):
+        from exporter import FORMATS, fetch_chunks, write_chunks
+
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format {fmt!r}, expected one of {', '.join(FORMATS)}")
+        condition, params = _period(start_date, end_date)
+        query = """
+            SELECT e.expense_date AS date, e.amount, c.name AS category, e.note
+            FROM expenses e
+            LEFT JOIN categories c ON e.category_id = c.id
+        """ + (f" WHERE {condition}" if condition else "") + \
+            " ORDER BY e.expense_date DESC, e.created_at DESC, e.id DESC"
+        with self._connection() as conn:
+            cursor = self._cursor(conn)
+            cursor.execute(query, [_param(value) for value in params])
+            # write_chunks() parses the ISO date text a whole chunk at a time
+            return write_chunks(fetch_chunks(cursor, chunk_size), out, fmt)
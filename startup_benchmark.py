@@ -0,0 +1,96 @@
+"""Measure time-to-first-render for each page of tracker.py.
+
+Every run renders the app in a fresh Python process, so imports, the
+connection pool and the query cache start cold, as in a new worker. A worker
+always lands on the default page first; other pages are timed from the
+moment the user switches to them. Point .streamlit/secrets.toml at a
+database first, then:
+
+    python startup_benchmark.py --runs 5
+    python startup_benchmark.py --no-prewarm --think-time 2
+
+"heavy" lists which of pandas / numpy / plotly / pyarrow the app had loaded
+once the page rendered (the test harness preloads plotly, so it never shows).
+Without prewarming, the landing page should need none of them.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+TRACKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tracker.py")
+PAGES = ("➕ Add Expense", "📊 Analytics", "🏷️ Categories")
+HEAVY_MODULES = ("pandas", "numpy", "plotly", "pyarrow")
+
+
+def render(page, prewarm, think_time):
+    """Runs in the child process: render page cold and report timings as JSON."""
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(TRACKER, default_timeout=300)
+    app.secrets = dict(st.secrets.to_dict(), prewarm_analytics=prewarm)
+    # The test harness itself imports some of these; only count the app's
+    preloaded = {name for name in HEAVY_MODULES if name in sys.modules}
+
+    started = time.perf_counter()
+    app.run()
+    result = {"page": page, "landing": time.perf_counter() - started}
+    if page != PAGES[0]:
+        time.sleep(think_time)
+        app.sidebar.radio[0].set_value(page)
+        started = time.perf_counter()
+        app.run()
+    result["render"] = time.perf_counter() - started
+    result["heavy"] = [name for name in HEAVY_MODULES if name in sys.modules and name not in preloaded]
+    result["errors"] = [str(element.value) for element in list(app.exception) + list(app.error)]
+    print(json.dumps(result))
+
+
+def measure(page, prewarm, think_time):
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", page, "--think-time", str(think_time)]
+        + ([] if prewarm else ["--no-prewarm"]),
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per page")
+    parser.add_argument("--pages", nargs="+", choices=PAGES, default=PAGES)
+    parser.add_argument("--no-prewarm", dest="prewarm", action="store_false",
+                        help="render with prewarm_analytics disabled")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="seconds on the landing page before switching pages")
+    parser.add_argument("--json", metavar="FILE", help="also write every run's results to FILE")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        render(args.child, args.prewarm, args.think_time)
+        return 0
+
+    runs = []
+    failed = False
+    for page in args.pages:
+        results = [measure(page, args.prewarm, args.think_time) for _ in range(args.runs)]
+        runs += results
+        failed = failed or any(result["errors"] for result in results)
+        renders = [result["render"] for result in results]
+        print(f"{page:<16} median {statistics.median(renders) * 1000:7.0f} ms"
+              f"  min {min(renders) * 1000:7.0f} ms  heavy: {', '.join(results[-1]['heavy']) or '-'}"
+              + "".join(f"\n      {error}" for result in results for error in result["errors"]))
+
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump({"prewarm": args.prewarm, "think_time": args.think_time, "runs": runs}, out, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
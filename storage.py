@@ -0,0 +1,123 @@
+"""The data operations tracker.py needs, independent of where the data lives.
+
+get_storage() returns the backend chosen by ``backend`` in secrets:
+
+* ``postgres`` (default): the server in secrets, through db.py's pooled
+  connections, rollup tables and LISTEN/NOTIFY cache invalidation;
+* ``sqlite``: an embedded database file at ``sqlite_path`` (default
+  ``expenses.db``), for single-user and offline deployments and for running
+  the whole app without a server.
+
+Every backend returns the same shapes: lists of plain dicts with the same
+keys, dates as datetime.date and timestamps as aware datetimes.
+
+With ``snapshot_dir`` set, get_storage() also serves long-range Analytics
+from Parquet snapshots of closed months (see snapshot.py).
+"""
+import streamlit as st
+
+BACKENDS = ('postgres', 'sqlite')
+
+
+class Storage:
+    """Interface implemented by each backend; see db.py for the reference behaviour."""
+
+    def ensure_schema(self):
+        """Create or upgrade the schema; cheap once it is current."""
+        raise NotImplementedError
+
+    def get_categories(self):
+        raise NotImplementedError
+
+    def add_category(self, name, color, icon):
+        """Returns True if the category was added, or shows db.DUPLICATE_CATEGORY and returns False if the name is taken."""
+        raise NotImplementedError
+
+    def add_expense(self, amount, category_id, note, expense_date):
+        """Returns True if the expense was added."""
+        raise NotImplementedError
+
+    def get_expenses(self, start_date=None, end_date=None, limit=None, after=None, order='newest',
+                     category_id=None, amount=None, note=None, as_frame=False):
+        """Expenses in the period in db.EXPENSE_ORDERS order, resuming after a db.expense_cursor().
+
+        A list of dicts, or with as_frame a DataFrame typed by frames.py.
+        """
+        raise NotImplementedError
+
+    def get_top_expenses(self, start_date=None, end_date=None, n=5):
+        return self.get_expenses(start_date, end_date, limit=n, order='largest')
+
+    def get_top_expenses_by_category(self, start_date=None, end_date=None, n=3, as_frame=False):
+        raise NotImplementedError
+
+    def search_notes(self, text, start_date=None, end_date=None, limit=20, offset=0, as_frame=False):
+        raise NotImplementedError
+
+    def get_expense_summary(self, start_date=None, end_date=None):
+        """{'totals', 'by_category', 'by_weekday'}, or None if the data is unavailable."""
+        raise NotImplementedError
+
+    def get_spending_trend(self, start_date=None, end_date=None, max_points=90):
+        """{'granularity', 'points', 'downsampled'}, or None if the data is unavailable."""
+        raise NotImplementedError
+
+    def get_period_comparison(self, start_date, end_date):
+        """{'current', 'previous', 'categories'}, or None if the data is unavailable."""
+        raise NotImplementedError
+
+    def get_daily_totals(self, start_date=None, end_date=None):
+        """Spending per day and category: expense_date, category_name (None if uncategorized), count, total."""
+        raise NotImplementedError
+
+    def get_month_versions(self):
+        """{'YYYY-MM': version} that changes whenever expenses dated in that month do, whichever
+        process wrote them; None if the data is unavailable."""
+        raise NotImplementedError
+
+    def delete_expenses(self, expense_ids):
+        """Returns how many were deleted; restore_expenses() undoes it for db.UNDO_WINDOW."""
+        raise NotImplementedError
+
+    def restore_expenses(self, expense_ids):
+        raise NotImplementedError
+
+    def delete_expense(self, expense_id):
+        return self.delete_expenses([expense_id])
+
+    def import_file(self, source, **options):
+        """Import a CSV file (see importer.read_chunks for options); None if the data is unavailable."""
+        raise NotImplementedError
+
+    def export_file(self, out, start_date=None, end_date=None, fmt='csv', chunk_size=50_000):
+        """Write the period's expenses to out (see exporter.py); None if the data is unavailable."""
+        raise NotImplementedError
+
+
+# Once per process
+@st.cache_resource(show_spinner=False)
+def get_backend():
+    """The live backend chosen in secrets."""
+    backend = st.secrets.get("backend", "postgres")
+    if backend == 'postgres':
+        from db import PostgresStorage
+        return PostgresStorage()
+    if backend == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(st.secrets.get("sqlite_path", "expenses.db"))
+    raise ValueError(f"Unknown storage backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+
+# Once per process
+@st.cache_resource(show_spinner=False)
+def get_storage():
+    """get_backend(), reading closed months from Parquet snapshots if snapshot_dir is set (see snapshot.py)."""
+    store = get_backend()
+    directory = st.secrets.get("snapshot_dir")
+    if not directory:
+        return store
+    from snapshot import SnapshotStorage, start_refresher
+    interval = float(st.secrets.get("snapshot_refresh_minutes", 60)) * 60
+    if interval > 0:
+        start_refresher(store, directory, interval)
+    return SnapshotStorage(store, directory)
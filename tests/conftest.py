@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+from streamlit import config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SECRETS = """
+backend = "sqlite"
+listen_for_changes = false
+"""
+
+
+def pytest_configure():
+    # Keep the developer's own secrets (and their Postgres server) out of the tests
+    path = os.path.join(os.environ.get("TMPDIR", "/tmp"), f"expense_tracker_test_secrets_{os.getpid()}.toml")
+    with open(path, "w") as out:
+        out.write(SECRETS)
+    config.set_option("secrets.files", [path])
+
+
+@pytest.fixture
+def store(tmp_path):
+    from db import get_query_cache
+    from sqlite_storage import SQLiteStorage
+
+    # The query cache is per process; start every test from an empty one
+    get_query_cache().invalidate()
+    return SQLiteStorage(str(tmp_path / "expenses.db"))
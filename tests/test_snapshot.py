@@ -0,0 +1,45 @@
+"""The Parquet snapshot over the SQLite backend: closed months written since export are read live."""
+from datetime import date
+
+import pytest
+
+from snapshot import SnapshotStorage, _refresh_lock, refresh
+
+CLOSED = date(2024, 3, 4)
+TODAY = date(2024, 5, 15)
+
+
+@pytest.fixture
+def snapshot(store, tmp_path):
+    for day in range(1, 4):
+        assert store.add_expense(10.0 * day, None, 'closed', CLOSED.replace(day=day))
+    changes = refresh(store, str(tmp_path / "snapshot"), TODAY)
+    assert changes['written'] == ['2024-03'] and not changes['skipped']
+    return SnapshotStorage(store, str(tmp_path / "snapshot"))
+
+
+def test_writes_bump_the_month_version(store):
+    assert store.add_expense(5.0, None, 'x', CLOSED)
+    before = store.get_month_versions()
+    assert store.add_expense(5.0, None, 'y', CLOSED)
+    after = store.get_month_versions()
+    assert after['2024-03'] > before['2024-03']
+
+
+def test_changed_closed_month_is_read_live(store, snapshot):
+    assert snapshot._split(date(2024, 3, 1), date(2024, 3, 31))[1] == ()
+
+    # As if another worker wrote it: only the database's versions record the change
+    ids = [row['id'] for row in store.get_expenses(date(2024, 3, 1), date(2024, 3, 31), limit=1)]
+    assert store.delete_expenses(ids) == 1
+    assert snapshot._split(date(2024, 3, 1), date(2024, 3, 31))[1] == ((date(2024, 3, 1), date(2024, 3, 31)),)
+    assert snapshot.get_expense_summary(date(2024, 3, 1), date(2024, 3, 31))['totals'] == \
+        store.get_expense_summary(date(2024, 3, 1), date(2024, 3, 31))['totals']
+
+
+def test_refresh_skips_while_another_holds_the_lock(store, snapshot, tmp_path):
+    directory = str(tmp_path / "snapshot")
+    with _refresh_lock(directory) as acquired:
+        assert acquired
+        assert refresh(store, directory, TODAY)['skipped']
+    assert not refresh(store, directory, TODAY)['skipped']
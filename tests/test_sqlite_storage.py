@@ -0,0 +1,174 @@
+"""The app's storage scenarios against the embedded SQLite backend, plus the pure helpers."""
+import io
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+from cache import QueryCache
+from db import expense_cursor
+from importer import MAX_NOTE_LENGTH, _clean_chunk
+from trend import bucket_count, choose_granularity, lttb
+
+START = date(2024, 3, 4)  # a Monday
+END = START + timedelta(days=6)
+
+
+def category_id(store, name):
+    return next(category['id'] for category in store.get_categories() if category['name'] == name)
+
+
+def add_week(store):
+    food, bills = category_id(store, 'Food'), category_id(store, 'Bills')
+    for offset, amount, category, note in [
+        (0, 12.5, food, 'lunch'),
+        (0, 40.0, bills, 'phone'),
+        (2, 7.25, food, 'coffee'),
+        (3, 120.0, bills, 'electricity'),
+        (6, 30.0, None, 'cash'),
+    ]:
+        assert store.add_expense(amount, category, note, START + timedelta(days=offset))
+
+
+def test_summary(store):
+    add_week(store)
+    store.add_expense(99.0, None, 'outside the period', END + timedelta(days=1))
+
+    summary = store.get_expense_summary(START, END)
+    assert summary['totals']['count'] == 5
+    assert summary['totals']['total'] == pytest.approx(209.75)
+    assert {row['category_name']: row['amount'] for row in summary['by_category']} == {
+        'Bills': pytest.approx(160.0), 'Food': pytest.approx(19.75),
+    }
+    assert [row['weekday'] for row in summary['by_weekday']] == [1, 3, 4, 7]
+
+    comparison = store.get_period_comparison(START, END)
+    assert comparison['current'] == {'total': pytest.approx(209.75), 'count': 5}
+    assert comparison['previous'] == {'total': 0, 'count': 0}
+
+
+def test_add_category_rejects_duplicate_names(store):
+    assert store.add_category('Travel', '#123456', '✈️')
+    assert not store.add_category('Travel', '#654321', '🧳')
+    assert [category['name'] for category in store.get_categories()].count('Travel') == 1
+
+
+@pytest.mark.parametrize('order', ['newest', 'oldest', 'largest', 'smallest'])
+def test_keyset_pages_cover_the_period_once(store, order):
+    add_week(store)
+    everything = store.get_expenses(START, END, order=order)
+
+    pages, after = [], None
+    while True:
+        page = store.get_expenses(START, END, limit=2, after=after, order=order)
+        if not page:
+            break
+        pages.append(page)
+        after = expense_cursor(page[-1], order)
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [row['id'] for page in pages for row in page] == [row['id'] for row in everything]
+
+
+@pytest.mark.parametrize('order', ['newest', 'largest'])
+def test_frames_match_rows(store, order):
+    add_week(store)
+    rows = store.get_expenses(START, END, order=order)
+    frame = store.get_expenses(START, END, limit=2, order=order, as_frame=True)
+
+    assert str(frame['amount'].dtype) == 'float64'
+    assert str(frame['expense_date'].dtype) == 'datetime64[ns]'
+    assert str(frame['category_name'].dtype) == 'category'
+    assert frame['id'].tolist() == [row['id'] for row in rows[:2]]
+
+    # A frame row resumes the keyset pages like the dict it stands for
+    after = store.get_expenses(START, END, after=expense_cursor(frame.iloc[-1], order), order=order, as_frame=True)
+    assert after['id'].tolist() == [row['id'] for row in rows[2:]]
+
+
+def test_delete_and_restore(store):
+    add_week(store)
+    rows = store.get_expenses(START, END, order='largest')
+    ids = [row['id'] for row in rows[:2]]
+
+    assert store.delete_expenses(ids) == 2
+    assert store.get_expense_summary(START, END)['totals']['count'] == 3
+    assert not set(ids) & {row['id'] for row in store.get_expenses(START, END)}
+
+    assert store.restore_expenses(ids) == 2
+    restored = store.get_expenses(START, END, order='largest')
+    assert [row['id'] for row in restored] == [row['id'] for row in rows]
+    assert store.get_expense_summary(START, END)['totals']['total'] == pytest.approx(209.75)
+
+
+def test_import_skips_rows_already_imported(store):
+    csv = (
+        "date,amount,category,note\n"
+        "2024-03-04,12.50,food,lunch\n"
+        "2024-03-04,12.50,food,lunch\n"  # a second identical lunch is a real expense
+        "2024-03-05,3.00,Nonexistent,bus\n"
+        "not a date,1.00,Food,bad\n"
+    )
+    first = store.import_file(io.StringIO(csv))
+    assert (first['read'], first['inserted'], first['rejected'], first['unmapped_categories']) == (4, 3, 1, 1)
+
+    again = store.import_file(io.StringIO(csv))
+    assert (again['inserted'], again['duplicates']) == (0, 3)
+    assert store.get_expense_summary(START, END)['totals']['count'] == 3
+
+
+def test_clean_chunk():
+    chunk = pd.DataFrame({
+        'date': ['2024-03-04', '2024-03-05', 'garbage', '2024-03-06', '2024-03-07'],
+        'amount': ['-12.5', '-₹1,234.50', '-5', '0', '-1'],
+        'category': [' Food ', 'unknown', 'Food', 'Food', None],
+        'note': ['lunch', 'x' * 600, None, None, ''],
+    })
+    columns = {'date': 'date', 'amount': 'amount', 'category': 'category', 'note': 'note'}
+    cleaned, rejected, unmapped = _clean_chunk(chunk, columns, {'food': 1, 'others': 8}, 8, None, True)
+
+    assert rejected == 2  # the bad date and the zero amount
+    assert unmapped == 2  # 'unknown' and the missing category fall back to Others
+    assert cleaned['expense_date'].tolist() == ['2024-03-04', '2024-03-05', '2024-03-07']
+    assert cleaned['amount'].tolist() == [12.5, 1234.5, 1.0]
+    assert cleaned['category_id'].tolist() == [1, 8, 8]
+    assert cleaned['note'].tolist()[:2] == ['lunch', 'x' * MAX_NOTE_LENGTH]
+    assert cleaned['note'].isna().tolist() == [False, False, True]
+
+
+def test_bucket_count():
+    assert bucket_count(START, END, 'day') == 7
+    assert bucket_count(START, END, 'week') == 1
+    assert bucket_count(date(2024, 1, 31), date(2024, 3, 1), 'month') == 3
+    assert bucket_count(date(2023, 12, 31), date(2024, 1, 1), 'quarter') == 2
+    assert choose_granularity(date(2020, 1, 1), date(2024, 12, 31), 90) == 'month'
+    with pytest.raises(ValueError):
+        bucket_count(START, END, 'year')
+
+
+def test_lttb_keeps_the_ends_and_the_peak():
+    y = [0.0] * 100
+    y[37] = 50.0
+    kept = list(lttb(range(100), y, 10))
+    assert len(kept) == 10
+    assert kept[0] == 0 and kept[-1] == 99
+    assert 37 in kept
+    assert kept == sorted(kept)
+    assert list(lttb(range(5), [1, 2, 3, 4, 5], 10)) == [0, 1, 2, 3, 4]
+
+
+def test_query_cache():
+    cache = QueryCache(maxsize=2, ttl=60)
+    cache.put('a', 1, cache.version)
+    cache.put('b', 2, cache.version)
+    assert cache.get('a') == (True, 1)
+    cache.put('c', 3, cache.version)  # evicts b, the least recently used
+    assert cache.get('b') == (False, None)
+
+    # A result read before a write committed is not kept
+    version = cache.version
+    cache.invalidate()
+    cache.put('d', 4, version)
+    assert cache.get('d') == (False, None)
+    assert cache.get('a') == (False, None)
+    assert cache.stats()['invalidations'] == 1
@@ -1,14 +1,16 @@
 import streamlit as st
 # import pymysql
 # from pymysql.err import MySQLError
-import psycopg2
-from psycopg2 import OperationalError
-from psycopg2.extras import DictCursor
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import calendar
+from functools import partial
+
+# pandas, plotly and pyarrow are imported by the pages that use them (see prewarm.py)
+from prewarm import start_prewarm
+from loader import load_all
+from instrumentation import start_rerun, annotate, finish_rerun, span
+from storage import get_storage
+from db import expense_cursor, UNDO_WINDOW
 
 # Page configuration
 st.set_page_config(
@@ -18,30 +20,37 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Initialize session state for theme (default is light)
-if 'theme' not in st.session_state:
-    st.session_state.theme = 'dark'
+# Per-rerun timings and query stats (see instrumentation.py); ?debug=1 also
+# shows them in the sidebar
+debug_panel = st.query_params.get("debug") == "1"
+if debug_panel or st.secrets.get("instrumentation", False):
+    start_rerun()
+
+try:
+    # Initialize session state for theme (default is light)
+    if 'theme' not in st.session_state:
+        st.session_state.theme = 'dark'
 
-# Dynamic CSS based on theme
-if st.session_state.theme == 'dark':
-    bg_color = '#1a1a1a'
-    card_bg = '#2d2d2d'
-    text_color = '#ffffff'
-    text_secondary = '#b0b0b0'
-    border_color = '#404040'
-    sidebar_bg = '#2d2d2d'
-    input_bg = '#404040'
-else:
-    bg_color = '#f8f9fa'
-    card_bg = '#ffffff'
-    text_color = '#1a1a1a'
-    text_secondary = '#6c757d'
-    border_color = '#e9ecef'
-    sidebar_bg = '#ffffff'
-    input_bg = '#ffffff'
+    # Dynamic CSS based on theme
+    if st.session_state.theme == 'dark':
+        bg_color = '#1a1a1a'
+        card_bg = '#2d2d2d'
+        text_color = '#ffffff'
+        text_secondary = '#b0b0b0'
+        border_color = '#404040'
+        sidebar_bg = '#2d2d2d'
+        input_bg = '#404040'
+    else:
+        bg_color = '#f8f9fa'
+        card_bg = '#ffffff'
+        text_color = '#1a1a1a'
+        text_secondary = '#6c757d'
+        border_color = '#e9ecef'
+        sidebar_bg = '#ffffff'
+        input_bg = '#ffffff'
 
-# Custom CSS with dynamic theme
-st.markdown(f"""
+    # Custom CSS with dynamic theme
+    st.markdown(f"""
     <style>
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap');
     
@@ -171,273 +180,114 @@ st.markdown(f"""
     </style>
 """, unsafe_allow_html=True)
 
-# Database connection
-def create_connection():
-    try:
-        connection = psycopg2.connect(
-            host=st.secrets["host"],
-            database=st.secrets["db"],
-            user=st.secrets["user"],
-            password=st.secrets["password"],
-            port=st.secrets["port"],
-            sslmode="require" 
-            # pool_mode='transaction'
-        )
-        return connection
-    except OperationalError as e:
-        st.error(f"Error connecting to PostgreSQL: {e}")
-        return None
-
-# Initialize database
-def init_database():
-    conn = create_connection()
-    if conn:
-        cursor = conn.cursor(cursor_factory=DictCursor)
-        
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS categories (
-                id integer generated by default as identity primary key,
-                name varchar(100) unique not null,
-                color varchar(7) default '#667eea',
-                icon varchar(50) default '📦',
-                created_at timestamp with time zone default now()
-            )
-        """)
-        
-        # Add icon column if it doesn't exist (migration)
-        try:
-            cursor.execute("""
-                    ALTER TABLE categories
-                    ADD COLUMN IF NOT EXISTS icon VARCHAR(50) DEFAULT '📦'
-            """)
-            conn.commit()
-        except OperationalError as e:
-            # Column already exists, ignore the error
-            pass
-        
-        cursor.execute("""
-             CREATE TABLE IF NOT EXISTS expenses (
-                id integer generated by default as identity primary key,
-                amount numeric(10,2) not null,
-                category_id integer references categories(id) on delete set null,
-                note text,
-                expense_date date not null,
-                created_at timestamp with time zone default now()
-            )
-        """)
-        
-        # Update existing categories with icons
-        icon_mapping = {
-            'Food': '🍔',
-            'Transport': '🚗',
-            'Shopping': '🛍️',
-            'Bills': '💡',
-            'Entertainment': '🎬',
-            'Health': '⚕️',
-            'Education': '📚',
-            'Others': '📦'
-        }
-        
-        for cat_name, cat_icon in icon_mapping.items():
-            cursor.execute("""
-                UPDATE categories SET icon = %s WHERE name = %s AND (icon IS NULL OR icon = '📦')
-            """, (cat_icon, cat_name))
-        
-        # Insert default categories if not exists
-        default_categories = [
-            ('Food', '#FF6B6B', '🍔'),
-            ('Transport', '#4ECDC4', '🚗'),
-            ('Shopping', '#45B7D1', '🛍️'),
-            ('Bills', '#FFA07A', '💡'),
-            ('Entertainment', '#98D8C8', '🎬'),
-            ('Health', '#F7DC6F', '⚕️'),
-            ('Education', '#BB8FCE', '📚'),
-            ('Others', '#B19CD9', '📦')
-        ]
-        
-        for cat_name, cat_color, cat_icon in default_categories:
-            cursor.execute("""
-                INSERT INTO categories (name, color, icon)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (name) DO NOTHING
-            """, (cat_name, cat_color, cat_icon))
-        conn.commit()
-        cursor.close()
-        conn.close()
-
-def add_category(name, color, icon):
-    conn = create_connection()
-    if conn:
-        cursor = conn.cursor(cursor_factory=DictCursor)
-        try:
-            cursor.execute("INSERT INTO categories (name, color, icon) VALUES (%s, %s, %s)", (name, color, icon))
-            conn.commit()
-            return True
-        except OperationalError as e:
-            st.error(f"Error: {e}")
-            return False
-        finally:
-            cursor.close()
-            conn.close()
-
-def get_categories():
-    conn = create_connection()
-    if conn:
-        cursor = conn.cursor(cursor_factory=DictCursor)
-        cursor.execute("SELECT * FROM categories ORDER BY name")
-        categories = cursor.fetchall()
-        
-        # Convert RealDictRow to plain dict
-        categories = [dict(row) for row in categories]
-        
-        cursor.close()
-        conn.close()
-        return categories
-    return []
+    # Postgres or an embedded SQLite file, as set in secrets (see storage.py)
+    store = get_storage()
 
-def add_expense(amount, category_id, note, expense_date):
-    conn = create_connection()
-    if conn:
-        cursor = conn.cursor(cursor_factory=DictCursor)
-        try:
-            cursor.execute("""
-                INSERT INTO expenses (amount, category_id, note, expense_date) 
-                VALUES (%s, %s, %s, %s)
-            """, (amount, category_id, note, expense_date))
-            conn.commit()
-            return True
-        except OperationalError as e:
-            st.error(f"Error: {e}")
-            return False
-        finally:
-            cursor.close()
-            conn.close()
+    # Apply pending schema migrations (once per process)
+    with span("ensure_schema"):
+        store.ensure_schema()
 
-def get_expenses(start_date=None, end_date=None):
-    conn = create_connection()
-    if conn:
-        cursor = conn.cursor(cursor_factory=DictCursor)
-        query = """
-            SELECT e.*, c.name as category_name, c.color, c.icon 
-            FROM expenses e 
-            LEFT JOIN categories c ON e.category_id = c.id
-        """
-        params = []
-        
-        if start_date and end_date:
-            query += " WHERE e.expense_date BETWEEN %s AND %s"
-            params = [start_date, end_date]
-        
-        query += " ORDER BY e.expense_date DESC, e.created_at DESC"
-        
-        cursor.execute(query, params)
-        expenses = cursor.fetchall()
-        
-        # ADD THIS LINE:
-        expenses = [dict(row) for row in expenses]
-        
-        cursor.close()
-        conn.close()
-        return expenses
-    return []
-def delete_expense(expense_id):
-    conn = create_connection()
-    if conn:
-        cursor = conn.cursor(cursor_factory=DictCursor)
-        cursor.execute("DELETE FROM expenses WHERE id = %s", (expense_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-
-# Initialize database
-init_database()
-
-# Sidebar
-with st.sidebar:
-    st.title("💰 Expense Tracker")
-    st.markdown("**Track. Analyze. Save.**")
-    st.markdown("---")
-    
-    menu = st.radio("📍 Navigation", ["➕ Add Expense", "📊 Analytics", "🏷️ Categories"], label_visibility="collapsed")
-    
-    st.markdown("---")
-    st.markdown("### 📅 Filter Period")
-    period = st.selectbox("Period", ["Today", "This Week", "This Month", "This Year", "All Time", "Custom"], label_visibility="collapsed")
-    
-    today = datetime.now().date()
-    
-    if period == "Today":
-        start_date = end_date = today
-    elif period == "This Week":
-        start_date = today - timedelta(days=today.weekday())
-        end_date = today
-    elif period == "This Month":
-        start_date = today.replace(day=1)
-        end_date = today
-    elif period == "This Year":
-        start_date = today.replace(month=1, day=1)
-        end_date = today
-    elif period == "Custom":
-        st.markdown("**Select Date Range**")
-        start_date = st.date_input("From", today - timedelta(days=30))
-        end_date = st.date_input("To", today)
-    else:
-        start_date = end_date = None
+    # Sidebar
+    with st.sidebar:
+        st.title("💰 Expense Tracker")
+        st.markdown("**Track. Analyze. Save.**")
+        st.markdown("---")
+    
+        menu = st.radio("📍 Navigation", ["➕ Add Expense", "📊 Analytics", "🏷️ Categories"], label_visibility="collapsed")
+    
+        st.markdown("---")
+        st.markdown("### 📅 Filter Period")
+        period = st.selectbox("Period", ["Today", "This Week", "This Month", "This Year", "All Time", "Custom"], label_visibility="collapsed")
+        annotate(page=menu, period=period)
+    
+        today = datetime.now().date()
+    
+        if period == "Today":
+            start_date = end_date = today
+        elif period == "This Week":
+            start_date = today - timedelta(days=today.weekday())
+            end_date = today
+        elif period == "This Month":
+            start_date = today.replace(day=1)
+            end_date = today
+        elif period == "This Year":
+            start_date = today.replace(month=1, day=1)
+            end_date = today
+        elif period == "Custom":
+            st.markdown("**Select Date Range**")
+            start_date = st.date_input("From", today - timedelta(days=30))
+            end_date = st.date_input("To", today)
+        else:
+            start_date = end_date = None
     
-    st.markdown("---")
-    st.markdown(f"<small style='color: #6c757d;'>📆 {datetime.now().strftime('%B %d, %Y')}</small>", unsafe_allow_html=True)
+        st.markdown("---")
+        st.markdown(f"<small style='color: #6c757d;'>📆 {datetime.now().strftime('%B %d, %Y')}</small>", unsafe_allow_html=True)
     
-    # Theme toggle button at bottom
-    st.markdown("<br><br>", unsafe_allow_html=True)
-    theme_icon = "🌙" if st.session_state.theme == 'light' else "☀️"
-    theme_text = "Dark Mode" if st.session_state.theme == 'light' else "Light Mode"
+        # Theme toggle button at bottom
+        st.markdown("<br><br>", unsafe_allow_html=True)
+        theme_icon = "🌙" if st.session_state.theme == 'light' else "☀️"
+        theme_text = "Dark Mode" if st.session_state.theme == 'light' else "Light Mode"
     
-    if st.button(f"{theme_icon} {theme_text}", use_container_width=True, key="theme_toggle"):
-        st.session_state.theme = 'dark' if st.session_state.theme == 'light' else 'light'
-        st.rerun()
+        if st.button(f"{theme_icon} {theme_text}", use_container_width=True, key="theme_toggle"):
+            st.session_state.theme = 'dark' if st.session_state.theme == 'light' else 'light'
+            st.rerun()
 
-# Main content
-if menu == "➕ Add Expense":
-    st.title("Add New Expense")
-    st.markdown("Record your spending quickly and easily")
+    # Main content
+    if menu == "➕ Add Expense":
+        st.title("Add New Expense")
+        st.markdown("Record your spending quickly and easily")
     
-    col1, col2 = st.columns([2, 1])
+        col1, col2 = st.columns([2, 1])
     
-    with col1:
-        with st.form("expense_form", clear_on_submit=True):
-            col_a, col_b = st.columns(2)
+        with col1:
+            with st.form("expense_form", clear_on_submit=True):
+                col_a, col_b = st.columns(2)
             
-            with col_a:
-                amount = st.number_input("💵 Amount (₹)", min_value=0, step=10)
+                with col_a:
+                    amount = st.number_input("💵 Amount (₹)", min_value=0, step=10)
             
-            with col_b:
-                expense_date = st.date_input("📅 Date", value=datetime.now().date())
+                with col_b:
+                    expense_date = st.date_input("📅 Date", value=datetime.now().date())
             
-            categories = get_categories()
-            category_options = {f"{cat['icon']} {cat['name']}": cat['id'] for cat in categories}
+                categories = store.get_categories()
+                category_options = {f"{cat['icon']} {cat['name']}": cat['id'] for cat in categories}
             
-            selected_category = st.selectbox("🏷️ Category", options=list(category_options.keys()))
+                selected_category = st.selectbox("🏷️ Category", options=list(category_options.keys()))
             
-            note = st.text_area("📝 Note (Optional)", placeholder="e.g., Lunch with friends at Pizza Hut", height=100)
+                note = st.text_area("📝 Note (Optional)", placeholder="e.g., Lunch with friends at Pizza Hut", height=100, max_chars=500)
             
-            submitted = st.form_submit_button("💾 Save Expense", use_container_width=True)
+                submitted = st.form_submit_button("💾 Save Expense", use_container_width=True)
             
-            if submitted:
-                if amount > 0 and selected_category:
-                    category_id = category_options[selected_category]
-                    if add_expense(amount, category_id, note, expense_date):
-                        st.success(f"✅ Expense of ₹{amount:.2f} added successfully!")
-                        st.rerun()
-                else:
-                    st.error("⚠️ Please fill in all required fields")
+                if submitted:
+                    if amount > 0 and selected_category:
+                        category_id = category_options[selected_category]
+                        if store.add_expense(amount, category_id, note, expense_date):
+                            st.success(f"✅ Expense of ₹{amount:.2f} added successfully!")
+                            st.rerun()
+                    else:
+                        st.error("⚠️ Please fill in all required fields")
+        
+            with st.expander("📥 Import from CSV"):
+                st.caption("Columns: date, amount, category, note. Rows imported before are skipped.")
+                uploaded_file = st.file_uploader("CSV file", type=["csv"], label_visibility="collapsed")
+                if uploaded_file and st.button("Import", use_container_width=True, key="import_csv"):
+                    try:
+                        with st.spinner("Importing..."):
+                            result = store.import_file(uploaded_file)
+                    except ValueError as e:
+                        st.error(f"⚠️ {e}")
+                    else:
+                        if result:
+                            st.success(f"✅ Imported {result['inserted']:,} expenses "
+                                       f"({result['duplicates']:,} duplicates, {result['rejected']:,} rejected rows skipped)")
     
-    with col2:
-        st.markdown("### 🕒 Recent Expenses")
-        recent = get_expenses()[:8]
+        with col2:
+            st.markdown("### 🕒 Recent Expenses")
+            recent = store.get_expenses(limit=8)
         
-        if recent:
-            for exp in recent:
-                st.markdown(f"""
+            if recent:
+                for exp in recent:
+                    st.markdown(f"""
                     <div class="expense-card" style="border-left-color: {exp.get('color', '#667eea')};">
                         <div style="display: flex; justify-content: space-between; align-items: center;">
                             <div>
@@ -452,333 +302,361 @@ if menu == "➕ Add Expense":
                         </div>
                     </div>
                 """, unsafe_allow_html=True)
-        else:
-            st.info("No recent expenses")
+            else:
+                st.info("No recent expenses")
 
-elif menu == "📊 Analytics":
-    st.title("Analytics Dashboard")
-    st.markdown("Detailed insights into your spending patterns")
-    
-    expenses = get_expenses(start_date, end_date) if start_date and end_date else get_expenses()
-    
-    if expenses:
-        df = pd.DataFrame(expenses)
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        df['expense_date'] = pd.to_datetime(df['expense_date'])
-        
-        # Summary metrics
-        total_amount = df['amount'].sum()
-        avg_amount = df['amount'].mean()
-        total_transactions = len(df)
-        
-        # Calculate comparison with previous period
+    elif menu == "📊 Analytics":
+        with span("import analytics modules"):
+            import pandas as pd
+            from charts import trend_figure, category_donut_figure, category_bar_figure, weekday_figure
+            from exporter import export_to_tempfile
+    
+        st.title("Analytics Dashboard")
+        st.markdown("Detailed insights into your spending patterns")
+    
+        # The page's queries are independent, so they run concurrently (see loader.py)
+        top_view = st.session_state.get("top_expenses_view", "Overall")
+        tasks = {
+            'summary': (store.get_expense_summary, start_date, end_date),
+            'trend': (store.get_spending_trend, start_date, end_date),
+            'top': (store.get_top_expenses, start_date, end_date, 5) if top_view == "Overall"
+                   else (partial(store.get_top_expenses_by_category, as_frame=True), start_date, end_date, 3),
+        }
         if start_date and end_date:
-            days_diff = (end_date - start_date).days + 1
-            prev_start = start_date - timedelta(days=days_diff)
-            prev_end = start_date - timedelta(days=1)
-            prev_expenses = get_expenses(prev_start, prev_end)
-            prev_total = sum([float(exp['amount']) for exp in prev_expenses]) if prev_expenses else 0
-            change_pct = ((total_amount - prev_total) / prev_total * 100) if prev_total > 0 else 0
-        else:
-            change_pct = 0
+            tasks['comparison'] = (store.get_period_comparison, start_date, end_date)
+        data = load_all(tasks, "load analytics data")
+        summary = data['summary']
+    
+        if summary and summary['totals']['count']:
+            # Summary metrics
+            total_amount = summary['totals']['total']
+            avg_amount = summary['totals']['average']
+            total_transactions = summary['totals']['count']
+        
+            # Calculate comparison with previous period
+            if start_date and end_date:
+                comparison = data['comparison']
+                prev_total = comparison['previous']['total'] if comparison else 0
+                change_pct = ((total_amount - prev_total) / prev_total * 100) if prev_total > 0 else 0
+            else:
+                change_pct = 0
         
-        top_category = df.groupby('category_name')['amount'].sum().idxmax()
-        top_category_amount = df.groupby('category_name')['amount'].sum().max()
+            # Already sorted by amount, largest first
+            category_data = pd.DataFrame(summary['by_category'], columns=['category_name', 'color', 'icon', 'amount'])
+            if not category_data.empty:
+                top_category = category_data['category_name'].iloc[0]
+                top_category_amount = category_data['amount'].iloc[0]
+            else:
+                top_category, top_category_amount = '-', 0
         
-        # Metric cards
-        col1, col2, col3, col4 = st.columns(4)
+            # Metric cards
+            col1, col2, col3, col4 = st.columns(4)
         
-        with col1:
-            st.metric("💰 Total Spent", f"₹{total_amount:,.2f}", 
-                     f"{change_pct:+.1f}%" if start_date and end_date else None,
-                     delta_color="inverse")
+            with col1:
+                st.metric("💰 Total Spent", f"₹{total_amount:,.2f}", 
+                         f"{change_pct:+.1f}%" if start_date and end_date else None,
+                         delta_color="inverse")
         
-        with col2:
-            st.metric("📊 Average", f"₹{avg_amount:,.2f}")
+            with col2:
+                st.metric("📊 Average", f"₹{avg_amount:,.2f}")
         
-        with col3:
-            st.metric("🔢 Transactions", f"{total_transactions:,}")
+            with col3:
+                st.metric("🔢 Transactions", f"{total_transactions:,}")
         
-        with col4:
-            st.metric("🏆 Top Category", top_category, f"₹{top_category_amount:,.0f}")
+            with col4:
+                st.metric("🏆 Top Category", top_category, f"₹{top_category_amount:,.0f}")
         
-        st.markdown("<br>", unsafe_allow_html=True)
+            st.markdown("<br>", unsafe_allow_html=True)
         
-        # Row 1: Spending Trend
-        st.subheader("📈 Spending Trend Over Time")
+            # Row 1: Spending Trend
+            st.subheader("📈 Spending Trend Over Time")
         
-        # Group by date and handle different period views
-        daily_expenses = df.groupby(df['expense_date'].dt.date)['amount'].sum().reset_index()
-        daily_expenses.columns = ['Date', 'Amount']
-        daily_expenses['Date'] = pd.to_datetime(daily_expenses['Date'])
+            # Buckets are summed in SQL at a granularity that keeps the chart
+            # under a fixed number of points, whatever the range
+            trend = data['trend']
+            if trend and trend['downsampled']:
+                st.caption(f"Showing {len(trend['points'])} representative {trend['granularity']}s of the range")
         
-        # Format x-axis based on period
-        if period == "Today":
-            x_title = 'Time'
-            daily_expenses['Display'] = daily_expenses['Date'].dt.strftime('%b %d, %Y')
-        elif period == "This Week":
-            x_title = 'Date'
-            daily_expenses['Display'] = daily_expenses['Date'].dt.strftime('%a, %b %d')
-        elif period == "This Month":
-            x_title = 'Date'
-            daily_expenses['Display'] = daily_expenses['Date'].dt.strftime('%b %d')
-        elif period == "This Year":
-            # Group by month for year view
-            daily_expenses = df.groupby(df['expense_date'].dt.to_period('M'))['amount'].sum().reset_index()
-            daily_expenses.columns = ['Date', 'Amount']
-            daily_expenses['Date'] = daily_expenses['Date'].dt.to_timestamp()
-            daily_expenses['Display'] = daily_expenses['Date'].dt.strftime('%b %Y')
-            x_title = 'Month'
-        else:
-            # Check date range to decide format
-            date_range = (daily_expenses['Date'].max() - daily_expenses['Date'].min()).days
-            if date_range <= 7:
-                daily_expenses['Display'] = daily_expenses['Date'].dt.strftime('%a, %b %d')
-                x_title = 'Date'
-            elif date_range <= 60:
-                daily_expenses['Display'] = daily_expenses['Date'].dt.strftime('%b %d')
-                x_title = 'Date'
-            else:
-                # Group by month for long ranges
-                daily_expenses = df.groupby(df['expense_date'].dt.to_period('M'))['amount'].sum().reset_index()
-                daily_expenses.columns = ['Date', 'Amount']
-                daily_expenses['Date'] = daily_expenses['Date'].dt.to_timestamp()
-                daily_expenses['Display'] = daily_expenses['Date'].dt.strftime('%b %Y')
-                x_title = 'Month'
-        
-        # Create area chart
-        fig_trend = go.Figure()
-        fig_trend.add_trace(go.Scatter(
-            x=daily_expenses['Display'],
-            y=daily_expenses['Amount'],
-            mode='lines+markers',
-            name='Daily Spending',
-            line=dict(color='#667eea', width=3),
-            marker=dict(size=8, color='#667eea'),
-            fill='tozeroy',
-            fillcolor='rgba(102, 126, 234, 0.15)',
-            hovertemplate='<b>%{x}</b><br>₹%{y:,.2f}<extra></extra>'
-        ))
-        
-        # Add moving average only if enough data points
-        if len(daily_expenses) > 3:
-            daily_expenses['MA'] = daily_expenses['Amount'].rolling(window=3, min_periods=1).mean()
-            fig_trend.add_trace(go.Scatter(
-                x=daily_expenses['Display'],
-                y=daily_expenses['MA'],
-                mode='lines',
-                name='3-Period Average',
-                line=dict(color='#FF6B6B', width=2, dash='dash'),
-                hovertemplate='<b>%{x}</b><br>Avg: ₹%{y:,.2f}<extra></extra>'
-            ))
-        
-        fig_trend.update_layout(
-            plot_bgcolor='rgba(0,0,0,0)',
-            paper_bgcolor='rgba(0,0,0,0)',
-            xaxis=dict(
-                showgrid=True, 
-                gridcolor='#e9ecef' if st.session_state.theme == 'light' else '#404040',
-                title=x_title,
-                color=text_color,
-                tickangle=-45 if len(daily_expenses) > 10 else 0
-            ),
-            yaxis=dict(
-                showgrid=True, 
-                gridcolor='#e9ecef' if st.session_state.theme == 'light' else '#404040',
-                title='Amount (₹)',
-                color=text_color
-            ),
-            hovermode='x unified',
-            font=dict(family='Inter', size=12, color=text_color),
-            height=400,
-            margin=dict(l=20, r=20, t=20, b=80),
-            showlegend=True,
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1,
-                font=dict(color=text_color)
-            )
-        )
-        st.plotly_chart(fig_trend, use_container_width=True)
+            # Figures are cached per period and theme until the data changes
+            with span("plotly_chart", chart="trend"):
+                st.plotly_chart(trend_figure(start_date, end_date, st.session_state.theme), use_container_width=True)
         
-        # Row 2: Category Analysis
-        col1, col2 = st.columns(2)
+            # Row 2: Category Analysis
+            col1, col2 = st.columns(2)
         
-        with col1:
-            st.subheader("🎯 Spending by Category")
+            with col1:
+                st.subheader("🎯 Spending by Category")
             
-            category_data = df.groupby(['category_name', 'color', 'icon'])['amount'].sum().reset_index()
-            category_data = category_data.sort_values('amount', ascending=False)
+                with span("plotly_chart", chart="donut"):
+                    st.plotly_chart(category_donut_figure(start_date, end_date, st.session_state.theme), use_container_width=True)
+        
+            with col2:
+                st.subheader("📊 Category Breakdown")
             
-            # Donut chart
-            fig_donut = go.Figure(data=[go.Pie(
-                labels=category_data['category_name'],
-                values=category_data['amount'],
-                hole=0.5,
-                marker=dict(colors=category_data['color']),
-                textposition='inside',
-                textinfo='percent',
-                hovertemplate='<b>%{label}</b><br>₹%{value:,.2f}<br>%{percent}<extra></extra>'
-            )])
+                with span("plotly_chart", chart="category bar"):
+                    st.plotly_chart(category_bar_figure(start_date, end_date, st.session_state.theme), use_container_width=True)
+        
+            # Row 3: Additional insights
+            col1, col2 = st.columns(2)
+        
+            with col1:
+                st.subheader("📅 Day of Week Analysis")
             
-            fig_donut.update_layout(
-                showlegend=True,
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                font=dict(family='Inter', size=12, color=text_color),
-                height=350,
-                margin=dict(l=20, r=20, t=20, b=20),
-                legend=dict(font=dict(color=text_color))
-            )
-            st.plotly_chart(fig_donut, use_container_width=True)
+                with span("plotly_chart", chart="weekday"):
+                    st.plotly_chart(weekday_figure(start_date, end_date, st.session_state.theme), use_container_width=True)
         
-        with col2:
-            st.subheader("📊 Category Breakdown")
+            with col2:
+                st.subheader("💳 Top 5 Expenses")
             
-            # Horizontal bar chart
-            fig_bar = go.Figure(go.Bar(
-                y=category_data['category_name'],
-                x=category_data['amount'],
-                orientation='h',
-                marker=dict(color=category_data['color']),
-                text=category_data['amount'].apply(lambda x: f'₹{x:,.0f}'),
-                textposition='outside',
-                hovertemplate='<b>%{y}</b><br>₹%{x:,.2f}<extra></extra>'
-            ))
+                top_view = st.radio("Top expenses", ["Overall", "By category"], horizontal=True,
+                                    label_visibility="collapsed", key="top_expenses_view")
             
-            fig_bar.update_layout(
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                xaxis=dict(showgrid=True, gridcolor='#e9ecef' if st.session_state.theme == 'light' else '#404040', title='Amount (₹)', color=text_color),
-                yaxis=dict(showgrid=False, title='', color=text_color),
-                font=dict(family='Inter', size=12, color=text_color),
-                height=350,
-                margin=dict(l=20, r=20, t=20, b=20)
-            )
-            st.plotly_chart(fig_bar, use_container_width=True)
-        
-        # Row 3: Additional insights
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.subheader("📅 Day of Week Analysis")
+                if top_view == "Overall":
+                    for exp in data['top']:
+                        note_text = exp['note'][:40] if exp['note'] else 'No note'
+                        st.markdown(f"""
+                        <div class="expense-card" style="border-left-color: {exp['color']};">
+                            <div style="display: flex; justify-content: space-between; align-items: center;">
+                                <div style="flex: 1;">
+                                    <div style="font-size: 15px; font-weight: 600; color: {text_color};">{exp['category_name']}</div>
+                                    <div style="font-size: 13px; color: {text_secondary}; margin-top: 2px;">{note_text}</div>
+                                    <div style="font-size: 12px; color: {text_secondary}; margin-top: 2px;">{exp['expense_date'].strftime('%b %d, %Y')}</div>
+                                </div>
+                                <div style="font-size: 20px; font-weight: 700; color: {exp['color']};">₹{exp['amount']:,.0f}</div>
+                            </div>
+                        </div>
+                    """, unsafe_allow_html=True)
+                else:
+                    # Typed by the fetch; only the label column is built here
+                    top_df = pd.DataFrame(data['top'], columns=['category_name', 'amount', 'expense_date', 'note'])
+                    top_df['category_name'] = data['top']['icon'].astype(str) + " " + top_df['category_name'].astype(str)
+                    st.dataframe(
+                        top_df, use_container_width=True, hide_index=True, height=360,
+                        column_config={
+                            'category_name': st.column_config.TextColumn("Category"),
+                            'amount': st.column_config.NumberColumn("Amount (₹)", format="₹%,.2f"),
+                            'expense_date': st.column_config.DateColumn("Date", format="MMM DD, YYYY"),
+                            'note': st.column_config.TextColumn("Note"),
+                        }
+                    )
+        
+            # Note search, ranked in the database and scoped to the period
+            st.markdown("<br>", unsafe_allow_html=True)
+            st.subheader("🔎 Search Notes")
+            search_text = st.text_input("Search notes", placeholder="e.g. pizza hut", key="note_search",
+                                        label_visibility="collapsed").strip()
+            if search_text:
+                search_page_size = 20
+                search_key = (search_text, start_date, end_date)
+                if st.session_state.get('note_search_key') != search_key:
+                    st.session_state.note_search_key = search_key
+                    st.session_state.note_search_page = 0
+                search_page = st.session_state.note_search_page
             
-            df['day_of_week'] = df['expense_date'].dt.day_name()
-            day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-            dow_expenses = df.groupby('day_of_week')['amount'].sum().reindex(day_order, fill_value=0)
+                results = store.search_notes(search_text, start_date, end_date, limit=search_page_size + 1,
+                                       offset=search_page * search_page_size, as_frame=True)
+                has_more = len(results) > search_page_size
+                results = results[:search_page_size]
             
-            fig_dow = go.Figure(go.Bar(
-                x=dow_expenses.index,
-                y=dow_expenses.values,
-                marker=dict(
-                    color=dow_expenses.values,
-                    colorscale='Purples',
-                    showscale=False
-                ),
-                text=[f'₹{val:.0f}' for val in dow_expenses.values],
-                textposition='outside',
-                hovertemplate='<b>%{x}</b><br>₹%{y:,.2f}<extra></extra>'
-            ))
+                if len(results):
+                    results_df = pd.DataFrame(results, columns=['expense_date', 'category_name', 'amount', 'note'])
+                    st.dataframe(
+                        results_df, use_container_width=True, hide_index=True,
+                        column_config={
+                            'expense_date': st.column_config.DateColumn("Date", format="MMM DD, YYYY"),
+                            'category_name': st.column_config.TextColumn("Category"),
+                            'amount': st.column_config.NumberColumn("Amount (₹)", format="₹%,.2f"),
+                            'note': st.column_config.TextColumn("Note"),
+                        }
+                    )
+                else:
+                    st.info(f"No notes match “{search_text}” in this period")
             
-            fig_dow.update_layout(
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                xaxis=dict(showgrid=False, title='', color=text_color),
-                yaxis=dict(showgrid=True, gridcolor='#e9ecef' if st.session_state.theme == 'light' else '#404040', title='Amount (₹)', color=text_color),
-                font=dict(family='Inter', size=12, color=text_color),
-                height=300,
-                margin=dict(l=20, r=20, t=20, b=20)
+                if search_page or has_more:
+                    col1, col2, col3 = st.columns([1, 2, 1])
+                    with col1:
+                        if st.button("⬅️ Previous", disabled=search_page == 0, use_container_width=True, key="note_search_previous"):
+                            st.session_state.note_search_page -= 1
+                            st.rerun()
+                    with col2:
+                        st.markdown(f"<div style='text-align: center; color: {text_secondary};'>Page {search_page + 1}</div>", unsafe_allow_html=True)
+                    with col3:
+                        if st.button("Next ➡️", disabled=not has_more, use_container_width=True, key="note_search_next"):
+                            st.session_state.note_search_page += 1
+                            st.rerun()
+        
+            # Expense table
+            st.markdown("<br>", unsafe_allow_html=True)
+            st.subheader("📋 All Transactions")
+        
+            # Sorting and filtering happen in SQL, so only the visible page is fetched
+            sort_labels = {'newest': 'Newest first', 'oldest': 'Oldest first',
+                           'largest': 'Largest amount', 'smallest': 'Smallest amount'}
+            filter_categories = store.get_categories()
+            col1, col2 = st.columns(2)
+            with col1:
+                sort_order = st.selectbox("Sort by", options=list(sort_labels), format_func=sort_labels.get,
+                                          key="transactions_sort")
+            with col2:
+                category_filter = st.selectbox("Category", options=[None] + [cat['id'] for cat in filter_categories],
+                                               format_func=lambda cat_id: "All categories" if cat_id is None else
+                                               next(f"{cat['icon']} {cat['name']}" for cat in filter_categories if cat['id'] == cat_id),
+                                               key="transactions_category")
+        
+            # Keyset pagination: remember the cursor of every page visited so far,
+            # starting over whenever the period, sort or filter changes
+            page_size = 50
+            page_key = (start_date, end_date, sort_order, category_filter)
+            if st.session_state.get('transactions_period') != page_key:
+                st.session_state.transactions_period = page_key
+                st.session_state.transactions_cursors = [None]
+            cursors = st.session_state.transactions_cursors
+        
+            page = store.get_expenses(start_date, end_date, limit=page_size + 1, after=cursors[-1],
+                                order=sort_order, category_id=category_filter, as_frame=True)
+            has_next = len(page) > page_size
+            page = page[:page_size]
+        
+            # Typed by the fetch; the grid formats dates and amounts in the browser
+            display_df = pd.DataFrame(page, columns=['expense_date', 'category_name', 'amount', 'note'])
+            display_df['note'] = display_df['note'].fillna('-')
+        
+            st.dataframe(
+                display_df, use_container_width=True, hide_index=True, height=300,
+                column_config={
+                    'expense_date': st.column_config.DateColumn("Date", format="MMM DD, YYYY"),
+                    'category_name': st.column_config.TextColumn("Category"),
+                    'amount': st.column_config.NumberColumn("Amount (₹)", format="₹%,.2f"),
+                    'note': st.column_config.TextColumn("Note"),
+                }
             )
-            st.plotly_chart(fig_dow, use_container_width=True)
         
-        with col2:
-            st.subheader("💳 Top 5 Expenses")
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col1:
+                if st.button("⬅️ Previous", disabled=len(cursors) == 1, use_container_width=True, key="transactions_newer"):
+                    cursors.pop()
+                    st.rerun()
+            with col2:
+                st.markdown(f"<div style='text-align: center; color: {text_secondary};'>Page {len(cursors)}</div>", unsafe_allow_html=True)
+            with col3:
+                if st.button("Next ➡️", disabled=not has_next, use_container_width=True, key="transactions_older"):
+                    cursors.append(expense_cursor(page.iloc[-1], sort_order))
+                    st.rerun()
+        
+            # Exports stream from the database on a separate thread when clicked,
+            # but download_button then holds the whole file in memory, so large
+            # ones are left to the command line
+            export_name = f"expenses_{start_date}_{end_date}" if start_date and end_date else "expenses_all_time"
+            export_max_rows = int(st.secrets.get("export_max_rows", 200_000))
+            if total_transactions > export_max_rows:
+                period_args = f" --start {start_date} --end {end_date}" if start_date and end_date else ""
+                st.caption(f"Exports of more than {export_max_rows:,} expenses run from the command line: "
+                           f"`python exporter.py {export_name}.parquet{period_args}`")
+            else:
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.download_button("⬇️ Export CSV", data=lambda: export_to_tempfile(start_date, end_date, 'csv'),
+                                       file_name=f"{export_name}.csv", mime="text/csv", use_container_width=True)
+                with col2:
+                    st.download_button("⬇️ Export Parquet", data=lambda: export_to_tempfile(start_date, end_date, 'parquet'),
+                                       file_name=f"{export_name}.parquet", mime="application/vnd.apache.parquet",
+                                       use_container_width=True)
+        
+            # Deleting: the lookup runs in SQL and only the first matches become options
+            st.markdown("<br>", unsafe_allow_html=True)
+            with st.expander("🗑️ Delete expenses"):
+                search_limit = 100
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    search_note = st.text_input("Note contains", key="delete_note")
+                with col2:
+                    search_amount = st.number_input("Amount (₹)", min_value=0.0, value=None, step=10.0, key="delete_amount")
+                with col3:
+                    search_date = st.date_input("Date", value=None, key="delete_date")
+                with col4:
+                    search_category = st.selectbox("Category", options=[None] + [cat['id'] for cat in filter_categories],
+                                                   format_func=lambda cat_id: "All categories" if cat_id is None else
+                                                   next(f"{cat['icon']} {cat['name']}" for cat in filter_categories if cat['id'] == cat_id),
+                                                   key="delete_category")
             
-            top_expenses = df.nlargest(5, 'amount')[['expense_date', 'category_name', 'amount', 'note', 'color']]
+                search_start, search_end = (search_date, search_date) if search_date else (start_date, end_date)
+                matches = store.get_expenses(search_start, search_end, limit=search_limit + 1, category_id=search_category,
+                                       amount=search_amount, note=search_note.strip() or None)
+                if len(matches) > search_limit:
+                    st.caption(f"Showing the newest {search_limit} matches, narrow the search to find older ones")
+                    matches = matches[:search_limit]
+                labels = {exp['id']: f"₹{exp['amount']:,.2f} - {exp['category_name']} - {exp['expense_date']:%Y-%m-%d}"
+                          + (f" - {exp['note'][:40]}" if exp['note'] else '')
+                          for exp in matches}
             
-            for idx, exp in top_expenses.iterrows():
-                note_text = exp['note'][:40] if pd.notna(exp['note']) and exp['note'] else 'No note'
-                st.markdown(f"""
-                    <div class="expense-card" style="border-left-color: {exp['color']};">
-                        <div style="display: flex; justify-content: space-between; align-items: center;">
-                            <div style="flex: 1;">
-                                <div style="font-size: 15px; font-weight: 600; color: {text_color};">{exp['category_name']}</div>
-                                <div style="font-size: 13px; color: {text_secondary}; margin-top: 2px;">{note_text}</div>
-                                <div style="font-size: 12px; color: {text_secondary}; margin-top: 2px;">{exp['expense_date'].strftime('%b %d, %Y')}</div>
-                            </div>
-                            <div style="font-size: 20px; font-weight: 700; color: {exp['color']};">₹{exp['amount']:,.0f}</div>
-                        </div>
-                    </div>
-                """, unsafe_allow_html=True)
-        
-        # Expense table
-        st.markdown("<br>", unsafe_allow_html=True)
-        st.subheader("📋 All Transactions")
-        
-        display_df = df[['expense_date', 'category_name', 'amount', 'note']].copy()
-        display_df.columns = ['Date', 'Category', 'Amount (₹)', 'Note']
-        display_df['Date'] = display_df['Date'].dt.strftime('%b %d, %Y')
-        display_df['Amount (₹)'] = display_df['Amount (₹)'].apply(lambda x: f"₹{x:,.2f}")
-        display_df['Note'] = display_df['Note'].fillna('-')
-        
-        st.dataframe(display_df, use_container_width=True, hide_index=True, height=300)
-        
-        st.markdown("<br>", unsafe_allow_html=True)
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            expense_to_delete = st.selectbox("Select expense to delete", 
-                                            options=[(exp['id'], f"₹{exp['amount']:.2f} - {exp['category_name']} - {exp['expense_date']}") 
-                                                    for exp in expenses],
-                                            format_func=lambda x: x[1])
-        
-        with col2:
-            if st.button("🗑️ Delete", type="secondary", use_container_width=True):
-                delete_expense(expense_to_delete[0])
-                st.success("Deleted!")
-                st.rerun()
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    select_all = st.checkbox(f"All {len(labels):,} matches", key="delete_select_all")
+                    selected_ids = list(labels) if select_all else st.multiselect(
+                        "Expenses to delete", options=list(labels), format_func=labels.get, key="delete_selection"
+                    )
+                with col2:
+                    delete_clicked = st.button("🗑️ Delete", type="secondary", disabled=not selected_ids,
+                                               use_container_width=True, key="delete_selected")
+                if delete_clicked:
+                    deleted = store.delete_expenses(selected_ids)
+                    if deleted:
+                        st.session_state.last_deleted = {'ids': selected_ids, 'at': datetime.now()}
+                    st.session_state.pop('delete_selection', None)
+                    st.session_state.pop('delete_select_all', None)
+                    st.rerun()
+        
+            st.markdown("</div>", unsafe_allow_html=True)
         
-        st.markdown("</div>", unsafe_allow_html=True)
-        
-    else:
-        st.info("📊 No expenses found for the selected period. Start adding expenses to see analytics!")
+        else:
+            st.info("📊 No expenses found for the selected period. Start adding expenses to see analytics!")
+    
+        # Outside the branch above, so a delete that empties the period can still be undone
+        last_deleted = st.session_state.get('last_deleted')
+        if last_deleted and datetime.now() - last_deleted['at'] < UNDO_WINDOW:
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.info(f"Deleted {len(last_deleted['ids']):,} expense(s)")
+            with col2:
+                if st.button("↩️ Undo", use_container_width=True, key="undo_delete"):
+                    store.restore_expenses(last_deleted['ids'])
+                    del st.session_state.last_deleted
+                    st.rerun()
 
-elif menu == "🏷️ Categories":
-    st.title("Manage Categories")
-    st.markdown("Customize your expense categories")
+    elif menu == "🏷️ Categories":
+        st.title("Manage Categories")
+        st.markdown("Customize your expense categories")
     
-    col1, col2 = st.columns([1, 2])
+        col1, col2 = st.columns([1, 2])
     
-    with col1:
-        st.subheader("➕ Add New Category")
-        with st.form("category_form", clear_on_submit=True):
-            cat_name = st.text_input("Category Name", placeholder="e.g., Groceries")
+        with col1:
+            st.subheader("➕ Add New Category")
+            with st.form("category_form", clear_on_submit=True):
+                cat_name = st.text_input("Category Name", placeholder="e.g., Groceries")
             
-            col_a, col_b = st.columns(2)
-            with col_a:
-                cat_color = st.color_picker("Color", "#667eea")
-            with col_b:
-                cat_icon = st.text_input("Emoji", "📦", max_chars=2)
+                col_a, col_b = st.columns(2)
+                with col_a:
+                    cat_color = st.color_picker("Color", "#667eea")
+                with col_b:
+                    cat_icon = st.text_input("Emoji", "📦", max_chars=2)
             
-            if st.form_submit_button("Add Category", use_container_width=True):
-                if cat_name:
-                    if add_category(cat_name, cat_color, cat_icon):
-                        st.success(f"✅ Category '{cat_name}' added!")
-                        st.rerun()
-                else:
-                    st.error("Please enter a category name")
+                if st.form_submit_button("Add Category", use_container_width=True):
+                    if cat_name:
+                        if store.add_category(cat_name, cat_color, cat_icon):
+                            st.success(f"✅ Category '{cat_name}' added!")
+                            st.rerun()
+                    else:
+                        st.error("Please enter a category name")
     
-    with col2:
-        st.subheader("📚 Existing Categories")
-        categories = get_categories()
-        
-        # Grid layout for categories
-        cols = st.columns(3)
-        for idx, cat in enumerate(categories):
-            with cols[idx % 3]:
-                st.markdown(f"""
+        with col2:
+            st.subheader("📚 Existing Categories")
+            categories = store.get_categories()
+        
+            # Grid layout for categories
+            cols = st.columns(3)
+            for idx, cat in enumerate(categories):
+                with cols[idx % 3]:
+                    st.markdown(f"""
                     <div style="background: {card_bg}; padding: 20px; border-radius: 12px; 
                                 box-shadow: 0 2px 8px rgba(0,0,0,0.08); border: 1px solid {border_color};
                                 text-align: center; border-top: 4px solid {cat['color']}; margin-bottom: 16px;">
@@ -786,4 +664,27 @@ elif menu == "🏷️ Categories":
                         <div style="font-size: 16px; font-weight: 600; color: {text_color}; margin-bottom: 4px;">{cat['name']}</div>
                         <div style="width: 40px; height: 4px; background: {cat['color']}; margin: 8px auto; border-radius: 2px;"></div>
                     </div>
-                """, unsafe_allow_html=True)
\ No newline at end of file
+                """, unsafe_allow_html=True)
+
+    # Last, so the page is already on screen: load the Analytics dependencies
+    # in the background while the user is busy with it
+    if st.secrets.get("prewarm_analytics", True):
+        start_prewarm()
+finally:
+    # Also when st.rerun() raises out of the script, so every rerun is recorded
+    metrics = finish_rerun(st.secrets.get("metrics_file"))
+if debug_panel and metrics:
+    totals = metrics.summary()
+    with st.sidebar.expander("🛠️ Rerun performance", expanded=True):
+        st.caption(f"{totals['ms']:,.0f} ms · {totals['queries']} queries in {totals['query_ms']:,.0f} ms · "
+                   f"{totals['rows']:,} rows · {totals['bytes'] / 1024:,.1f} KiB")
+        st.dataframe(
+            [{'span': "· " * s['depth'] + s['name'] + (f" ({s['chart']})" if 'chart' in s else ''),
+              'ms': s.get('ms'), 'cache': s.get('cache', '')} for s in metrics.spans],
+            hide_index=True, use_container_width=True
+        )
+        st.dataframe(
+            [{'span': q['span'], 'ms': q['ms'], 'rows': q['rows'], 'bytes': q['bytes'], 'sql': q['sql']}
+             for q in metrics.queries],
+            hide_index=True, use_container_width=True
+        )
@@ -0,0 +1,81 @@
+"""Time bucketing for the spending trend chart.
+
+The chart has a fixed point budget. choose_granularity() picks the finest of
+day / week / month / quarter whose bucket count fits the budget for the
+selected range; the buckets themselves are summed in SQL (db.trend_query).
+Ranges too long even for quarters are thinned with LTTB
+(Largest-Triangle-Three-Buckets), which keeps the peaks and troughs that
+plain every-nth sampling would drop.
+"""
+from datetime import timedelta
+
+GRANULARITIES = ('day', 'week', 'month', 'quarter')
+
+
+def bucket_count(start_date, end_date, granularity):
+    """Number of date_trunc(granularity) buckets touched by [start_date, end_date]."""
+    if granularity == 'day':
+        return (end_date - start_date).days + 1
+    if granularity == 'week':
+        monday = start_date - timedelta(days=start_date.weekday())
+        return (end_date - monday).days // 7 + 1
+    months = (end_date.year - start_date.year) * 12 + end_date.month - start_date.month
+    if granularity == 'month':
+        return months + 1
+    if granularity == 'quarter':
+        return (end_date.year - start_date.year) * 4 + (end_date.month - 1) // 3 - (start_date.month - 1) // 3 + 1
+    raise ValueError(f"Unknown granularity {granularity!r}, expected one of {', '.join(GRANULARITIES)}")
+
+
+def bucket_start(day, granularity):
+    """date_trunc(granularity, day) for a datetime.date."""
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'quarter':
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    raise ValueError(f"Unknown granularity {granularity!r}, expected one of {', '.join(GRANULARITIES)}")
+
+
+def choose_granularity(start_date, end_date, max_points):
+    """Finest granularity that fits max_points buckets, else the coarsest."""
+    for granularity in GRANULARITIES:
+        if bucket_count(start_date, end_date, granularity) <= max_points:
+            return granularity
+    return GRANULARITIES[-1]
+
+
+def lttb(x, y, threshold):
+    """Indices of the threshold points LTTB keeps from the series (x, y).
+
+    x must be increasing. The first and last points are always kept.
+    """
+    # Only long ranges get here; keep numpy off the import path of db.py
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Interior points are split into threshold - 2 buckets; from each bucket
+    # keep the point forming the largest triangle with the previously kept
+    # point and the average of the next bucket
+    every = (n - 2) / (threshold - 2)
+    kept = np.empty(threshold, dtype=int)
+    kept[0] = a = 0
+    for i in range(threshold - 2):
+        lo = int(i * every) + 1
+        hi = int((i + 1) * every) + 1
+        next_lo, next_hi = hi, min(int((i + 2) * every) + 1, n)
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        kept[i + 1] = a
+    kept[-1] = n - 1
+    return kept